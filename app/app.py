@@ -1,150 +1,417 @@
 import os
-import pathlib
-import numpy as np
+import threading
 import datetime as dt
 import dash
-import ast
+import flask
 from dash import dcc
 from dash import html
-import yaml
-import pandas as pd
-from datetime import timedelta
 from dash.exceptions import PreventUpdate
-from dash.dependencies import Input, Output, State
-from scipy.stats import rayleigh
-from db.api_db import MLOPs_DB_Connect
-from db.utils import read_yaml_file
+from dash.dependencies import Input, Output, State, MATCH
+from db.metrics import REGISTRY as metrics
+from figures import app_color, bar_figure, category_figure, figure_update, metric_figure
 
+# The database connection (and with it pandas, SQLAlchemy and boto3) is
+# set up on first use, after gunicorn has forked its workers
 config_path = "mlopsDB_config.yaml"
-db_config = read_yaml_file(config_path)
-mlops_db = MLOPs_DB_Connect(**db_config)
+_mlops_db = None
+_mlops_db_lock = threading.Lock()
+
+
+def get_db():
+    """ The MLOPs_DB_Connect of this process, created on first call. """
+
+    global _mlops_db
+    if _mlops_db is None:
+        with _mlops_db_lock:
+            if _mlops_db is None:
+                from db.api_db import MLOPs_DB_Connect
+                from db.utils import read_yaml_file
+
+                _mlops_db = MLOPs_DB_Connect(**read_yaml_file(config_path))
+    return _mlops_db
+
 
 GRAPH_INTERVAL = os.environ.get("GRAPH_INTERVAL", 5000)
 
+# With LIVE_UPDATES=push the panels refresh when the database announces a
+# change (postgres LISTEN/NOTIFY), and polling only runs as a slow fallback
+LIVE_UPDATES = os.environ.get("LIVE_UPDATES", "poll")
+PUSH_FALLBACK_INTERVAL = os.environ.get("PUSH_FALLBACK_INTERVAL", 60000)
+# Each open event stream holds a server thread (see the Procfile), past this
+# many per worker new streams are turned away and those clients poll instead
+MAX_EVENT_STREAMS = int(os.environ.get("MAX_EVENT_STREAMS", 8))
+_event_streams = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+
+def push_enabled():
+    """ Whether the panels are refreshed by database notifications. """
+
+    return LIVE_UPDATES == "push" and get_db().dialect_name == "postgresql"
+
+
+# Pipelines and metrics to plot, see pipelines.yaml. All their panels share
+# one grouped query per refresh
+PIPELINES_CONFIG = os.environ.get("PIPELINES_CONFIG", "pipelines.yaml")
+_registry = None
+
+
+def get_registry():
+    """ The pipeline registry, loaded on first call. """
+
+    global _registry
+    if _registry is None:
+        from registry import PipelineRegistry
+
+        _registry = PipelineRegistry.load(PIPELINES_CONFIG)
+    return _registry
+
+# Time ranges of the selector, in days back from today ("all" and "custom" aside)
+TIME_RANGES = [
+    ("Last 7 days", "7"),
+    ("Last 30 days", "30"),
+    ("Last 90 days", "90"),
+    ("Custom", "custom"),
+    ("All history", "all"),
+]
+# Most bars a panel plots, about one per horizontal pixel. Longer ranges
+# are downsampled on the server, keeping every bucket's lowest and highest day
+WIDE_PANEL_BARS = int(os.environ.get("WIDE_PANEL_BARS", 800))
+NARROW_PANEL_BARS = int(os.environ.get("NARROW_PANEL_BARS", 400))
+
+# The layout is built per request from the pipeline registry. Without
+# suppress_callback_exceptions dash would also build it at import to validate
+# the callbacks, loading pipelines.yaml before the workers fork
 app = dash.Dash(
     __name__,
     meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}],
+    suppress_callback_exceptions=True,
 )
 app.title = "Wind Speed Dashboard"
 
 server = app.server
 
-app_color = {"graph_bg": "#082255", "graph_line": "#007ACE"}
 
-app.layout = html.Div(
-    [
-        # header
-        html.Div(
-            [
-                html.Div(
-                    [
-                        html.H4("MONITORING PANEL", className="app__header__title"),
-                        html.P(
-                            "Displays metrics related to all the important deployed machine learning pipelines.",
-                            className="app__header__title--grey",
-                        ),
-                    ],
-                    className="app__header__desc",
+def metric_panel(pipeline, panel, class_name):
+    """ Graph of one metric of a pipeline, rendered by gen_metric_panel. """
+
+    panel_id = {"pipeline": pipeline["name"], "metric": panel["metric"]}
+    return html.Div(
+        [
+            html.Div(
+                [
+                    html.H6(
+                        "{} ({})".format(panel["title"], pipeline["title"]),
+                        className="graph__title",
+                    )
+                ]
+            ),
+            dcc.Graph(
+                id=dict(panel_id, type="metric-graph"),
+                figure=dict(
+                    layout=dict(
+                        plot_bgcolor=app_color["graph_bg"],
+                        paper_bgcolor=app_color["graph_bg"],
+                    )
                 ),
-                html.Div(
-                    [
+            ),
+            # bars the client already has, see figures.figure_update
+            dcc.Store(id=dict(panel_id, type="metric-state")),
+        ],
+        className=class_name,
+    )
+
+
+def pipeline_section(pipeline):
+    """
+    Row of panels of a pipeline: the wide panels on the left, the others
+    stacked in a column on their right (or side by side without wide ones).
+    """
+
+    wide = [panel for panel in pipeline["panels"] if panel["wide"]]
+    narrow = [panel for panel in pipeline["panels"] if not panel["wide"]]
+    if not wide:
+        columns = [
+            metric_panel(pipeline, panel, "one-third column graph__container")
+            for panel in narrow
+        ]
+    else:
+        columns = [
+            metric_panel(pipeline, panel, "two-thirds column wind__speed__container")
+            for panel in wide
+        ]
+        if narrow:
+            stacked = [
+                metric_panel(
+                    pipeline,
+                    panel,
+                    "graph__container " + ("first" if i < len(narrow) - 1 else "second"),
+                )
+                for i, panel in enumerate(narrow)
+            ]
+            columns.append(html.Div(stacked, className="one-third column histogram__direction"))
+    return html.Div(columns, className="app__content")
+
+
+def serve_layout():
+    """ Page layout, built per page load so importing the app stays cheap. """
+
+    return html.Div(
+        [
+            # header
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.H4("MONITORING PANEL", className="app__header__title"),
+                            html.P(
+                                "Displays metrics related to all the important deployed machine learning pipelines.",
+                                className="app__header__title--grey",
+                            ),
+                        ],
+                        className="app__header__desc",
+                    ),
+                    html.Div(
+                        [
                         
                         
-                        html.A(
-                            html.Img(
-                                src=app.get_asset_url("cp_logo.ico"),
-                                className="app__menu__img",
+                            html.A(
+                                html.Img(
+                                    src=app.get_asset_url("cp_logo.ico"),
+                                    className="app__menu__img",
+                                ),
+                                href="https://class-proxima.com",
                             ),
-                            href="https://class-proxima.com",
-                        ),
-                    ],
-                    className="app__header__logo",
-                ),
-            ],
-            className="app__header",
-        ),
-        html.Div(
-            [
-                # wind speed
-                html.Div(
-                    [
-                        html.Div(
-                            [html.H6("RUN DURATION (MOMENTS PIPELINE)", className="graph__title")]
-                        ),
-                        dcc.Graph(
-                            id="wind-speed",
-                            figure=dict(
-                                layout=dict(
-                                    plot_bgcolor=app_color["graph_bg"],
-                                    paper_bgcolor=app_color["graph_bg"],
-                                )
+                        ],
+                        className="app__header__logo",
+                    ),
+                ],
+                className="app__header",
+            ),
+            # time range of every panel
+            html.Div(
+                [
+                    dcc.RadioItems(
+                        id="time-range",
+                        options=[{"label": label, "value": value} for label, value in TIME_RANGES],
+                        value="all",
+                        className="time__range",
+                        labelClassName="time__range__label",
+                    ),
+                    dcc.DatePickerRange(
+                        id="custom-range",
+                        display_format="YYYY-MM-DD",
+                        disabled=True,
+                        clearable=True,
+                    ),
+                    # {"since", "until"} of the selected range, None for no bound
+                    dcc.Store(id="time-window", data={"since": None, "until": None}),
+                    dcc.Interval(
+                        id="data-update",
+                        interval=int(PUSH_FALLBACK_INTERVAL if push_enabled() else GRAPH_INTERVAL),
+                        n_intervals=0,
+                    ),
+                    # clicked by assets/live-updates.js on every data change
+                    html.Button(id="data-changed", n_clicks=0, style={"display": "none"}),
+                    # fingerprint of the plotted data, the panels refresh when it changes
+                    dcc.Store(id="data-version"),
+                ],
+                className="app__controls",
+            ),
+            # one row of panels per pipeline of the registry
+            *[pipeline_section(pipeline) for pipeline in get_registry().pipelines],
+            # prediction-level panels, read from the prediction aggregates
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.Div(
+                                [html.H6("DETECTIONS PER DAY", className="graph__title")]
                             ),
-                        ),
-                        dcc.Interval(
-                            id="wind-speed-update",
-                            interval=int(GRAPH_INTERVAL),
-                            n_intervals=0,
-                        ),
-                    ],
-                    className="two-thirds column wind__speed__container",
-                ),
-                html.Div(
-                    [
-                        # histogram
-                        html.Div(
-                            [
-                                html.Div(
-                                    [
-                                        html.H6(
-                                            "FEED COUNT (MOMENTS)",
-                                            className="graph__title",
-                                        )
-                                    ]
+                            dcc.Graph(
+                                id="detections-per-day",
+                                figure=dict(
+                                    layout=dict(
+                                        plot_bgcolor=app_color["graph_bg"],
+                                        paper_bgcolor=app_color["graph_bg"],
+                                    )
                                 ),
-                                
-                                dcc.Graph(
-                                    id="wind-histogram",
-                                    figure=dict(
-                                        layout=dict(
-                                            plot_bgcolor=app_color["graph_bg"],
-                                            paper_bgcolor=app_color["graph_bg"],
-                                        )
-                                    ),
-                                ),
-                            ],
-                            className="graph__container first",
-                        ),
-                        # wind direction
-                        html.Div(
-                            [
-                                html.Div(
-                                    [
-                                        html.H6(
-                                            "TOTAL INCOMING VIDEOS (MOMENTS)", className="graph__title"
-                                        )
-                                    ]
+                            ),
+                            # bars the client already has, see figures.figure_update
+                            dcc.Store(id="detections-per-day-state"),
+                        ],
+                        className="one-third column graph__container",
+                    ),
+                    html.Div(
+                        [
+                            html.Div(
+                                [html.H6("DETECTIONS PER CLASS", className="graph__title")]
+                            ),
+                            dcc.Graph(
+                                id="detections-per-class",
+                                figure=dict(
+                                    layout=dict(
+                                        plot_bgcolor=app_color["graph_bg"],
+                                        paper_bgcolor=app_color["graph_bg"],
+                                    )
                                 ),
-                                dcc.Graph(
-                                    id="wind-direction",
-                                    figure=dict(
-                                        layout=dict(
-                                            plot_bgcolor=app_color["graph_bg"],
-                                            paper_bgcolor=app_color["graph_bg"],
-                                        )
-                                    ),
+                            ),
+                        ],
+                        className="one-third column graph__container",
+                    ),
+                    html.Div(
+                        [
+                            html.Div(
+                                [html.H6("DETECTIONS PER DAY BY PIPELINE", className="graph__title")]
+                            ),
+                            dcc.Graph(
+                                id="detections-per-pipeline",
+                                figure=dict(
+                                    layout=dict(
+                                        plot_bgcolor=app_color["graph_bg"],
+                                        paper_bgcolor=app_color["graph_bg"],
+                                    )
                                 ),
-                            ],
-                            className="graph__container second",
-                        ),
-                    ],
-                    className="one-third column histogram__direction",
-                ),
-            ],
-            className="app__content",
-        ),
+                            ),
+                        ],
+                        className="one-third column graph__container",
+                    ),
+                ],
+                className="app__content",
+            ),
+        ],
+        className="app__container",
+    )
+
+
+app.layout = serve_layout
+
+
+@server.route(app.config.routes_pathname_prefix + "events")
+def data_change_events():
+    """ Server-sent events stream with one message per data change. """
+
+    listener = get_db().change_listener() if push_enabled() else None
+    if listener is None:
+        return flask.Response(status=404)
+    if not _event_streams.acquire(blocking=False):
+        return flask.Response(status=503)
+
+    def stream(version):
+        yield "retry: 5000\n\n"
+        while True:
+            new_version = listener.wait(version, timeout=15)
+            if new_version == version:
+                yield ": keepalive\n\n"
+            else:
+                version = new_version
+                yield "data: {}\n\n".format(version)
+
+    response = flask.Response(
+        stream(listener.version),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # closed when the client goes away, noticed on the next keepalive at the latest
+    response.call_on_close(_event_streams.release)
+    return response
+
+
+@server.route(app.config.routes_pathname_prefix + "metrics")
+def prometheus_metrics():
+    """ Query, S3 listing and callback latencies, enabled with MLOPS_METRICS=1. """
+
+    if not metrics.enabled:
+        return flask.Response(status=404)
+    return flask.Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def get_pipeline_runs(window, version):
+    """
+    Runs of every registered pipeline in the time window, with the columns
+    and metadata keys all panels plot, from one grouped query.
+    """
+
+    registry = get_registry()
+    return get_db().get_pipeline_runs(
+        registry.model_names,
+        since=window["since"],
+        until=window["until"],
+        columns=registry.columns,
+        metadata_keys=registry.metadata_keys,
+        version=version,
+    )
+
+
+def get_prediction_counts(window, version):
+    """ Detections per date, pipeline and class in the time window, from the prediction aggregates. """
+
+    return get_db().get_prediction_counts(
+        since=window["since"], until=window["until"], version=version
+    )
+
+
+def cached_figure(panel, build, window, version, table="data_table"):
+    """
+    Figure of a panel for a time window, built once per data version and
+    shared between clients (and gunicorn workers with the shared cache
+    backend). The version is part of the key so a figure built before the
+    version moved is never served for the new one.
+    """
+
+    return get_db().cache.get(
+        (table, "figure", panel, window["since"], window["until"], version), build
+    )
+
+
+def panel_update(panel, build, state, window, version, table="data_table"):
+    """
+    Update of a panel for a client holding the figure described by state:
+    a Patch with just the new and changed bars, or the full figure when
+    its layout or time window changed.
+    """
+
+    update, state = figure_update(cached_figure(panel, build, window, version, table), state)
+    if update is None:
+        raise PreventUpdate
+    return update, state
+
+
+@app.callback(
+    Output("data-version", "data"),
+    [Input("data-update", "n_intervals"), Input("data-changed", "n_clicks")],
+    [State("data-version", "data")],
+)
+@metrics.timed("mlops_callback_seconds", callback="check_data_version")
+def check_data_version(interval, changes, version):
+    """
+    Check the data version on every interval (and data change in push mode)
+    and only pass it on to the panels when it moved, so idle ticks cost one
+    small query and no rendering.
+    """
+
+    new_version = get_db().get_data_version(version)
+    if new_version == version:
+        raise PreventUpdate
+    return new_version
+
+
+@app.callback(
+    [Output("time-window", "data"), Output("custom-range", "disabled")],
+    [
+        Input("time-range", "value"),
+        Input("custom-range", "start_date"),
+        Input("custom-range", "end_date"),
     ],
-    className="app__container",
 )
+def select_time_window(time_range, start_date, end_date):
+    """ Bounds of the selected time range, the custom dates only count for "custom". """
+
+    if time_range == "custom":
+        return {"since": start_date, "until": end_date}, False
+    if time_range == "all":
+        return {"since": None, "until": None}, True
+    since = dt.date.today() - dt.timedelta(days=int(time_range))
+    return {"since": since.isoformat(), "until": None}, True
 
 
 def get_current_time():
@@ -156,170 +423,122 @@ def get_current_time():
 
 
 @app.callback(
-    Output("wind-speed", "figure"), [Input("wind-speed-update", "n_intervals")]
+    [
+        Output({"type": "metric-graph", "pipeline": MATCH, "metric": MATCH}, "figure"),
+        Output({"type": "metric-state", "pipeline": MATCH, "metric": MATCH}, "data"),
+    ],
+    [Input("data-version", "data"), Input("time-window", "data")],
+    [
+        State({"type": "metric-state", "pipeline": MATCH, "metric": MATCH}, "data"),
+        State({"type": "metric-graph", "pipeline": MATCH, "metric": MATCH}, "id"),
+    ],
 )
-def gen_wind_speed(interval):
+@metrics.timed("mlops_callback_seconds", callback="gen_metric_panel")
+def gen_metric_panel(version, window, state, graph_id):
     """
-    Generate the wind speed graph.
+    Generate the graph of one metric of one pipeline, for every panel of
+    the registry.
 
-    :params interval: update the graph based on an interval
+    :params version: update the graph when the data version changes
+    :params window: {"since", "until"} of the days to plot
+    :params state: what the client has of the graph, only the difference is sent
+    :params graph_id: {"pipeline", "metric"} of the panel
     """
 
-    data_table = mlops_db.get_table('data_table')
-    
-    moments = data_table.loc[data_table['model_name']=='moments_pipeline']
-    #dup = data_table.loc[data_table['model_name']=='moments_pipeline']
-    #dup['date_inlet'] = dup['date_inlet'] + timedelta(days=-1)
-    #dup['datetime_inference_end'] = dup['datetime_inference_end'] + timedelta(hours=-3)
-    #moments = pd.concat([moments, dup], ignore_index=True)
-
-    moments['duration'] = moments['datetime_inference_end'] - moments['datetime_inference_start']
-    moments['duration'] = moments['duration'].apply(lambda x: round(x.total_seconds()/3600, 1))
-    moments['date_txt'] = moments['date_inlet'].apply(lambda x:str(x))
-    print(list(moments["date_txt"]))
-    bar_trace = dict(
-        type="bar",
-        y=moments['duration'],
-        line={"color": "#42C4F7"},
-        mode="lines",
-        x=moments['date_txt']
+    pipeline, metric = graph_id["pipeline"], graph_id["metric"]
+    panel = get_registry().panel(pipeline, metric)
+    return panel_update(
+        "metric:{}:{}".format(pipeline, metric),
+        lambda: metric_figure(
+            get_pipeline_runs(window, version),
+            metric,
+            panel["height"],
+            panel["y_title"],
+            pipeline=pipeline,
+            xaxis=panel["xaxis"],
+            max_points=WIDE_PANEL_BARS if panel["wide"] else NARROW_PANEL_BARS,
+        ),
+        state,
+        window,
+        version,
     )
 
-    layout = dict(
-        plot_bgcolor=app_color["graph_bg"],
-        paper_bgcolor=app_color["graph_bg"],
-        font={"color": "#fff"},
-        height=700,
-        xaxis={
-            "showline": True,
-            "zeroline": False,
-            "title": "Date",
-            "tickvals":moments['date_inlet'],
-            "ticktext":[str(f.day) + " " + f.strftime("%b") for f in list(moments['date_inlet'])]#list(moments["date_txt"])
-        },
-        yaxis={
-            "showgrid": True,
-            "showline": True,
-            "zeroline": False,
-            "title":"Duration (Hours)",
-            "gridcolor": app_color["graph_line"],
-        },
+
+def detections_per_day_figure(counts):
+    per_day = counts.groupby("date_inlet")["detections"].sum()
+    return bar_figure(
+        per_day.index,
+        per_day.to_numpy(),
+        350,
+        "# detections",
+        xaxis={"tickangle": 90},
+        max_points=NARROW_PANEL_BARS,
     )
 
-    return dict(data=[bar_trace], layout=layout)
 
+def detections_per_class_figure(counts):
+    per_class = counts.groupby("class_name")["detections"].sum().sort_values(ascending=False)
+    return category_figure(per_class.index, per_class.to_numpy(), 350, "# detections", "Class")
 
-@app.callback(
-    Output("wind-direction", "figure"), [Input("wind-speed-update", "n_intervals")]
-)
-def gen_wind_direction(interval):
-    data_table = mlops_db.get_table('data_table')
-    
-    moments = data_table.loc[data_table['model_name']=='moments_pipeline']
-    #dup = data_table.loc[data_table['model_name']=='moments_pipeline']
-    #dup['date_inlet'] = dup['date_inlet'] + timedelta(days=-1)
-    #dup['datetime_inference_end'] = dup['datetime_inference_end'] + timedelta(hours=-3)
-    #moments = pd.concat([moments, dup], ignore_index=True)
-
-    #moments['feed_count'] = moments['metadata'].apply(lambda x:ast.literal_eval(x)['feed_count'])
-    moments['date_txt'] = moments['date_inlet'].apply(lambda x:str(x))
-    
-    print(list(moments["date_txt"]))
-    bar_trace = dict(
-        type="bar",
-        y=moments['no_of_samples'],
-        line={"color": "#42C4F7"},
-        mode="lines",
-        x=moments['date_txt']
-    )
 
-    layout = dict(
-        plot_bgcolor=app_color["graph_bg"],
-        paper_bgcolor=app_color["graph_bg"],
-        font={"color": "#fff"},
-        height=350,
-        xaxis={
-            "showline": True,
-            "zeroline": False,
-            "title": "",
-            "tickvals":moments['date_inlet'],
-            "ticktext":[str(f.day) + " " + f.strftime("%b") for f in list(moments['date_inlet'])], #list(moments["date_txt"])
-            "tickangle":90,
-            "tickfont_size":0.5,
-            "title":"Date"
-        },
-        yaxis={
-            "showgrid": True,
-            "showline": True,
-            "zeroline": False,
-            "title":"# videos from School",
-            "gridcolor": app_color["graph_line"],
-        },
+def detections_per_pipeline_figure(counts):
+    per_pipeline = counts.groupby("model_name").agg(
+        detections=("detections", "sum"), days=("date_inlet", "nunique")
+    )
+    return category_figure(
+        per_pipeline.index,
+        (per_pipeline["detections"] / per_pipeline["days"]).round(1).to_numpy(),
+        350,
+        "# detections per day",
+        "Pipeline",
     )
 
-    return dict(data=[bar_trace], layout=layout)
 
-'''
 @app.callback(
-    Output("wind-histogram", "figure"),
-    [Input("wind-speed-update", "n_intervals")],
-    [
-        State("wind-speed", "figure"),
-        State("bin-slider", "value"),
-        State("bin-auto", "value"),
-    ],
+    [Output("detections-per-day", "figure"), Output("detections-per-day-state", "data")],
+    [Input("data-version", "data"), Input("time-window", "data")],
+    [State("detections-per-day-state", "data")],
 )
-'''
+@metrics.timed("mlops_callback_seconds", callback="gen_detections_per_day")
+def gen_detections_per_day(version, window, state):
+    return panel_update(
+        "detections-per-day",
+        lambda: detections_per_day_figure(get_prediction_counts(window, version)),
+        state,
+        window,
+        version,
+        table="prediction_counts",
+    )
+
 
 @app.callback(
-    Output("wind-histogram", "figure"), [Input("wind-speed-update", "n_intervals")]
+    Output("detections-per-class", "figure"),
+    [Input("data-version", "data"), Input("time-window", "data")],
 )
-
-def gen_wind_histogram(interval):
-    data_table = mlops_db.get_table('data_table')
-    
-    moments = data_table.loc[data_table['model_name']=='moments_pipeline']
-    #dup = data_table.loc[data_table['model_name']=='moments_pipeline']
-    #dup['date_inlet'] = dup['date_inlet'] + timedelta(days=-1)
-    #dup['datetime_inference_end'] = dup['datetime_inference_end'] + timedelta(hours=-3)
-    #moments = pd.concat([moments, dup], ignore_index=True)
-
-    moments['feed_count'] = moments['metadata'].apply(lambda x:ast.literal_eval(x)['feed_count'])
-    moments['date_txt'] = moments['date_inlet'].apply(lambda x:str(x))
-    
-    print(list(moments["date_txt"]))
-    bar_trace = dict(
-        type="bar",
-        y=moments['feed_count'],
-        line={"color": "#42C4F7"},
-        mode="lines",
-        x=moments['date_txt']
+@metrics.timed("mlops_callback_seconds", callback="gen_detections_per_class")
+def gen_detections_per_class(version, window):
+    return cached_figure(
+        "detections-per-class",
+        lambda: detections_per_class_figure(get_prediction_counts(window, version)),
+        window,
+        version,
+        table="prediction_counts",
     )
 
-    layout = dict(
-        plot_bgcolor=app_color["graph_bg"],
-        paper_bgcolor=app_color["graph_bg"],
-        font={"color": "#fff"},
-        height=350,
-        #bargap=0.5,
-        xaxis={
-            "showline": True,
-            "zeroline": False,
-            "title": "Date",
-            "tickangle":90,
-            "tickvals":moments['date_inlet'],
-            "ticktext":[str(f.day) + " " + f.strftime("%b") for f in list(moments['date_inlet'])]#list(moments["date_txt"])
-        },
-        yaxis={
-            "showgrid": True,
-            "showline": True,
-            "zeroline": False,
-            "title":"# videos pushed to feed",
-            "gridcolor": app_color["graph_line"],
-        },
-    )
 
-    return dict(data=[bar_trace], layout=layout)
+@app.callback(
+    Output("detections-per-pipeline", "figure"),
+    [Input("data-version", "data"), Input("time-window", "data")],
+)
+@metrics.timed("mlops_callback_seconds", callback="gen_detections_per_pipeline")
+def gen_detections_per_pipeline(version, window):
+    return cached_figure(
+        "detections-per-pipeline",
+        lambda: detections_per_pipeline_figure(get_prediction_counts(window, version)),
+        window,
+        version,
+        table="prediction_counts",
+    )
 
 '''
 @app.callback(
@@ -362,4 +581,4 @@ def show_num_bins(autoValue, slider_value):
 
 
 if __name__ == "__main__":
-    app.run_server(debug=True)
+    app.run(debug=True)
@@ -0,0 +1,22 @@
+/* Live updates
+––––––––––––––––––––––––––––––––––––––––––––––––––
+Listens to the server-sent "events" stream and clicks the hidden
+#data-changed button whenever the server reports that data changed,
+which triggers the panel callbacks. If the stream is not served
+(polling mode, or the worker has no stream slot left) the browser gives
+up and the dcc.Interval keeps refreshing the panels on its own.
+*/
+
+(function () {
+    if (!window.EventSource) {
+        return;
+    }
+
+    var source = new EventSource("events");
+    source.onmessage = function () {
+        var button = document.getElementById("data-changed");
+        if (button) {
+            button.click();
+        }
+    };
+})();
@@ -0,0 +1,72 @@
+'''
+Microbenchmark of panel figure construction.
+
+"rowwise" is the previous per-callback code (apply(str) labels and a list
+comprehension for the tick texts), "vectorized" is figures.metric_figure.
+
+Run from the app folder:
+    python -m benchmarks.bench_figures --points 1000 100000
+'''
+import argparse
+import time
+from datetime import date
+
+from benchmarks import synthetic
+from figures import app_color, metric_figure
+
+
+def rowwise_figure(runs):
+    runs = runs.copy()
+    runs['date_txt'] = runs['date_inlet'].apply(lambda x: str(x.date()))
+    bar_trace = dict(type="bar", y=runs['duration'], line={"color": "#42C4F7"},
+                     mode="lines", x=runs['date_txt'])
+    layout = dict(
+        plot_bgcolor=app_color["graph_bg"],
+        paper_bgcolor=app_color["graph_bg"],
+        font={"color": "#fff"},
+        height=700,
+        xaxis={"showline": True, "zeroline": False, "title": "Date",
+               "tickvals": runs['date_txt'],
+               "ticktext": [str(f.day) + " " + f.strftime("%b") for f in list(runs['date_inlet'])]},
+        yaxis={"showgrid": True, "showline": True, "zeroline": False,
+               "title": "Duration (Hours)", "gridcolor": app_color["graph_line"]},
+    )
+    return dict(data=[bar_trace], layout=layout)
+
+
+def vectorized_figure(runs):
+    return metric_figure(runs, 'duration', 700, 'Duration (Hours)')
+
+
+def time_it(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(points, repeat):
+    results = []
+    for n_points in points:
+        #Starting in 1900 so 100k days still fit in datetime64[ns]
+        runs = synthetic.make_runs(n_points, start=date(1900, 1, 1))
+        results.append({
+            'points': n_points,
+            'rowwise_s': time_it(lambda: rowwise_figure(runs), repeat),
+            'vectorized_s': time_it(lambda: vectorized_figure(runs), repeat),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>10} {:>14} {:>16}'.format('points', 'rowwise (ms)', 'vectorized (ms)'))
+    for result in run(args.points, args.repeat):
+        print('{:>10} {:>14.2f} {:>16.2f}'.format(
+            result['points'], result['rowwise_s'] * 1000, result['vectorized_s'] * 1000))
@@ -0,0 +1,74 @@
+'''
+Callback payload size of a panel over a year of daily data.
+
+"full" resends the whole figure on every poll (the previous callbacks),
+"patch" is figures.figure_update: nothing when the data did not change, a
+Patch with the changed or appended bars otherwise. Sizes are the JSON the
+callback response carries for the figure.
+
+Run from the app folder:
+    python -m benchmarks.bench_payload --days 365
+'''
+import argparse
+import json
+
+from plotly.utils import PlotlyJSONEncoder
+
+from benchmarks.synthetic import make_runs
+from figures import figure_update, metric_figure
+
+
+def payload_bytes(update):
+    if update is None:
+        return 0
+    if hasattr(update, 'to_plotly_json'):
+        update = update.to_plotly_json()
+    return len(json.dumps(update, cls=PlotlyJSONEncoder))
+
+
+def build(runs):
+    return metric_figure(runs, 'duration', 700, 'Duration (Hours)')
+
+
+def run(n_days):
+    runs = make_runs(n_days)
+    figure = build(runs)
+    _, state = figure_update(figure, None)
+
+    appended = make_runs(n_days + 1)
+    appended.iloc[:n_days] = runs
+    changed = runs.copy()
+    changed.loc[n_days - 1, 'duration'] += 1
+
+    scenarios = [
+        ('first load', figure, None),
+        ('no change', build(runs), state),
+        ('new day', build(appended), state),
+        ('latest day updated', build(changed), state),
+    ]
+    results = []
+    for name, new_figure, client_state in scenarios:
+        update, _ = figure_update(new_figure, client_state)
+        results.append({'scenario': name,
+                        'full_bytes': payload_bytes(new_figure),
+                        'patch_bytes': payload_bytes(update)})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--polls-per-day', type=int, default=17280, help='5 s polling')
+    args = parser.parse_args()
+
+    results = run(args.days)
+    print('{:>20} {:>12} {:>12}'.format('scenario', 'full (B)', 'patch (B)'))
+    for result in results:
+        print('{:>20} {:>12} {:>12}'.format(result['scenario'], result['full_bytes'], result['patch_bytes']))
+
+    #One client for a day: one new date, every other poll unchanged
+    sizes = {r['scenario']: r for r in results}
+    idle_polls = args.polls_per_day - 1
+    full = args.polls_per_day * sizes['no change']['full_bytes']
+    patch = idle_polls * sizes['no change']['patch_bytes'] + sizes['new day']['patch_bytes']
+    print('one client, one day of polling: full {:.1f} MB, patch {:.1f} kB'.format(full / 1e6, patch / 1e3))
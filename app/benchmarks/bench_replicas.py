@@ -0,0 +1,88 @@
+'''
+Read-replica routing of MLOPs_DB_Connect: which database serves the
+dashboard reads and the status writes, and the fallback to the primary.
+
+Runs dashboard reads (data version, pipeline runs, table snapshot) and
+status writes through one MLOPs_DB_Connect configured with --replica
+databases and counts the statements each database ran. A replica url that
+can't be reached (--down) shows the health check skipping it.
+
+With two local postgres instances set up as primary and streaming
+standby, give the standby as --replica. Two independent databases (or
+sqlite files, the default) work as well with --copy, which loads the same
+synthetic tables into every replica first.
+
+Run from the app folder:
+    python -m benchmarks.bench_replicas --primary postgresql://localhost:5432/mlops \\
+        --replica postgresql://localhost:5433/mlops --reads 200
+'''
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+from collections import Counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks import synthetic
+from db.api_db import MLOPs_DB_Connect
+
+
+def hidden(url):
+    return url.render_as_string(hide_password=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--primary', help='scratch primary database, its tables are replaced')
+    parser.add_argument('--replica', action='append', default=[], help='replica database (repeatable)')
+    parser.add_argument('--down', action='append', default=[], help='replica url that is not reachable')
+    parser.add_argument('--copy', action='store_true', help='load the tables into the replicas too')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--reads', type=int, default=100)
+    parser.add_argument('--writes', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        primary = args.primary or synthetic.sqlite_url(directory, 'primary.db')
+        replicas = args.replica
+        if not args.primary and not replicas:
+            replicas = [synthetic.sqlite_url(directory, 'replica{}.db'.format(i)) for i in (1, 2)]
+            args.copy = True
+        data_table = synthetic.make_data_table(args.rows)
+        for url in [primary] + (replicas if args.copy else []):
+            synthetic.load_tables(url, data_table)
+
+        db = MLOPs_DB_Connect(None, None, None, None, None, None, None, engine_url=primary, cache_ttl=0,
+                              replicas=replicas + args.down, replica_check_interval=1,
+                              pool={'size': 5, 'max_overflow': 5, 'pre_ping': True, 'recycle': 1800})
+
+        statements = Counter()
+
+        @event.listens_for(Engine, 'before_cursor_execute')
+        def count(conn, cursor, statement, parameters, context, executemany):
+            kind = 'write' if statement.lstrip().lower().startswith(('update', 'insert', 'delete')) else 'read'
+            statements[(hidden(conn.engine.url), kind)] += 1
+
+        dates = [str(day) for day in data_table['date_inlet'].iloc[-args.writes:]]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            for i in range(args.reads):
+                db.get_data_version()
+                db.get_pipeline_runs('moments_pipeline', since=dates[0])
+                if i % 10 == 0:
+                    db.get_table('data_table')
+            for day in dates:
+                db.update_inference_end_time(day)
+        elapsed = time.perf_counter() - start
+
+    for line in sorted(set(log.getvalue().splitlines())):
+        if line.startswith('Replica'):
+            print(line)
+    print('{:>60} {:>8} {:>8}'.format('database', 'reads', 'writes'))
+    for url in sorted({url for url, _ in statements}):
+        print('{:>60} {:>8} {:>8}'.format(url[-60:], statements[(url, 'read')], statements[(url, 'write')]))
+    print('{} reads and {} writes in {:.2f}s'.format(args.reads, len(dates), elapsed))
+    print('replica status:', db._router.status() if db._router else None)
@@ -0,0 +1,116 @@
+'''
+Memory and refresh time of data_table snapshots, as read ("raw") and with
+compact_snapshots ("compact": categoricals, datetime64 and bools).
+
+The table has one row per day and pipeline over several years. "read" is a
+full snapshot read, "copy" what a get_table caller modifying the snapshot
+(and the incremental sync, once per refresh) pays, "incremental"
+an incremental-sync refresh after one row changed and "arrow" a round trip
+through an Arrow IPC file as done by the shared cache.
+
+pandas 3 already stores text in Arrow-backed string columns, pass
+--object-strings to measure the python-object strings of earlier pandas.
+
+Run from the app folder:
+    python -m benchmarks.bench_snapshot --years 5 --pipelines 8 --object-strings
+'''
+import argparse
+import io
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import text
+
+from benchmarks import synthetic
+from db.api_db import MLOPs_DB_Connect
+from db.snapshot import frame_memory
+from db.sync import IncrementalTableSync
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def time_it(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def arrow_round_trip(frame):
+    sink = io.BytesIO()
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return pa.ipc.open_file(pa.BufferReader(sink.getvalue())).read_all().to_pandas()
+
+
+def incremental_refresh(db, sync):
+    #One row rewritten, as after an update_* call
+    with db.engine.begin() as conn:
+        conn.execute(text('update data_table set updated_at = :now where rowid = 1'), {'now': datetime.now()})
+    sync.refresh(db.engine)
+
+
+def run(years, pipelines, repeat):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_table = synthetic.make_data_table(365 * years * pipelines,
+                                               pipelines=synthetic.pipeline_names(pipelines))
+        url = synthetic.load_tables(synthetic.sqlite_url(tmp), data_table)
+        cases = []
+        for mode in ('raw', 'compact'):
+            db = MLOPs_DB_Connect(None, None, None, None, None, 'benchmark-bucket', 'frames',
+                                  engine_url=url, compact_snapshots=mode == 'compact')
+            frame = db.get_table('data_table', use_cache=False)
+            sync = IncrementalTableSync('data_table', key_columns=('date_inlet', 'model_name'),
+                                        transform=db._compact if db.compact_snapshots else None)
+            sync.refresh(db.engine)
+            timings = {
+                'read_s': lambda db=db: db.get_table('data_table', use_cache=False),
+                'copy_s': frame.copy,
+                'incremental_s': lambda db=db, sync=sync: incremental_refresh(db, sync),
+            }
+            if pa is not None:
+                timings['arrow_s'] = lambda frame=frame: arrow_round_trip(frame)
+            results.append({'mode': mode, 'rows': len(frame), 'memory_bytes': frame_memory(frame)})
+            cases.append(timings)
+        #The modes take turns, so neither is timed against the database and
+        #heap the other one left behind
+        for _ in range(repeat):
+            for result, timings in zip(results, cases):
+                for name, fn in timings.items():
+                    result[name] = min(result.get(name, float('inf')), time_it(fn))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--pipelines', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--object-strings', action='store_true')
+    args = parser.parse_args()
+    if args.object_strings:
+        try:
+            pd.set_option('future.infer_string', False)
+        except KeyError:
+            #pandas < 2.1 has object strings anyway
+            pass
+
+    results = run(args.years, args.pipelines, args.repeat)
+    print('{} rows'.format(results[0]['rows']))
+    print('{:>8} {:>12} {:>10} {:>10} {:>16} {:>10}'.format(
+        'mode', 'memory (MB)', 'read (ms)', 'copy (ms)', 'incremental (ms)', 'arrow (ms)'))
+    for result in results:
+        print('{:>8} {:>12.1f} {:>10.1f} {:>10.2f} {:>16.1f} {:>10}'.format(
+            result['mode'], result['memory_bytes'] / 1e6, result['read_s'] * 1000, result['copy_s'] * 1000,
+            result['incremental_s'] * 1000,
+            '{:.1f}'.format(result['arrow_s'] * 1000) if 'arrow_s' in result else '-'))
+    raw, compact = results
+    print('memory: {:.1f}x smaller, read {:.2f}x, copy {:.2f}x, incremental refresh {:.2f}x the raw time'.format(
+        raw['memory_bytes'] / compact['memory_bytes'], compact['read_s'] / raw['read_s'],
+        compact['copy_s'] / raw['copy_s'], compact['incremental_s'] / raw['incremental_s']))
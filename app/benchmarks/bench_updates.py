@@ -0,0 +1,67 @@
+'''
+Compare the cost of a one-row status update as data_table grows.
+
+"replace" is the old read-whole-table + to_sql(if_exists='replace') path,
+"targeted" is the parameterized UPDATE used by MLOPs_DB_Connect now.
+
+Run from the app folder:
+    python -m benchmarks.bench_updates --rows 1000 10000 100000
+'''
+import argparse
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks import synthetic
+from db.api_db import MLOPs_DB_Connect
+
+
+def replace_update(db, date_str):
+    #The pre-existing implementation of update_inference_end_time, with the
+    #column types postgres would return restored for sqlite
+    df = pd.read_sql_query('select * from "data_table"', con=db.engine,
+                           parse_dates=['date_inlet', 'datetime_inference_start',
+                                        'datetime_inference_end', 'updated_at'])
+    df['predictions_done'] = df['predictions_done'].astype(bool)
+    date_formatted = pd.Timestamp(date_str)
+    df.loc[df['date_inlet'] == date_formatted, ['datetime_inference_end']] = datetime.now()
+    df.loc[df['date_inlet'] == date_formatted, ['predictions_done']] = True
+    df.to_sql('data_table', db.engine, if_exists='replace', index=False)
+
+
+def time_it(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(rows, repeat):
+    results = []
+    for n_rows in rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_table = synthetic.make_data_table(n_rows)
+            url = synthetic.load_tables(synthetic.sqlite_url(tmp), data_table)
+            db = MLOPs_DB_Connect(None, None, None, None, None, 'benchmark-bucket', 'frames', engine_url=url)
+            target = str(data_table['date_inlet'].iloc[n_rows // 2])
+
+            targeted = time_it(lambda: db.update_inference_end_time(target), repeat)
+            replaced = time_it(lambda: replace_update(db, target), repeat)
+            results.append({'rows': n_rows, 'targeted_s': targeted, 'replace_s': replaced})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:>10} {:>14} {:>14}'.format('rows', 'targeted (ms)', 'replace (ms)'))
+    for result in run(args.rows, args.repeat):
+        print('{:>10} {:>14.2f} {:>14.2f}'.format(
+            result['rows'], result['targeted_s'] * 1000, result['replace_s'] * 1000))
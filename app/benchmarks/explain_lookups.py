@@ -0,0 +1,103 @@
+'''
+Query plans of the lookups the dashboard and pull_dataset_date run, to
+check that each one is served by an index of db/schema.py.
+
+The statements are captured while calling the real methods on a synthetic
+data_table (migrated by MLOpsSchema like a deployment), then explained:
+EXPLAIN QUERY PLAN on sqlite, EXPLAIN with enable_seqscan off on postgres,
+so a remaining sequential scan means no index can serve the query.
+
+Run from the app folder:
+    python -m benchmarks.explain_lookups [--rows 100000] [--engine-url postgresql://...]
+'''
+import argparse
+import contextlib
+import io
+import sys
+import tempfile
+
+from sqlalchemy import event
+
+from benchmarks import synthetic
+from db.api_db import MLOPs_DB_Connect
+
+#Full reads on purpose, e.g. get_table
+ALLOWED_SCANS = ('select * from',)
+
+
+def capture(engine, fn):
+    statements, seen = [], set()
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().lower().startswith(('select', 'insert', 'update', 'delete', 'with')) and not executemany:
+            #Per-date statements repeat, one plan each is enough
+            if statement not in seen:
+                seen.add(statement)
+                statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_execute)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_execute)
+    return statements
+
+
+def explain(engine, statement, parameters):
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn.exec_driver_sql('set enable_seqscan = off')
+            rows = conn.exec_driver_sql('explain ' + statement, parameters).fetchall()
+            plan = [row[0] for row in rows]
+            scans = [line for line in plan if 'Seq Scan' in line]
+        else:
+            rows = conn.exec_driver_sql('explain query plan ' + statement, parameters).fetchall()
+            plan = [row[-1] for row in rows]
+            scans = [line for line in plan if line.startswith('SCAN') and 'INDEX' not in line
+                     and line != 'SCAN CONSTANT ROW']
+    return plan, scans
+
+
+def lookups(db, date):
+    return [
+        ('get_data_version', db.get_data_version),
+        ('get_pipeline_runs', lambda: db.get_pipeline_runs('moments_pipeline', since=date)),
+        ('get_prediction_counts', lambda: db.get_prediction_counts(since=date, model_name='moments_pipeline')),
+        ('pull_dataset_date:latest_date', lambda: db.pull_dataset_date('latest_date')),
+        ('pull_dataset_date:pull_unprocessed_dates', lambda: db.pull_dataset_date('pull_unprocessed_dates')),
+        ('pull_dataset_date:claim_unprocessed_date', lambda: db.pull_dataset_date('claim_unprocessed_date')),
+        ('pull_dataset_date:custom_date', lambda: db.pull_dataset_date('custom_date', date)),
+        ('update_annotations_info', lambda: db.update_annotations_info(date, 42)),
+        ('refresh_prediction_aggregates', lambda: db.refresh_prediction_aggregates()),
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--engine-url', help='scratch database to use instead of sqlite, its tables are replaced')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        data_table = synthetic.make_data_table(args.rows, pipelines=synthetic.pipeline_names(2))
+        dates = data_table['date_inlet'].unique()
+        url = synthetic.load_tables(args.engine_url or synthetic.sqlite_url(directory), data_table,
+                                    synthetic.make_predictions_table(args.rows, dates[-30:]))
+        db = MLOPs_DB_Connect(None, None, None, None, None, None, None, engine_url=url, cache_ttl=0)
+        db.schema.ensure()
+        date = str(dates[len(dates) // 2])
+
+        failed = 0
+        for name, fn in lookups(db, date):
+            for statement, parameters in capture(db.engine, fn):
+                plan, scans = explain(db.engine, statement, parameters)
+                if scans and statement.lstrip().lower().startswith(ALLOWED_SCANS):
+                    scans = []
+                failed += bool(scans)
+                print('{} {}'.format('SCAN' if scans else 'ok  ', name))
+                print('     ' + ' '.join(statement.split())[:120])
+                for line in plan:
+                    print('       ' + line)
+        db.engine.dispose()
+    sys.exit(1 if failed else 0)
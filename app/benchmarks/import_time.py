@@ -0,0 +1,75 @@
+'''
+Import-time budget of the dashboard app.
+
+Imports `app` in a fresh interpreter with `python -X importtime`, prints
+the slowest modules and exits with status 1 when the import takes longer
+than the budget, or when it already connected to the database or S3.
+Gunicorn imports the app before forking its workers, so whatever happens
+here delays every worker boot.
+
+--repeat keeps the fastest of several imports, as a single one also
+measures whatever else the machine is busy with. tests/test_import_time.py
+runs it with the default budget.
+
+Run from the app folder (CI can run it as is):
+    python -m benchmarks.import_time --budget-ms 1500
+'''
+import argparse
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Modules that must not be loaded by importing the app. The layout is built by a
+#function, so the pipeline registry (pipelines.yaml) is only read on the first request
+DEFERRED = ('boto3', 'sqlalchemy', 'pandas', 'scipy', 'yaml', 'registry', 'db.api_db')
+
+CHECK = '''
+import sys, app
+assert app._mlops_db is None, "the database connection was created at import"
+print(",".join(m for m in {!r} if m in sys.modules))
+'''.format(DEFERRED)
+
+
+def measure():
+    '''
+    Run the import and return (total_us, [(cumulative_us, module)], loaded deferred modules).
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHECK], cwd=APP_DIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr[-2000:])
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        #Nested imports are indented by two spaces per level
+        timings.append((int(cumulative), module[1:].rstrip()))
+    total = sum(cumulative for cumulative, module in timings if not module.startswith(' '))
+    loaded = [m for m in result.stdout.strip().split(',') if m]
+    return total, timings, loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('IMPORT_TIME_BUDGET_MS', 1500)))
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    total, timings, loaded = min((measure() for _ in range(args.repeat)), key=lambda run: run[0])
+    print('{:>12}  {}'.format('cumul. (ms)', 'module'))
+    for cumulative, module in sorted(timings, reverse=True)[:args.top]:
+        print('{:>12.1f}  {}'.format(cumulative / 1000, module))
+    print('import app: {:.0f} ms (budget {:.0f} ms)'.format(total / 1000, args.budget_ms))
+
+    failed = False
+    if loaded:
+        print('Loaded at import, should be deferred to first use:', ', '.join(loaded))
+        failed = True
+    if total / 1000 > args.budget_ms:
+        print('Import time over budget')
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,164 @@
+'''
+Benchmark suite of the dashboard callbacks and the MLOPs_DB_Connect write
+paths on synthetic data, at several data_table sizes.
+
+For every size a fresh database (sqlite in a temporary folder, or the
+scratch database given with --engine-url, whose tables are replaced) is
+loaded with a synthetic data_table, and the frames of the target date are
+put in an in-memory S3 bucket. Each scenario reports the best of --repeat
+runs. "cold" callbacks run with an empty snapshot cache, "warm" ones
+are served from it.
+
+Results are written as JSON (to stdout or --output) so runs can be
+compared to track regressions:
+    {"environment": {...}, "results": [{"scenario", "rows", "seconds", ...}]}
+
+Run from the app folder:
+    python -m benchmarks.suite --rows 1000 100000 1000000 --output results.json
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import sqlalchemy
+
+from benchmarks import synthetic
+from db.api_db import MLOPs_DB_Connect
+
+SUBPATH = 'frames'
+
+
+def time_it(fn, repeat, before=None):
+    timings = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        #The db layer reports progress with prints
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def connect(url, bucket):
+    db = MLOPs_DB_Connect(None, None, None, None, None, bucket.name, SUBPATH, engine_url=url)
+    db._frame_bucket = bucket
+    return db
+
+
+def callback_scenarios(db, last_date):
+    import app
+
+    app._mlops_db = db
+    #The "all history" view and a 90 days range ending at the newest date
+    windows = [('all', {'since': None, 'until': None}),
+               ('90d', {'since': str(last_date - timedelta(days=90)), 'until': None})]
+    scenarios = [('callback:check_data_version', lambda: app.check_data_version(0, 0, None))]
+    for name, window in windows:
+        for pipeline in app.get_registry().pipelines:
+            for panel in pipeline['panels']:
+                graph_id = {'pipeline': pipeline['name'], 'metric': panel['metric']}
+                scenarios.append(('callback:gen_metric_panel:{}:{}'.format(panel['metric'], name),
+                                  lambda w=window, g=graph_id: app.gen_metric_panel('version', w, None, g)))
+        scenarios.append(('callback:gen_detections_per_day:{}'.format(name),
+                          lambda w=window: app.gen_detections_per_day('version', w, None)))
+        for callback in (app.gen_detections_per_class, app.gen_detections_per_pipeline):
+            scenarios.append(('callback:{}:{}'.format(callback.__name__, name),
+                              lambda cb=callback, w=window: cb('version', w)))
+    return scenarios
+
+
+def run_size(n_rows, args, directory):
+    data_table = synthetic.make_data_table(n_rows, pipelines=synthetic.pipeline_names(args.pipelines),
+                                           metadata_shape=args.metadata_shape)
+    url = synthetic.load_tables(args.engine_url or synthetic.sqlite_url(directory), data_table)
+    target = str(data_table['date_inlet'].iloc[len(data_table) // 2])
+    bucket = synthetic.FakeBucket(keys=synthetic.frame_keys(SUBPATH, [target], args.frames_per_date))
+    csv_path = synthetic.write_predictions_csv(os.path.join(directory, 'labels.csv'), n_rows)
+    db = connect(url, bucket)
+
+    results = []
+
+    def record(scenario, fn, before=None, **extra):
+        seconds = time_it(fn, args.repeat, before)
+        results.append(dict(scenario=scenario, rows=n_rows, seconds=seconds, repeat=args.repeat, **extra))
+        print('{:>48} {:>10} {:>12.2f} ms'.format(scenario, n_rows, seconds * 1000), file=sys.stderr)
+
+    for scenario, fn in callback_scenarios(db, data_table['date_inlet'].iloc[-1]):
+        record(scenario + ':cold', fn, before=db.cache.invalidate)
+        record(scenario + ':warm', fn)
+
+    record('update_annotations_info', lambda: db.update_annotations_info(target, 42))
+    record('update_inference_info', lambda: db.update_inference_info(target, 'moments_pipeline', 'v2',
+                                                                     's3://weights/moments_pipeline.pt'))
+    record('update_inference_end_time', lambda: db.update_inference_end_time(target))
+    record('update_metadata', lambda: db.update_metadata(target, {'feed_count': 7}))
+    record('update_daily_count', lambda: db.update_daily_count(target),
+           frames=args.frames_per_date)
+    #What an inference worker does per date, for a burst of dates
+    burst_dates = [str(day) for day in data_table['date_inlet'].iloc[:50]]
+
+    def status_burst():
+        for day in burst_dates:
+            db.update_inference_info(day, 'moments_pipeline', 'v2', 's3://weights/moments_pipeline.pt')
+            db.update_annotations_info(day, 42)
+            db.update_inference_end_time(day)
+
+    def write_behind_burst():
+        with db.write_behind(max_pending=len(burst_dates)):
+            status_burst()
+
+    record('status_burst:direct', status_burst, dates=len(burst_dates))
+    record('status_burst:write_behind', write_behind_burst, dates=len(burst_dates))
+    record('upload_predictions', lambda: db.upload_predictions(target, csv_path),
+           predictions=n_rows)
+    record('refresh_prediction_aggregates', lambda: db.refresh_prediction_aggregates(dates=[target]),
+           predictions=n_rows * args.repeat)
+    db.engine.dispose()
+    return results
+
+
+def environment(args):
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'sqlalchemy': sqlalchemy.__version__,
+        'backend': (args.engine_url or 'sqlite').split(':')[0],
+        'pipelines': args.pipelines,
+        'metadata_shape': args.metadata_shape,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pipelines', type=int, default=2)
+    parser.add_argument('--metadata-shape', default='mixed', choices=['json', 'literal', 'mixed', 'none'])
+    parser.add_argument('--frames-per-date', type=int, default=5000)
+    parser.add_argument('--engine-url', help='scratch database to use instead of sqlite, its tables are replaced')
+    parser.add_argument('--output', help='JSON file to write, stdout by default')
+    args = parser.parse_args()
+
+    results = []
+    for n_rows in args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            results.extend(run_size(n_rows, args, directory))
+
+    report = json.dumps({'environment': environment(args), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fo:
+            fo.write(report + '\n')
+    else:
+        print(report)
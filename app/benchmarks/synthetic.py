@@ -0,0 +1,240 @@
+'''
+Synthetic MLOps data for the benchmarks: data_table and predictions_table
+frames, prediction csv files like the ones inference writes, a local
+database to load them into and an in-memory S3 bucket with frame keys.
+
+Run times follow a bounded random walk like the wind speed generator in
+Notebook/wind-speed-generation.ipynb, so the panels plot plausible series.
+'''
+import bisect
+import hashlib
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+PIPELINES = ('moments_pipeline', 'feed_pipeline', 'faces_pipeline', 'ocr_pipeline')
+CLASSES = ('person', 'face', 'hand', 'book', 'laptop', 'phone', 'board', 'chair')
+START_DATE = date(2000, 1, 1)
+#Longest history make_data_table generates, about ten years
+MAX_DAYS = 3650
+
+
+def random_walk(n, start=2.0, step=0.2, low=0.2, high=10.0, rng=None):
+    '''
+    Bounded random walk of n values, as the notebook generates wind speeds.
+    '''
+    rng = rng or np.random.RandomState(0)
+    values = start + np.cumsum(rng.normal(0, step, n))
+    #Fold the walk back into [low, high] instead of clipping it flat
+    span = high - low
+    values = np.abs((values - low) % (2 * span) - span)
+    return high - values
+
+
+def pipeline_names(n):
+    '''
+    n pipeline names, the known ones first.
+    '''
+    return list(PIPELINES[:n]) + ['pipeline_{}'.format(i) for i in range(len(PIPELINES), n)]
+
+
+def make_runs(n_points, start=START_DATE, seed=0):
+    '''
+    Pipeline runs as get_pipeline_runs returns them, with a run duration per day.
+    '''
+    return pd.DataFrame({'date_inlet': pd.date_range(start, periods=n_points, freq='D'),
+                         'duration': np.round(random_walk(n_points, rng=np.random.RandomState(seed)), 1)})
+
+
+def make_metadata(n, keys=('feed_count',), shape='json', rng=None):
+    '''
+    n metadata strings with integer values for keys. shape is 'json' (what
+    update_metadata writes), 'literal' (legacy python dict literals),
+    'mixed' (both, plus some malformed values) or 'none'.
+    '''
+    rng = rng or np.random.RandomState(0)
+    if shape == 'none' or not keys:
+        return [None] * n
+    values = {key: rng.randint(0, 500, n) for key in keys}
+    rows = [{key: int(values[key][i]) for key in keys} for i in range(n)]
+    if shape == 'json':
+        return [json.dumps(row) for row in rows]
+    if shape == 'literal':
+        return [repr(row) for row in rows]
+    kinds = rng.randint(0, 10, n)
+    return [json.dumps(row) if kind < 6 else repr(row) if kind < 9 else '{not metadata'
+            for row, kind in zip(rows, kinds)]
+
+
+def make_data_table(n_rows, pipelines=PIPELINES[:1], start=None, max_days=MAX_DAYS,
+                    metadata_keys=('feed_count',), metadata_shape='json', done_ratio=0.95, seed=0):
+    '''
+    data_table with n_rows rows, one per day and pipeline, starting at start
+    or else ending today. Rows that don't fit in max_days days go to more
+    pipelines (see pipeline_names), as there is one row per day and
+    pipeline. The last rows are the most likely to be pending
+    (predictions_done false).
+    '''
+    rng = np.random.RandomState(seed)
+    pipelines = list(pipelines)
+    n_pipelines = -(-n_rows // max_days)
+    if n_pipelines > len(pipelines):
+        extra = [name for name in pipeline_names(n_pipelines + len(pipelines)) if name not in pipelines]
+        pipelines += extra[:n_pipelines - len(pipelines)]
+    n_days = -(-n_rows // len(pipelines))
+    if start is None:
+        start = date.today() - timedelta(days=n_days - 1)
+    days = np.repeat(pd.date_range(start, periods=n_days, freq='D').date, len(pipelines))[:n_rows]
+    names = np.tile(list(pipelines), n_days)[:n_rows]
+    done = rng.rand(n_rows) < done_ratio
+    done[-max(1, n_rows // 100):] = False
+    starts = pd.to_datetime(days) + pd.to_timedelta(rng.randint(0, 6 * 60, n_rows), unit='m')
+    hours = random_walk(n_rows, rng=rng)
+    ends = starts + pd.to_timedelta(np.round(hours * 3600), unit='s')
+    return pd.DataFrame({
+        'date_inlet': days,
+        'predictions_done': done,
+        'no_of_frames': rng.randint(100, 100000, n_rows),
+        'datetime_inference_start': starts.where(done),
+        'datetime_inference_end': ends.where(done),
+        'model_name': names,
+        'model_version': np.char.add('v', rng.randint(1, 4, n_rows).astype(str)),
+        'weights_path': np.char.add(np.char.add('s3://weights/', names.astype(str)), '.pt'),
+        'labelstudio_projectid': None,
+        'no_of_samples': rng.randint(0, 500, n_rows),
+        'metadata': make_metadata(n_rows, metadata_keys, metadata_shape, rng),
+        'updated_at': datetime(2020, 1, 1),
+    })
+
+
+def make_predictions(n_rows, videos=100, classes=CLASSES, seed=0):
+    '''
+    n_rows detections as written by inference (the csv upload_predictions reads).
+    '''
+    rng = np.random.RandomState(seed)
+    video = np.char.add('video_', rng.randint(0, videos, n_rows).astype(str))
+    frame_no = rng.randint(0, 10000, n_rows)
+    x_min, y_min = rng.randint(0, 1800, n_rows), rng.randint(0, 1000, n_rows)
+    return pd.DataFrame({
+        'imagename': np.char.add(np.char.add(video, '_'), frame_no.astype(str)),
+        'frame_no': frame_no,
+        'video': video,
+        'class_name': np.asarray(classes)[rng.randint(0, len(classes), n_rows)],
+        'x_min': x_min,
+        'y_min': y_min,
+        'x_max': x_min + rng.randint(10, 200, n_rows),
+        'y_max': y_min + rng.randint(10, 200, n_rows),
+    })
+
+
+def write_predictions_csv(path, n_rows, **kwargs):
+    make_predictions(n_rows, **kwargs).to_csv(path, index=False)
+    return path
+
+
+def make_predictions_table(n_rows, dates, seed=0):
+    '''
+    predictions_table rows spread over dates, as upload_predictions stores them.
+    '''
+    rng = np.random.RandomState(seed)
+    frame = make_predictions(n_rows, seed=seed).drop(columns=['imagename', 'frame_no'])
+    frame = frame.rename(columns={'video': 'image_name'})
+    dates = np.asarray(dates)
+    frame['date_inlet'] = np.sort(dates[rng.randint(0, len(dates), n_rows)])
+    frame['date_inference'] = frame['date_inlet']
+    frame['bbox_confidence'] = np.nan
+    frame['class_score'] = np.nan
+    return frame
+
+
+def sqlite_url(directory, name='mlops.db'):
+    return 'sqlite:///' + os.path.join(directory, name)
+
+
+def load_tables(url, data_table, predictions_table=None, migrate=True):
+    '''
+    (Re)create the tables in the database at url (sqlite or a scratch
+    postgres database) with the index on date_inlet a deployment has, then
+    migrate them like `python -m db.schema` does on deploy.
+    '''
+    from db.schema import MLOpsSchema
+
+    engine = create_engine(url)
+    data_table.to_sql('data_table', engine, index=False, if_exists='replace', chunksize=50000)
+    if predictions_table is not None:
+        predictions_table.to_sql('predictions_table', engine, index=False, if_exists='replace',
+                                 chunksize=50000)
+    with engine.begin() as conn:
+        conn.execute(text('create index if not exists data_table_date_inlet_idx on data_table (date_inlet)'))
+    if migrate:
+        MLOpsSchema(engine).ensure()
+    engine.dispose()
+    return url
+
+
+class FakeBucket:
+    """
+    In-memory stand-in for a boto3 Bucket, with the list_objects_v2
+    paginator (Prefix, Delimiter, StartAfter, 1000 keys per page) that
+    S3PrefixCounter uses. Holds millions of keys without a network.
+    """
+
+    def __init__(self, name='benchmark-bucket', keys=()):
+        self.name = name
+        self.keys = sorted(keys)
+        self.meta = _Meta(_FakeClient(self))
+
+    def add(self, keys):
+        self.keys = sorted(self.keys + list(keys))
+
+
+def frame_keys(subpath, dates, frames_per_date):
+    '''
+    Keys of the frames of every date: "<subpath>/<date>/<video>/<frame>.jpg".
+    '''
+    for day in dates:
+        for i in range(frames_per_date):
+            yield '{}/{}/video_{}/{:06d}.jpg'.format(subpath, day, i // 1000, i)
+
+
+class _Meta:
+    def __init__(self, client):
+        self.client = client
+
+
+class _FakeClient:
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_paginator(self, operation):
+        assert operation == 'list_objects_v2', operation
+        return self
+
+    def paginate(self, Bucket, Prefix='', Delimiter=None, StartAfter=None, PageSize=1000):
+        keys = self.bucket.keys
+        i = bisect.bisect_left(keys, Prefix)
+        if StartAfter:
+            i = max(i, bisect.bisect_right(keys, StartAfter))
+        page = {'Contents': [], 'CommonPrefixes': []}
+        prefixes = set()
+        while i < len(keys) and keys[i].startswith(Prefix):
+            key = keys[i]
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                folder = key[:key.index(Delimiter, len(Prefix)) + 1]
+                if folder not in prefixes:
+                    prefixes.add(folder)
+                    page['CommonPrefixes'].append({'Prefix': folder})
+                #Skip the rest of the folder
+                i = bisect.bisect_left(keys, folder[:-1] + chr(ord(Delimiter) + 1), i)
+            else:
+                page['Contents'].append({'Key': key, 'ETag': hashlib.md5(key.encode()).hexdigest()})
+                i += 1
+            if len(page['Contents']) + len(page['CommonPrefixes']) >= PageSize:
+                yield page
+                page = {'Contents': [], 'CommonPrefixes': []}
+        if page['Contents'] or page['CommonPrefixes']:
+            yield page
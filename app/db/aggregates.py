@@ -0,0 +1,134 @@
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import bindparam, inspect, text
+from .schema import MLOpsSchema
+
+TABLE = 'prediction_counts'
+#Column of predictions_table holding the detected class, the first one present is used
+CLASS_COLUMNS = ('class_name', 'class', 'label', 'category')
+
+
+class PredictionAggregates:
+    """
+    Detection counts per (date_inlet, model_name, class_name), kept in the
+    small prediction_counts table so the dashboard never reads
+    predictions_table itself.
+
+    upload_predictions adds the counts of every uploaded chunk in the same
+    transaction (`count_chunk` + `add`). `refresh` recomputes whole dates
+    from predictions_table, by default only the dates past the newest one
+    aggregated so far, for rows that were loaded some other way.
+    """
+
+    def __init__(self, engine, schema=None, reader=None):
+        self.engine = engine
+        self.schema = schema or MLOpsSchema(engine)
+        #Engine for read and version, e.g. a replica, instead of engine
+        self.reader = reader or (lambda: engine)
+
+    def check_table(self):
+        self.schema.check()
+
+    def count_chunk(self, counts, chunk):
+        '''
+        Add the detections per class of a predictions chunk to the Counter counts.
+        '''
+        column = class_column(chunk.columns)
+        if column is None:
+            counts[''] += len(chunk)
+        else:
+            for class_name, n in chunk[column].fillna('').astype(str).value_counts().items():
+                counts[class_name] += int(n)
+        return counts
+
+    def add(self, conn, date, model_name, counts):
+        '''
+        Add counts ({class_name: detections}) to the aggregates of date and model_name.
+        '''
+        if not counts:
+            return
+        now = datetime.now()
+        conn.execute(text('''
+            insert into {0} (date_inlet, model_name, class_name, detections, updated_at)
+            values (:date_inlet, :model_name, :class_name, :detections, :updated_at)
+            on conflict (date_inlet, model_name, class_name) do update
+            set detections = {0}.detections + excluded.detections, updated_at = excluded.updated_at
+            '''.format(TABLE)), [{'date_inlet': date, 'model_name': model_name or '', 'class_name': class_name,
+                                  'detections': n, 'updated_at': now} for class_name, n in counts.items()])
+
+    def refresh(self, dates=None, progress=print):
+        '''
+        Recompute the aggregates of dates (default: every date of
+        predictions_table newer than the newest aggregated one) from
+        predictions_table, one date per transaction. Returns the dates done.
+        '''
+        self.check_table()
+        inspector = inspect(self.engine)
+        if not inspector.has_table('predictions_table'):
+            return []
+        column = class_column([c['name'] for c in inspector.get_columns('predictions_table')])
+        class_expr = "coalesce(cast(p.{} as text), '')".format(column) if column else "''"
+        if dates is None:
+            with self.engine.connect() as conn:
+                newest = conn.execute(text('select max(date_inlet) from {}'.format(TABLE))).scalar()
+                query = 'select distinct date_inlet from predictions_table'
+                if newest is not None:
+                    query += ' where date_inlet > :newest'
+                dates = [row[0] for row in conn.execute(text(query + ' order by date_inlet'),
+                                                        {'newest': newest})]
+        #The model of a date is the one data_table has for it
+        insert = text('''
+            insert into {0} (date_inlet, model_name, class_name, detections, updated_at)
+            select p.date_inlet, coalesce(d.model_name, ''), {1}, count(*), :now
+            from predictions_table p
+            left join (select date_inlet, min(model_name) as model_name from data_table
+                       where date_inlet = :date group by date_inlet) d on d.date_inlet = p.date_inlet
+            where p.date_inlet = :date
+            group by p.date_inlet, coalesce(d.model_name, ''), {1}'''.format(TABLE, class_expr))
+        for i, date in enumerate(dates, 1):
+            with self.engine.begin() as conn:
+                conn.execute(text('delete from {} where date_inlet = :date'.format(TABLE)), {'date': date})
+                conn.execute(insert, {'date': date, 'now': datetime.now()})
+            if progress is not None and (i % 100 == 0 or i == len(dates)):
+                progress("Aggregated predictions of {}/{} dates".format(i, len(dates)))
+        return [str(date) for date in dates]
+
+    def read(self, since=None, until=None, model_names=None, engine=None):
+        '''
+        The aggregates, optionally limited to date_inlet in [since, until]
+        and to some models, ordered by date, read from engine or the reader.
+        '''
+        self.check_table()
+        conditions, params = [], {}
+        if since is not None:
+            conditions.append('date_inlet >= :since')
+            params['since'] = since
+        if until is not None:
+            conditions.append('date_inlet <= :until')
+            params['until'] = until
+        if model_names:
+            conditions.append('model_name in :model_names')
+            params['model_names'] = list(model_names)
+        query = 'select date_inlet, model_name, class_name, detections from {}'.format(TABLE)
+        if conditions:
+            query += ' where ' + ' and '.join(conditions)
+        query = text(query + ' order by date_inlet')
+        if model_names:
+            query = query.bindparams(bindparam('model_names', expanding=True))
+        return pd.read_sql_query(query, con=engine or self.reader(), params=params, parse_dates=['date_inlet'])
+
+    def version(self, engine=None):
+        '''
+        Row count and latest update of the aggregates, as a string.
+        '''
+        self.check_table()
+        with (engine or self.reader()).connect() as conn:
+            row = conn.execute(text('select count(*), max(updated_at) from {}'.format(TABLE))).fetchone()
+        return '|'.join(str(value) for value in row)
+
+
+def class_column(columns):
+    for column in CLASS_COLUMNS:
+        if column in columns:
+            return column
+    return None
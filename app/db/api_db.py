@@ -1,59 +1,317 @@
-from sqlalchemy import event, create_engine
+from sqlalchemy import create_engine, text, bindparam
+from sqlalchemy.engine import make_url
 import pandas as pd
 import time
 import sys
 import os
 import numpy as np
-import boto3
-import json
-import sys
+import re
+import threading
+from collections import Counter
 from datetime import datetime
+from .cache import SnapshotCache, SharedSnapshotCache
+from .sync import IncrementalTableSync
+from .s3_count import S3PrefixCounter
+from .bulk import insert_method
+from .metadata import MetadataParser, dump_metadata
+from .notify import ChangeListener, notify_change
+from .metrics import REGISTRY as metrics
+from .scheduler import PendingDateScheduler
+from .snapshot import BOOL_COLUMNS, compact_frame
+from .write_behind import WriteBehindQueue
+from .aggregates import PredictionAggregates
+from .schema import MLOpsSchema
+from .routing import ReplicaRouter, engine_options, replica_url
+
+#Columns computed by the database in get_pipeline_runs, per dialect
+DERIVED_COLUMNS = {
+    'postgresql': {
+        'duration': 'round((extract(epoch from (datetime_inference_end - datetime_inference_start)) / 3600)::numeric, 1)::float8',
+        'date_txt': "to_char(date_inlet, 'YYYY-MM-DD')",
+    },
+    'sqlite': {
+        'duration': 'round((julianday(datetime_inference_end) - julianday(datetime_inference_start)) * 24, 1)',
+        'date_txt': 'date(date_inlet)',
+    },
+}
+DATETIME_COLUMNS = ['date_inlet', 'datetime_inference_start', 'datetime_inference_end', 'updated_at']
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+#Statements shared with AsyncMLOPs_DB_Connect
+DATE_EXISTS = text('select 1 from data_table where date_inlet = :date limit 1')
+UPSERT_DAILY_COUNT = '''
+    insert into data_table (date_inlet, predictions_done, no_of_frames, model_name,
+                            model_version, weights_path, updated_at)
+    values (:date_inlet, false, :no_of_frames, '', '', '', {now})
+    on conflict (date_inlet, model_name) do update
+    set no_of_frames = excluded.no_of_frames, updated_at = excluded.updated_at
+    '''
+#Database clock the row versions (updated_at) are stamped with, so workers
+#on hosts with skewed clocks can't stamp a change older than the watermark
+#the incremental sync already read
+DB_NOW = {
+    'postgresql': 'localtimestamp',
+    'sqlite': "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')",
+}
+
+
+def _to_date(date):
+    #Dates are passed around both as 'YYYY-MM-DD' strings and date objects
+    if isinstance(date, str):
+        return datetime.strptime(date, "%Y-%m-%d").date()
+    if isinstance(date, datetime):
+        return date.date()
+    return date
+
+def _db_now(dialect):
+    return DB_NOW.get(dialect, 'current_timestamp')
+
+def _db_time(conn):
+    #Current time of the database clock, for rows written with to_sql
+    return conn.execute(text('select ' + _db_now(conn.dialect.name))).scalar()
+
+def _upsert_daily_count_statement(dialect):
+    return text(UPSERT_DAILY_COUNT.format(now=_db_now(dialect)))
+
+def _update_date_statement(date, values, dialect='postgresql', model_name=None):
+    '''
+    Parameterized UPDATE of the given columns of the data_table rows for
+    date, and its parameters. Setting model_name only touches the row of
+    that pipeline, or if it has none yet the one no pipeline has taken, as
+    (date_inlet, model_name) is unique. Otherwise model_name picks the
+    pipeline's row, and without it every row of the date is updated.
+    '''
+    values = {column: value for column, value in values.items() if column != 'updated_at'}
+    assignments = ', '.join(['"{0}" = :{0}'.format(column) for column in values] +
+                            ['updated_at = ' + _db_now(dialect)])
+    params = dict(values, date_inlet=_to_date(date))
+    condition = 'date_inlet = :date_inlet'
+    if 'model_name' in values:
+        condition += (" and (model_name = :model_name or (coalesce(model_name, '') = '' and not exists ("
+                      "select 1 from data_table taken where taken.date_inlet = :date_inlet "
+                      "and taken.model_name = :model_name)))")
+    elif model_name is not None:
+        condition += ' and model_name = :model_name'
+        params['model_name'] = model_name
+    statement = text('update data_table set {} where {}'.format(assignments, condition))
+    return statement, params
+
+def _version_source(version):
+    #get_data_version strings start with the database they were read from
+    return str(version).split('|', 1)[0]
+
+def _daily_log_entries(counts, model_name='', model_version='', weights_path='', updated_at=None):
+    #New data_table rows for {date: no_of_frames}, updated_at from _db_time
+    return pd.DataFrame([{'date_inlet': _to_date(date), 
+                          'predictions_done': False, 
+                          'no_of_frames': counting, 
+                          'datetime_inference_start': np.nan, 
+                          'datetime_inference_end': np.nan,
+                          'model_name':model_name,
+                          'model_version':model_version,
+                          'weights_path':weights_path,
+                          'labelstudio_projectid':None,
+                          'updated_at': updated_at
+                          } for date, counting in counts.items()])
 
 class MLOPs_DB_Connect:
     def __init__(self, hostname, username,
-                port, password, database, aws_bucket, bucket_subpath
+                port, password, database, aws_bucket, bucket_subpath,
+                cache_ttl=5, sync_mode='full', engine_url=None,
+                s3_workers=16, manifest_dir=None, s3_sorted_keys=False, cache_backend='local', cache_dir=None,
+                compact_snapshots=False, write_behind=None,
+                replicas=None, pool=None, max_replica_lag=30, replica_check_interval=10
                 ):
         
-        self.engine_url = 'postgresql://{}:{}@{}:{}/{}'.format(
+        #engine_url overrides the postgres settings, e.g. sqlite for local runs
+        self.engine_url = engine_url or 'postgresql://{}:{}@{}:{}/{}'.format(
                                                             username,
                                                             password,
                                                             hostname,
                                                             port,
                                                             database
                                                             )
-        self.engine = create_engine(self.engine_url)
-        self.frame_bucket = boto3.resource('s3').Bucket(aws_bucket)
+        #Pool settings ({size, max_overflow, timeout, pre_ping, recycle}) of
+        #the primary and the replicas
+        self.engine_options = engine_options(pool)
+        #Read-only replicas (urls, or the settings that differ from the
+        #primary's) serving the dashboard reads, see read_engine
+        primary = dict(hostname=hostname, username=username, port=port, password=password, database=database)
+        self.replica_urls = [replica_url(replica, primary) for replica in (replicas or [])]
+        self.max_replica_lag = max_replica_lag
+        self.replica_check_interval = replica_check_interval
+        self.aws_bucket = aws_bucket
         self.bucket_subpath = bucket_subpath
+        self.s3_workers = s3_workers
+        self.manifest_dir = manifest_dir
+        #Frames are written with increasing key names in their folders,
+        #so recounts may skip the keys they listed before
+        self.s3_sorted_keys = s3_sorted_keys
+        #The engine, S3 clients and listener are created on first use in each
+        #process, so the app can be imported and forked (gunicorn) cheaply
+        self._engine = None
+        self._frame_bucket = None
+        self._frame_counter = None
+        self._scheduler = None
+        self._aggregates = None
+        self._schema = None
+        self._router = None
+        self._pid = os.getpid()
+        self._init_lock = threading.RLock()
+        #Table snapshots shared by every caller of get_table in this process,
+        #or with cache_backend 'shared' by every process on the host
+        if cache_backend == 'shared':
+            self.cache = SharedSnapshotCache(ttl=cache_ttl, directory=cache_dir)
+        else:
+            self.cache = SnapshotCache(ttl=cache_ttl)
+        #With compact_snapshots, table snapshots hold categoricals, datetime64
+        #and bools instead of python strings, dates and 0/1 objects
+        self.compact_snapshots = compact_snapshots
+        #With sync_mode 'incremental' data_table is read as deltas past the
+        #last seen updated_at and merged into an in-memory frame
+        self.syncs = {}
+        if sync_mode == 'incremental':
+            self.syncs['data_table'] = IncrementalTableSync(
+                'data_table', transform=self._compact if compact_snapshots else None)
+        #Parsed metadata of every row seen, so refreshes only parse new rows
+        self.metadata_parser = MetadataParser()
+        self._listener = None
+        #Status writes of update_* are queued and batched while a write-behind
+        #queue is open, write_behind=True or {max_pending, max_delay} opens one
+        self.write_behind_queue = None
+        if write_behind:
+            self.write_behind(**(write_behind if isinstance(write_behind, dict) else {}))
+
+    @property
+    def dialect_name(self):
+        '''
+        Database backend of engine_url ('postgresql', 'sqlite', ...), without connecting
+        '''
+        return make_url(self.engine_url).get_backend_name()
+
+    @property
+    def engine(self):
+        with self._init_lock:
+            self._check_pid()
+            if self._engine is None:
+                self._engine = create_engine(self.engine_url, **self.engine_options)
+                metrics.instrument_engine(self._engine)
+            return self._engine
+
+    @property
+    def read_engine(self):
+        '''
+        Engine for reads that may lag a little behind the writes (table
+        snapshots, dashboard queries): the next usable replica, round-robin,
+        or the primary without replicas or when none is usable.
+        '''
+        return self._read_target()[1]
+
+    def _read_target(self, version=None, prefer=None):
+        '''
+        (name, engine) to read from: the replica a data version was read
+        from (or the primary if it is no longer usable), so the queries of
+        a refresh never see older data than its version, else replica
+        prefer if usable, else the next usable replica.
+        '''
+        if not self.replica_urls:
+            return 'primary', self.engine
+        with self._init_lock:
+            self._check_pid()
+            if self._router is None:
+                self._router = ReplicaRouter(self.replica_urls, lambda: self.engine,
+                                             max_lag=self.max_replica_lag,
+                                             check_interval=self.replica_check_interval,
+                                             engine_kwargs=self.engine_options,
+                                             on_engine=metrics.instrument_engine)
+            router = self._router
+        if version is not None:
+            return router.pinned(_version_source(version))
+        return router.pick(prefer)
+
+    @property
+    def frame_bucket(self):
+        with self._init_lock:
+            self._check_pid()
+            if self._frame_bucket is None:
+                import boto3
+                self._frame_bucket = boto3.session.Session().resource('s3').Bucket(self.aws_bucket)
+            return self._frame_bucket
+
+    @property
+    def frame_counter(self):
+        #Parallel frame counting with per-date manifests, for incremental
+        #recounts with s3_sorted_keys
+        with self._init_lock:
+            if self._frame_counter is None or self._pid != os.getpid():
+                self._frame_counter = S3PrefixCounter(self.frame_bucket, max_workers=self.s3_workers,
+                                                      manifest_dir=self.manifest_dir,
+                                                      sorted_keys=self.s3_sorted_keys)
+            return self._frame_counter
+
+    @property
+    def scheduler(self):
+        #Pending-date queries and claims for inference workers
+        with self._init_lock:
+            if self._scheduler is None:
+                self._scheduler = PendingDateScheduler(self.engine, schema=self.schema)
+            return self._scheduler
+
+    @property
+    def schema(self):
+        #Typed tables, keys and indexes, checked on first use and migrated on deploy
+        with self._init_lock:
+            if self._schema is None:
+                self._schema = MLOpsSchema(self.engine)
+            return self._schema
+
+    @property
+    def aggregates(self):
+        #Detection counts per date, model and class for the dashboard
+        with self._init_lock:
+            if self._aggregates is None:
+                self._aggregates = PredictionAggregates(self.engine, schema=self.schema,
+                                                        reader=lambda: self.read_engine)
+            return self._aggregates
+
+    def _check_pid(self):
+        #In a forked child the parent's connections, S3 session and listener
+        #thread can't be used, start over with fresh ones
+        if self._pid == os.getpid():
+            return
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+        if self._router is not None:
+            self._router.dispose(close=False)
+        self._frame_bucket = None
+        self._frame_counter = None
+        self._listener = None
+        self._pid = os.getpid()
     
     def pull_dataset_date(self, pull_strategy, custom_date=None):
         '''
         Fetch the date for which the inference is to be run
         '''
         if pull_strategy=='latest_date':
-            df = self.get_table('data_table')
-            df_sorted = df.loc[df['predictions_done']==False]
-            df_sorted = df.sort_values(by=['date_inlet'], ascending=True)
-            date_inference = str(df_sorted.iloc[-1]['date_inlet'])
+            #Newest date without predictions
+            date_inference = self.scheduler.next_pending(newest_first=True)
         elif pull_strategy=='pull_unprocessed_dates':
-            df = self.get_table('data_table')
-            df_sorted = df.loc[df['predictions_done']==False]
-            df_sorted = df.sort_values(by=['date_inlet'], ascending=False)
-            date_inference = str(df_sorted.iloc[-1]['date_inlet'])
+            #Oldest date without predictions
+            date_inference = self.scheduler.next_pending()
+        elif pull_strategy=='claim_unprocessed_date':
+            #Oldest date without predictions that no other worker is running
+            claimed = self.scheduler.claim(1)
+            date_inference = claimed[0] if claimed else None
         elif pull_strategy=='custom_date':
             #Check if the date entry exists in the data table
-            df = self.get_table('data_table')
-            df_date = df.loc[df['date_inlet']==datetime.strptime(custom_date, '%Y-%m-%d').date()]
-            if len(df_date):
+            if self._date_exists(custom_date):
                 print("Date exists in database.")
                 date_inference = custom_date
             else:
                 print("Sorry! Couldn't find the custom date in data table.")
                 print("Alternatively, looking into bucket for samples for custom date....")
-                count = 0
                 date_prefix = os.path.join(self.bucket_subpath, custom_date)
-                for obj in self.frame_bucket.objects.filter(Prefix=date_prefix):
-                    filename = obj.key
-                    count += 1
+                with metrics.timer('mlops_s3_list_seconds', operation='pull_dataset_date'):
+                    count = self.frame_counter.count(date_prefix, manifest_name=custom_date)
                 
                 if count:
                     self.create_daily_log(custom_date, count)
@@ -62,123 +320,416 @@ class MLOPs_DB_Connect:
                     print("Error: Unable to find the custom date(", custom_date, ")" ,"samples in both database & s3 bucket.")
                     sys.exit()
         
+        if date_inference is None:
+            print("Error: No unprocessed dates found in the data table.")
+            sys.exit()
         return date_inference
+
+    def pending_dates(self, limit=None, newest_first=False):
+        '''
+        Generator over the dates still waiting for inference, in date order
+        '''
+        return self.scheduler.pending_dates(limit=limit, newest_first=newest_first)
+
+    def claim_pending_dates(self, k=1, newest_first=False):
+        '''
+        Claim up to k dates waiting for inference so that no other worker picks them
+        '''
+        return self.scheduler.claim(k, newest_first=newest_first)
+
+    def _date_exists(self, date):
+        with self.engine.connect() as conn:
+            row = conn.execute(DATE_EXISTS, {'date': _to_date(date)}).first()
+        return row is not None
+
+    def release_date(self, date):
+        '''
+        Return a claimed date to the pending pool
+        '''
+        self.scheduler.release(_to_date(date))
     
-    def upload_predictions(self, date, labels_path):
-        #Add all the predictions from the csv file to the mlops database predictions table
+    def upload_predictions(self, date, labels_path, chunksize=100000, model_name=None):
+        #Add all the predictions from the csv file to the mlops database predictions table.
+        #The csv is streamed in chunks of chunksize rows and loaded with COPY on
+        #postgres, so memory stays bounded however large the file is. The
+        #detection counts per class are added to the aggregates in the same
+        #transaction, under model_name or else the model data_table has for the date
         date_inference = (datetime.now().date())
-        annotations_csv = pd.read_csv(labels_path)
-        if len(annotations_csv):
-            annotations_csv = annotations_csv.drop(columns=['imagename'])
-            annotations_csv = annotations_csv.drop(columns=['frame_no'])
-            annotations_csv['date_inlet'] = date
-            annotations_csv['date_inference'] = date_inference
-            annotations_csv = annotations_csv.rename(columns={'video':'image_name'})
-            annotations_csv['bbox_confidence'] = np.nan
-            annotations_csv['class_score'] = np.nan
-            annotations_csv.to_sql('predictions_table', self.engine, if_exists='append', index=False)
+        method = insert_method(self.engine)
+        rows = 0
+        counts = Counter()
+        start = time.time()
+        self._check_schema()
+        self.schema.ensure_partition(date)
+        with self.engine.begin() as conn:
+            for chunk in pd.read_csv(labels_path, chunksize=chunksize):
+                self.aggregates.count_chunk(counts, chunk)
+                chunk = chunk.drop(columns=['imagename'])
+                chunk = chunk.drop(columns=['frame_no'])
+                chunk['date_inlet'] = date
+                chunk['date_inference'] = date_inference
+                chunk = chunk.rename(columns={'video':'image_name'})
+                chunk['bbox_confidence'] = np.nan
+                chunk['class_score'] = np.nan
+                self.schema.ensure_columns('predictions_table', chunk, conn=conn)
+                chunk.to_sql('predictions_table', conn, if_exists='append', index=False, method=method)
+                rows += len(chunk)
+            if rows:
+                if model_name is None:
+                    model_name = conn.execute(text('select min(model_name) from data_table where date_inlet = :date'),
+                                              {'date': _to_date(date)}).scalar()
+                self.aggregates.add(conn, _to_date(date), model_name, counts)
+            notify_change(conn, 'predictions_table')
+            notify_change(conn, 'prediction_counts')
+        if rows:
+            self.cache.invalidate('predictions_table')
+            self.cache.invalidate('prediction_counts')
+            elapsed = time.time() - start
             print("Frame predictions uploaded to MLOps database.")
+            print("Uploaded {} rows in {:.1f}s ({:.0f} rows/sec).".format(rows, elapsed, rows / max(elapsed, 1e-9)))
         
 
-    def update_annotations_info(self, date, labelstudio_projectid):
-        #Add all the annotations to the MLOps database
-        df = self.get_table('data_table')
-        date_formatted  = datetime.strptime(date, "%Y-%m-%d").date() 
-        df_date = df.loc[df['date_inlet']==date_formatted]
-        if len(df_date):
-            df.loc[df['date_inlet']==date_formatted, ['labelstudio_projectid']] = labelstudio_projectid
-
-            df.to_sql('data_table', self.engine, if_exists='replace', index=False)
-            print("Inference start datetime set in mlops db.")
-        else:
-            print("Sorry! but no db entries found for this date.")
-            print("Please first create an entry for this date.")
+    def update_annotations_info(self, date, labelstudio_projectid, model_name=None):
+        #Add all the annotations to the MLOps database, on the row of the
+        #pipeline model_name if given
+        self._set_date_values(date, {'labelstudio_projectid': labelstudio_projectid},
+                              "Annotation project id set in mlops db.", model_name)
         
     def update_daily_count(self, date=None):
         #Get the row with current date and update the sample count by checking the
         #no of entries in aws bucket
-        count = 0
         date = (datetime.now().date()) if date is None else date
         date_prefix = os.path.join(self.bucket_subpath, str(date))
-        for obj in self.frame_bucket.objects.filter(Prefix=date_prefix):
-            filename = obj.key
-            count += 1
+        with metrics.timer('mlops_s3_list_seconds', operation='update_daily_count'):
+            count = self.frame_counter.count(date_prefix, manifest_name=str(date))
         
         if count==0:
             print("No frames found for today!")
         else:
-            #Checks the entry in the database for the date.
-            #If there is already an entry, then replace it, otherwise create new entry
+            #Update the entry for the date if there is one, otherwise create it,
+            #both in the same transaction
             print("Current no of frames:", count)
-            df = self.get_table('data_table')
-            df_date = df.loc[df['date_inlet']==date]
-            
-            if len(df_date):
-                df.loc[df['date_inlet']==date, ['no_of_frames']] = count
-
-                df.to_sql('data_table', self.engine, if_exists='replace', index=False)
-                print("Frames count altered in the mlops db.")
-            else:
-                #Create new entry in the table with the date
-                self.create_daily_log(date, count)
+            self._check_schema()
+            with self.engine.begin() as conn:
+                if self._update_date_row(date, {'no_of_frames': count}, conn=conn):
+                    print("Frames count altered in the mlops db.")
+                else:
+                    self._upsert_daily_count(date, count, conn)
+            self.cache.invalidate('data_table')
     
     def update_inference_info(self, date, model_name, model_version, weights_path):
         #Set the inference start time, model name, model version 
         #in the database for the day inference
-        dt_now = datetime.now()
-        df = self.get_table('data_table')
-        date_formatted  = datetime.strptime(date, "%Y-%m-%d").date() 
-        df_date = df.loc[df['date_inlet']==date_formatted]
-
-        if len(df_date):
-            df.loc[df['date_inlet']==date_formatted, ['datetime_inference_start']] = dt_now
-            df.loc[df['date_inlet']==date_formatted, ['model_name']] = model_name
-            df.loc[df['date_inlet']==date_formatted, ['model_version']] = model_version
-            df.loc[df['date_inlet']==date_formatted, ['weights_path']] = weights_path
-
-            df.to_sql('data_table', self.engine, if_exists='replace', index=False)
-            print("Inference start datetime set in mlops db.")
+        values = {'datetime_inference_start': datetime.now(),
+                  'model_name': model_name,
+                  'model_version': model_version,
+                  'weights_path': weights_path}
+        self._set_date_values(date, values, "Inference start datetime set in mlops db.", model_name)
+
+    def update_inference_end_time(self, date, model_name=None):
+        #Set the inference end time in the database for the day inference,
+        #on the row of the pipeline model_name if given
+        values = {'datetime_inference_end': datetime.now(),
+                  'predictions_done': True}
+        self._set_date_values(date, values, "Inference end datetime set in mlops db.", model_name)
+
+    def update_metadata(self, date, metadata):
+        #Store the metadata dict of the day (e.g. feed_count) as json
+        self._set_date_values(date, {'metadata': dump_metadata(metadata)}, "Metadata set in mlops db.")
+
+    def create_daily_log(self, date, counting, model_name='', model_version='', weights_path='',
+                         metadata=None, conn=None):
+        data_entry = _daily_log_entries({date: counting}, model_name, model_version, weights_path)
+        if metadata is not None:
+            data_entry['metadata'] = dump_metadata(metadata)
+        
+        self._check_schema()
+        if conn is None:
+            with self.engine.begin() as conn:
+                self._insert_daily_log(data_entry, conn)
         else:
-            print("Sorry! but no db entries found for this date.")
-            print("Please first create an entry for this date.")
+            self._insert_daily_log(data_entry, conn)
+        self.cache.invalidate('data_table')
+        print("Daily dataset entry added to the mlops db.")
+
+    def _insert_daily_log(self, data_entry, conn):
+        data_entry['updated_at'] = _db_time(conn)
+        data_entry.to_sql('data_table', conn, if_exists='append', index=False)
+        notify_change(conn, 'data_table')
+
+    def backfill(self, start_date, end_date, progress=print):
+        '''
+        Recount the frames of every date from start_date to end_date with one
+        listing of the bucket subpath, then update the existing data_table
+        rows and upsert the missing ones in a single transaction.
+        '''
+        start_date, end_date = _to_date(start_date), _to_date(end_date)
+        with metrics.timer('mlops_s3_list_seconds', operation='backfill'):
+            counts = self.frame_counter.count_by_date(self.bucket_subpath, start_date, end_date,
+                                                      progress=progress)
+        if not counts:
+            print("No frames found between", start_date, "and", end_date)
+            return {}
+
+        self._check_schema()
+        with self.engine.begin() as conn:
+            now = _db_now(conn.dialect.name)
+            existing = conn.execute(text('select date_inlet from data_table '
+                                         'where date_inlet >= :start and date_inlet <= :end'),
+                                    {'start': start_date, 'end': end_date})
+            existing = {str(row[0])[:10] for row in existing}
+            #Every pipeline's row of a date carries its frame count
+            updates = [{'date_inlet': _to_date(date), 'no_of_frames': count}
+                       for date, count in counts.items() if date in existing]
+            if updates:
+                conn.execute(text('update data_table set no_of_frames = :no_of_frames, '
+                                  'updated_at = ' + now + ' where date_inlet = :date_inlet'), updates)
+            missing = {date: count for date, count in counts.items() if date not in existing}
+            if missing and self.schema.has_unique_key:
+                #A worker creating one of the dates meanwhile turns its insert
+                #into an update instead of aborting the whole backfill
+                conn.execute(_upsert_daily_count_statement(conn.dialect.name),
+                             [{'date_inlet': _to_date(date), 'no_of_frames': count}
+                              for date, count in missing.items()])
+            elif missing:
+                #Duplicate rows kept the key from being created, no conflict target
+                _daily_log_entries(missing, updated_at=_db_time(conn)).to_sql('data_table', conn, if_exists='append', index=False)
+            notify_change(conn, 'data_table')
+        self.cache.invalidate('data_table')
+        if progress is not None:
+            progress("Backfill done: {} dates updated, {} created".format(len(updates), len(missing)))
+        return counts
+
+    def write_behind(self, max_pending=100, max_delay=5.0):
+        '''
+        Open (once) and return the write-behind queue: from now on the
+        update_* status writes are merged per row and written in batches
+        of max_pending rows or after max_delay seconds. Leaving
+            with db.write_behind():
+        or calling flush() makes sure everything queued is written.
+        '''
+        with self._init_lock:
+            if self.write_behind_queue is None or self.write_behind_queue.closed:
+                self.write_behind_queue = WriteBehindQueue(self, max_pending, max_delay).start()
+            return self.write_behind_queue
+
+    def flush(self):
+        '''
+        Write the queued status updates, if a write-behind queue is open.
+        '''
+        if self.write_behind_queue is not None:
+            self.write_behind_queue.flush()
 
-    def update_inference_end_time(self, date):
-        #Set the inference start time in the database for the day inference
-        dt_now = datetime.now()
-        df = self.get_table('data_table')
-        date_formatted  = datetime.strptime(date, "%Y-%m-%d").date() 
-        df_date = df.loc[df['date_inlet']==date_formatted]
-        if len(df_date):
-            df.loc[df['date_inlet']==date_formatted, ['datetime_inference_end']] = dt_now
-            df.loc[df['date_inlet']==date_formatted, ['predictions_done']] = True
-
-            df.to_sql('data_table', self.engine, if_exists='replace', index=False)
-            print("Inference end datetime set in mlops db.")
+    def _set_date_values(self, date, values, message, model_name=None):
+        queue = self.write_behind_queue
+        if queue is not None and not queue.closed:
+            queue.put((_to_date(date), model_name), values)
+        elif self._update_date_row(date, values, model_name=model_name):
+            print(message)
         else:
             print("Sorry! but no db entries found for this date.")
             print("Please first create an entry for this date.")
 
-    def create_daily_log(self, date, counting, model_name='', model_version='', weights_path=''):
-        data_entry = pd.DataFrame()
-        
-        data_entry = data_entry.append({'date_inlet': date, 
-                                        'predictions_done': False, 
-                                        'no_of_frames': counting, 
-                                        'datetime_inference_start': np.nan, 
-                                        'datetime_inference_end': np.nan,
-                                        'model_name':model_name,
-                                        'model_version':model_version,
-                                        'weights_path':weights_path,
-                                        'labelstudio_projectid':None
-                                        }, 
-                                        ignore_index=True)
-        
-        data_entry.to_sql('data_table', self.engine, if_exists='append', index=False)
+    def _write_batch(self, updates):
+        '''
+        Apply {(date, model_name): {column: value}} to data_table in one
+        transaction and return the (date, model_name) that have no row.
+        '''
+        self._check_schema()
+        missing = []
+        with self.engine.begin() as conn:
+            for (date, model_name), values in updates.items():
+                if not self._update_date_row(date, values, conn=conn, model_name=model_name):
+                    missing.append((date, model_name))
+        self.cache.invalidate('data_table')
+        return missing
+
+    def _upsert_daily_count(self, date, count, conn):
+        '''
+        Insert the data_table row of a new date, or set its frame count if
+        another worker created it in the meantime.
+        '''
+        if not self.schema.has_unique_key:
+            #Duplicate rows kept the key from being created, no conflict target
+            self.create_daily_log(date, count, conn=conn)
+            return
+        #Unlike create_daily_log this can't fail when another worker inserts the date first
+        conn.execute(_upsert_daily_count_statement(conn.dialect.name),
+                     {'date_inlet': _to_date(date), 'no_of_frames': count})
+        notify_change(conn, 'data_table')
         print("Daily dataset entry added to the mlops db.")
+
+    def _update_date_row(self, date, values, conn=None, model_name=None):
+        '''
+        Set the given columns of the data_table row for date (of the pipeline
+        model_name, if given) with a single parameterized UPDATE. Returns
+        False if there is no such row.
+        '''
+        statement, params = _update_date_statement(date, values, self.dialect_name, model_name)
+        if conn is None:
+            self._check_schema()
+            with self.engine.begin() as conn:
+                result = conn.execute(statement, params)
+                if result.rowcount:
+                    notify_change(conn, 'data_table')
+            self.cache.invalidate('data_table')
+        else:
+            result = conn.execute(statement, params)
+            if result.rowcount:
+                notify_change(conn, 'data_table')
+        return result.rowcount > 0
+
+    def _check_schema(self):
+        #Migrations only run on deploy (python -m db.schema), not from here
+        self.schema.check()
     
-    def get_table(self, table_name):
+    def get_table(self, table_name, use_cache=True):
         '''
-        Fetch the full table from the mlops database
-        '''        
-        df = pd.read_sql_query('select * from "{}"'.format(table_name),con=self.engine)
-        return df
\ No newline at end of file
+        Fetch the full table from the mlops database.
+        With use_cache the snapshot is shared with other callers for cache_ttl
+        seconds, as is: copy it before modifying it.
+        '''
+        if not use_cache:
+            return self._read_table(table_name)
+        return self.cache.get((table_name,), lambda: self._read_table(table_name))
+
+    def get_pipeline_runs(self, model_name, since=None, until=None, columns=None, metadata_keys=None,
+                          version=None):
+        '''
+        Fetch the data_table rows of one pipeline (or a list of pipelines),
+        optionally limited to date_inlet in [since, until], with only the
+        requested columns. 'duration' (hours) and 'date_txt' are computed by
+        the database, metadata_keys are extracted from the metadata column
+        into typed columns. Results are shared through the snapshot cache,
+        per version (get_data_version) if given, so a result read before a
+        version was seen is never served for it, and shared as is like
+        get_table's snapshot.
+        '''
+        columns = list(columns or ['date_inlet', 'date_txt', 'duration'])
+        metadata_keys = list(metadata_keys or [])
+        model_names = [model_name] if isinstance(model_name, str) else list(model_name)
+        since = _to_date(since) if since is not None else None
+        until = _to_date(until) if until is not None else None
+        key = ('data_table', 'pipeline_runs', tuple(model_names), since, until, tuple(columns), tuple(metadata_keys),
+               version)
+        return self.cache.get(key, lambda: self._read_pipeline_runs(model_names, since, until, columns,
+                                                                    metadata_keys, self._read_target(version)[1]))
+
+    def _read_pipeline_runs(self, model_names, since, until, columns, metadata_keys=(), engine=None):
+        if metadata_keys:
+            #The raw metadata and the row identity are only fetched to extract from
+            extra = [c for c in ['date_inlet', 'model_name', 'metadata'] if c not in columns]
+            df = self._read_pipeline_runs(model_names, since, until, columns + extra, engine=engine)
+            values = self.metadata_parser.extract(df, metadata_keys)
+            df = df.drop(columns=extra)
+            for key in metadata_keys:
+                df[key] = values[key]
+            return df
+
+        derived = DERIVED_COLUMNS.get(self.dialect_name, DERIVED_COLUMNS['postgresql'])
+        select = []
+        for column in columns:
+            if not _IDENTIFIER.match(column):
+                raise ValueError("Invalid column name: {}".format(column))
+            if column in derived:
+                select.append('{} as "{}"'.format(derived[column], column))
+            else:
+                select.append('"{}"'.format(column))
+
+        conditions = ['model_name in :model_names']
+        params = {'model_names': model_names}
+        if since is not None:
+            conditions.append('date_inlet >= :since')
+            params['since'] = since
+        if until is not None:
+            conditions.append('date_inlet <= :until')
+            params['until'] = until
+        query = text('select {} from data_table where {} order by date_inlet'.format(
+            ', '.join(select), ' and '.join(conditions))).bindparams(bindparam('model_names', expanding=True))
+        return pd.read_sql_query(query, con=engine or self.read_engine, params=params,
+                                 parse_dates=[c for c in columns if c in DATETIME_COLUMNS])
+
+    def get_data_version(self, previous=None):
+        '''
+        Cheap fingerprint of data_table: its row count and the latest row
+        version, date and run times, plus the same for the prediction
+        aggregates, as one string. It changes whenever a row is added or
+        removed or written by this class, so clients can skip refreshing
+        while it stays the same. Cached like the snapshots.
+
+        With replicas the string starts with the database it was read from,
+        and the reads given it as version go to the same one. previous (the
+        version a client has) keeps a client on its replica while usable,
+        so its versions don't flip between replicas with different lags.
+        '''
+        prefer = _version_source(previous) if previous is not None else None
+        source, engine = self._read_target(prefer=prefer)
+        return '{}|{}|{}'.format(
+            source,
+            self.cache.get(('data_table', 'version', source), lambda: self._read_data_version(engine)),
+            self.cache.get(('prediction_counts', 'version', source), lambda: self.aggregates.version(engine)))
+
+    def get_prediction_counts(self, since=None, until=None, model_name=None, version=None):
+        '''
+        Detections per date_inlet, model_name and class_name from the
+        prediction aggregates, optionally limited to date_inlet in
+        [since, until] and to a pipeline (or a list of pipelines). Cached
+        per version like get_pipeline_runs.
+        '''
+        since = _to_date(since) if since is not None else None
+        until = _to_date(until) if until is not None else None
+        model_names = None
+        if model_name is not None:
+            model_names = (model_name,) if isinstance(model_name, str) else tuple(model_name)
+        key = ('prediction_counts', since, until, model_names, version)
+        return self.cache.get(key, lambda: self.aggregates.read(since, until, model_names,
+                                                                engine=self._read_target(version)[1]))
+
+    def refresh_prediction_aggregates(self, dates=None, progress=print):
+        '''
+        Aggregate the predictions of the dates (default: the dates of
+        predictions_table past the newest aggregated one) for rows that did
+        not come through upload_predictions. Meant to run as a periodic job.
+        '''
+        dates = self.aggregates.refresh(dates, progress=progress)
+        if dates:
+            with self.engine.begin() as conn:
+                notify_change(conn, 'prediction_counts')
+            self.cache.invalidate('prediction_counts')
+        return dates
+
+    def _read_data_version(self, engine=None):
+        self._check_schema()
+        #One subquery per aggregate, so each max() reads the end of its index
+        query = text('select ' + ', '.join('(select {} from data_table)'.format(aggregate) for aggregate in (
+            'count(*)', 'max(updated_at)', 'max(date_inlet)',
+            'max(datetime_inference_start)', 'max(datetime_inference_end)')))
+        with (engine or self.read_engine).connect() as conn:
+            row = conn.execute(query).fetchone()
+        return '|'.join(str(value) for value in row)
+
+    def change_listener(self):
+        '''
+        Start (once per process) and return the listener for change
+        notifications sent by the write methods, or None if the database
+        can't deliver them (anything but postgres). Notified tables are
+        dropped from the snapshot cache straight away.
+        '''
+        if self.dialect_name != 'postgresql':
+            return None
+        with self._init_lock:
+            self._check_pid()
+            if self._listener is None:
+                self._listener = ChangeListener(self.engine)
+                self._listener.subscribe(self.cache.invalidate)
+                self._listener.start()
+        return self._listener
+
+    def _read_table(self, table_name):
+        if table_name in self.syncs:
+            return self.syncs[table_name].refresh(self.read_engine).copy()
+        df = pd.read_sql_query('select * from "{}"'.format(table_name),con=self.read_engine)
+        return self._compact(df) if self.compact_snapshots else df
+
+    def _compact(self, df):
+        return compact_frame(df, datetime_columns=DATETIME_COLUMNS, bool_columns=BOOL_COLUMNS)
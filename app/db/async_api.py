@@ -0,0 +1,249 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+from sqlalchemy.engine import make_url
+from .api_db import (MLOPs_DB_Connect, DATE_EXISTS, _daily_log_entries, _db_time, _to_date,
+                     _update_date_statement, _upsert_daily_count_statement)
+from .metadata import dump_metadata
+from .metrics import REGISTRY as metrics
+from .notify import CHANNEL, NOTIFY
+from .scheduler import claim_query, default_worker, pending_query
+
+#Async driver of every database backend
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+
+def async_url(engine_url):
+    '''
+    engine_url with the async driver of its backend, e.g.
+    postgresql://... -> postgresql+asyncpg://...
+    '''
+    url = make_url(engine_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError("No async driver for {} databases".format(backend))
+    return url.set(drivername='{}+{}'.format(backend, ASYNC_DRIVERS[backend]))
+
+
+class AsyncMLOPs_DB_Connect:
+    """
+    asyncio version of MLOPs_DB_Connect for pipeline workers, so the
+    operations of many dates can run concurrently from one event loop:
+
+        db = AsyncMLOPs_DB_Connect(**config)
+        await asyncio.gather(*(db.update_daily_count(date) for date in dates))
+
+    Status reads and writes run on an async SQLAlchemy engine (asyncpg or
+    aiosqlite) whose pool bounds the open connections (pool_size +
+    max_overflow), with the same statements as MLOPs_DB_Connect. Work that
+    is CPU or blocking I/O bound runs in worker threads: S3 frame counting
+    (at most s3_concurrency prefixes at a time, each listed by s3_workers
+    threads), prediction csv uploads and get_table, which go through the
+    wrapped MLOPs_DB_Connect (`sync`) and share its snapshot cache.
+    """
+
+    def __init__(self, hostname, username, port, password, database, aws_bucket, bucket_subpath,
+                 pool_size=5, max_overflow=5, pool_timeout=30, s3_concurrency=4, **kwargs):
+        self.sync = MLOPs_DB_Connect(hostname, username, port, password, database,
+                                     aws_bucket, bucket_subpath, **kwargs)
+        self.bucket_subpath = bucket_subpath
+        self.pool_options = dict(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+        self.s3_concurrency = s3_concurrency
+        self._engine = None
+        self._s3_slots = None
+        self._schema_ready = None
+
+    @property
+    def engine(self):
+        #Created on first use, inside the event loop that will use it
+        if self._engine is None:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            self._engine = create_async_engine(async_url(self.sync.engine_url), **self.pool_options)
+        return self._engine
+
+    async def close(self):
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+        self.sync.flush()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _check_schema(self):
+        #The schema check is sync (inspection), run it once in a thread. A task,
+        #unlike the coroutine, can be awaited by every concurrent caller
+        if self._schema_ready is None:
+            self._schema_ready = asyncio.ensure_future(asyncio.to_thread(self.sync.schema.check))
+        try:
+            await self._schema_ready
+        except RuntimeError:
+            #Check again next time, the database may be migrated meanwhile
+            self._schema_ready = None
+            raise
+
+    async def _notify(self, conn, table_name):
+        if conn.dialect.name == 'postgresql':
+            await conn.execute(NOTIFY, {'channel': CHANNEL, 'table_name': table_name})
+
+    async def count_frames(self, date, operation='update_daily_count'):
+        '''
+        Number of frames of date in the bucket, counted in a thread.
+        '''
+        if self._s3_slots is None:
+            self._s3_slots = asyncio.Semaphore(self.s3_concurrency)
+        date_prefix = os.path.join(self.bucket_subpath, str(date))
+        async with self._s3_slots:
+            with metrics.timer('mlops_s3_list_seconds', operation=operation):
+                return await asyncio.to_thread(self.sync.frame_counter.count, date_prefix,
+                                               manifest_name=str(date))
+
+    async def pull_dataset_date(self, pull_strategy, custom_date=None):
+        '''
+        Fetch the date for which the inference is to be run
+        '''
+        await self._check_schema()
+        date_inference = None
+        if pull_strategy in ('latest_date', 'pull_unprocessed_dates'):
+            #Newest or oldest date without predictions
+            async with self.engine.connect() as conn:
+                result = await conn.execute(pending_query(newest_first=pull_strategy == 'latest_date'),
+                                            {'size': 1})
+                row = result.first()
+            date_inference = str(row[0]) if row else None
+        elif pull_strategy == 'claim_unprocessed_date':
+            #Oldest date without predictions that no other worker is running
+            claimed = await self.claim_pending_dates(1)
+            date_inference = claimed[0] if claimed else None
+        elif pull_strategy == 'custom_date':
+            if await self._date_exists(custom_date):
+                print("Date exists in database.")
+                date_inference = custom_date
+            else:
+                print("Sorry! Couldn't find the custom date in data table.")
+                print("Alternatively, looking into bucket for samples for custom date....")
+                count = await self.count_frames(custom_date, operation='pull_dataset_date')
+                if count:
+                    await self.create_daily_log(custom_date, count)
+                    date_inference = custom_date
+                else:
+                    print("Error: Unable to find the custom date(", custom_date, ")" ,"samples in both database & s3 bucket.")
+                    sys.exit()
+
+        if date_inference is None:
+            print("Error: No unprocessed dates found in the data table.")
+            sys.exit()
+        return date_inference
+
+    async def claim_pending_dates(self, k=1, newest_first=False):
+        '''
+        Claim up to k dates waiting for inference so that no other worker picks them
+        '''
+        await self._check_schema()
+        now = datetime.now()
+        query = claim_query(newest_first, skip_locked=self.engine.dialect.name == 'postgresql')
+        async with self.engine.begin() as conn:
+            result = await conn.execute(query, {'now': now, 'worker': default_worker(),
+                                                'expired': now - self.sync.scheduler.lease, 'k': k})
+            rows = result.fetchall()
+        return sorted({str(row[0]) for row in rows}, reverse=newest_first)
+
+    async def _date_exists(self, date):
+        async with self.engine.connect() as conn:
+            result = await conn.execute(DATE_EXISTS, {'date': _to_date(date)})
+            return result.first() is not None
+
+    async def update_daily_count(self, date=None):
+        #Count the frames of the date in the bucket and store the count in its
+        #data_table row, creating it if needed
+        date = (datetime.now().date()) if date is None else date
+        count = await self.count_frames(date)
+        if count == 0:
+            print("No frames found for {}!".format(date))
+            return
+        print("Current no of frames:", count)
+        await self._check_schema()
+        async with self.engine.begin() as conn:
+            if await self._update_date_row(conn, date, {'no_of_frames': count}):
+                print("Frames count altered in the mlops db.")
+            elif self.sync.schema.has_unique_key:
+                await conn.execute(_upsert_daily_count_statement(conn.dialect.name),
+                                   {'date_inlet': _to_date(date), 'no_of_frames': count})
+                await self._notify(conn, 'data_table')
+                print("Daily dataset entry added to the mlops db.")
+            else:
+                await self._create_daily_log(conn, date, count)
+        self.sync.cache.invalidate('data_table')
+
+    async def update_annotations_info(self, date, labelstudio_projectid, model_name=None):
+        await self._set_date_values(date, {'labelstudio_projectid': labelstudio_projectid},
+                                    "Annotation project id set in mlops db.", model_name)
+
+    async def update_inference_info(self, date, model_name, model_version, weights_path):
+        values = {'datetime_inference_start': datetime.now(),
+                  'model_name': model_name,
+                  'model_version': model_version,
+                  'weights_path': weights_path}
+        await self._set_date_values(date, values, "Inference start datetime set in mlops db.")
+
+    async def update_inference_end_time(self, date, model_name=None):
+        values = {'datetime_inference_end': datetime.now(),
+                  'predictions_done': True}
+        await self._set_date_values(date, values, "Inference end datetime set in mlops db.", model_name)
+
+    async def update_metadata(self, date, metadata):
+        await self._set_date_values(date, {'metadata': dump_metadata(metadata)}, "Metadata set in mlops db.")
+
+    async def create_daily_log(self, date, counting, model_name='', model_version='', weights_path='',
+                               metadata=None):
+        await self._check_schema()
+        async with self.engine.begin() as conn:
+            await self._create_daily_log(conn, date, counting, model_name, model_version, weights_path, metadata)
+        self.sync.cache.invalidate('data_table')
+
+    async def upload_predictions(self, date, labels_path, chunksize=100000, model_name=None):
+        #Parsing the csv and COPY are blocking, the upload runs in a thread
+        #with MLOPs_DB_Connect.upload_predictions
+        await asyncio.to_thread(self.sync.upload_predictions, date, labels_path,
+                                chunksize=chunksize, model_name=model_name)
+
+    async def get_table(self, table_name, use_cache=True):
+        '''
+        Fetch the full table, read and built into a DataFrame in a thread.
+        '''
+        return await asyncio.to_thread(self.sync.get_table, table_name, use_cache)
+
+    async def _set_date_values(self, date, values, message, model_name=None):
+        await self._check_schema()
+        async with self.engine.begin() as conn:
+            updated = await self._update_date_row(conn, date, values, model_name)
+        if updated:
+            self.sync.cache.invalidate('data_table')
+            print(message)
+        else:
+            print("Sorry! but no db entries found for {}.".format(date))
+            print("Please first create an entry for this date.")
+
+    async def _update_date_row(self, conn, date, values, model_name=None):
+        statement, params = _update_date_statement(date, values, conn.dialect.name, model_name)
+        result = await conn.execute(statement, params)
+        if result.rowcount:
+            await self._notify(conn, 'data_table')
+        return result.rowcount > 0
+
+    async def _create_daily_log(self, conn, date, counting, model_name='', model_version='',
+                                weights_path='', metadata=None):
+        data_entry = _daily_log_entries({date: counting}, model_name, model_version, weights_path)
+        if metadata is not None:
+            data_entry['metadata'] = dump_metadata(metadata)
+        #to_sql needs a sync connection, run_sync hands it the one of this transaction
+        def insert(sync_conn):
+            data_entry['updated_at'] = _db_time(sync_conn)
+            data_entry.to_sql('data_table', sync_conn, if_exists='append', index=False)
+        await conn.run_sync(insert)
+        await self._notify(conn, 'data_table')
+        print("Daily dataset entry added to the mlops db.")
@@ -0,0 +1,37 @@
+import csv
+from io import StringIO
+
+
+def psql_insert_copy(table, conn, keys, data_iter):
+    '''
+    DataFrame.to_sql insertion method that loads the rows with PostgreSQL
+    COPY FROM STDIN instead of INSERT statements.
+    '''
+    buffer = StringIO()
+    csv.writer(buffer).writerows(data_iter)
+    buffer.seek(0)
+
+    columns = ', '.join('"{}"'.format(k) for k in keys)
+    table_name = '"{}"."{}"'.format(table.schema, table.name) if table.schema else '"{}"'.format(table.name)
+    sql = 'COPY {} ({}) FROM STDIN WITH CSV'.format(table_name, columns)
+
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        if hasattr(cur, 'copy_expert'):
+            #psycopg2
+            cur.copy_expert(sql=sql, file=buffer)
+        else:
+            #psycopg 3
+            with cur.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
+def insert_method(bind):
+    '''
+    Fastest to_sql method for the database behind bind (engine or connection):
+    COPY on postgres with a psycopg driver, plain executemany batches otherwise.
+    '''
+    dialect = bind.dialect
+    if dialect.name == 'postgresql' and dialect.driver in ('psycopg2', 'psycopg'):
+        return psql_insert_copy
+    return None
@@ -0,0 +1,288 @@
+import fcntl
+import hashlib
+import os
+import pickle
+from stat import S_ISDIR
+import tempfile
+import threading
+import time
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+class SnapshotCache:
+    """
+    Process-wide cache of query results with a time-to-live.
+
+    Concurrent callers asking for the same key while it is being loaded
+    wait for the in-flight load instead of issuing their own query
+    (single-flight), so N dashboard callbacks cost one query per TTL.
+    Keys are tuples whose first element is the table the result was read
+    from, which is what `invalidate` matches on.
+    """
+
+    def __init__(self, ttl=5):
+        self.ttl = float(ttl)
+        self._entries = {}
+        self._inflight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        '''
+        Return the cached value for key, calling loader() if it is missing
+        or older than the TTL.
+        '''
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                    return entry[1]
+                done = self._inflight.get(key)
+                if done is None:
+                    done = self._inflight[key] = threading.Event()
+                    generation = self._generation
+                    break
+            # Another thread is loading this key, wait for it and re-check.
+            done.wait()
+
+        try:
+            value = loader()
+            with self._lock:
+                # Don't keep a result that was read before an invalidation.
+                if generation == self._generation:
+                    now = time.monotonic()
+                    # Expired entries would be loaded again anyway, drop them
+                    # so keys that are never asked again (e.g. old data
+                    # versions) don't pile up.
+                    for stale in [k for k, e in self._entries.items() if now - e[0] >= self.ttl]:
+                        del self._entries[stale]
+                    self._entries[key] = (now, value)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            done.set()
+
+    def invalidate(self, table_name=None):
+        '''
+        Drop every entry read from table_name, or everything if no table is given.
+        '''
+        with self._lock:
+            self._generation += 1
+            if table_name is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == table_name]:
+                    del self._entries[key]
+
+
+class SharedSnapshotCache:
+    """
+    Snapshot cache shared by every worker process on a host through files
+    in a common directory, preferably on tmpfs (/dev/shm).
+
+    When an entry is older than the TTL one worker, elected by an exclusive
+    flock on the entry's lock file, runs the loader and replaces the file;
+    the other workers keep serving the previous file meanwhile, or wait for
+    the refresher if there is none yet. So the database sees one query per
+    TTL per host, whatever the number of workers.
+
+    DataFrames are stored as Arrow IPC files and memory-mapped when pyarrow
+    is installed, other values (e.g. prebuilt figures) are pickled. Each
+    process remembers the value it read last per file, so a snapshot is
+    only converted once per refresh in each worker, and hands out that
+    same value: callers copy a frame before modifying it.
+
+    Since pickles are loaded from it, the directory must belong to the
+    user running the workers and be private to it (mode 0700). As in
+    SnapshotCache, a value loaded before an invalidate is not stored.
+    """
+
+    def __init__(self, ttl=5, directory=None):
+        self.ttl = float(ttl)
+        if directory is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            directory = os.path.join(base, 'mlops-dashboard-{}'.format(os.getuid()))
+        self.directory = directory
+        _private_directory(self.directory)
+        #Bumped by invalidate, see _write
+        self._generation_path = os.path.join(self.directory, 'generation')
+        #Entries not refreshed for this long are removed, e.g. the ones of
+        #old data versions, checked at most this often by each process
+        self.expire_after = max(60.0, 10 * self.ttl)
+        self._pruned = time.time()
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        '''
+        Return the shared value for key, calling loader() if this process is
+        elected to refresh a missing or expired entry.
+        '''
+        path = self._path(key)
+        stat = _stat(path)
+        if self._fresh(stat):
+            value = self._read(path, stat)
+            if value is not _MISSING:
+                return value
+
+        with open(path + '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                #Another worker is refreshing, serve the previous snapshot
+                #if there is one, otherwise wait for the new one
+                value = self._read(path, stat) if stat is not None else _MISSING
+                if value is not _MISSING:
+                    return value
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                #It may have been refreshed while we were getting the lock
+                stat = _stat(path)
+                if self._fresh(stat):
+                    value = self._read(path, stat)
+                    if value is not _MISSING:
+                        return value
+                generation = self._generation()
+                value = loader()
+                self._write(path, value, generation)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        if time.time() - self._pruned > self.expire_after:
+            self._prune()
+        return value
+
+    def invalidate(self, table_name=None):
+        '''
+        Remove every entry read from table_name, or everything if no table is given.
+        '''
+        prefix = None if table_name is None else _safe_name(table_name) + '-'
+        with open(self._generation_path + '.lock', 'a') as lock:
+            #Writers check the generation under a shared lock, so none can
+            #store a value loaded before this once it is bumped
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            tmp = '{}.{}.tmp'.format(self._generation_path, os.getpid())
+            with open(tmp, 'w') as fo:
+                fo.write(str(int(self._generation() or 0) + 1))
+            os.replace(tmp, self._generation_path)
+            for name in os.listdir(self.directory):
+                if name.endswith(('.arrow', '.pickle')) and (prefix is None or name.startswith(prefix)):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+    def _prune(self):
+        self._pruned = now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(('.arrow', '.pickle')):
+                continue
+            try:
+                if now - os.stat(path).st_mtime < self.expire_after:
+                    continue
+                with open(path.rsplit('.', 1)[0] + '.lock', 'a') as lock:
+                    #Leave entries some worker is refreshing
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(path)
+                    os.remove(lock.name)
+            except (FileNotFoundError, BlockingIOError):
+                continue
+        with self._lock:
+            self._loaded = {p: v for p, v in self._loaded.items() if _stat(p) is not None}
+
+    def _generation(self):
+        try:
+            with open(self._generation_path) as fo:
+                return fo.read()
+        except FileNotFoundError:
+            return ''
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, '{}-{}'.format(_safe_name(key[0]), digest))
+
+    def _fresh(self, stat):
+        return stat is not None and time.time() - stat.st_mtime < self.ttl
+
+    def _read(self, path, stat):
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            loaded = self._loaded.get(path)
+        if loaded is not None and loaded[0] == signature:
+            return loaded[1]
+        try:
+            if stat.kind == 'arrow':
+                with pa.memory_map(path + '.arrow') as source:
+                    value = pa.ipc.open_file(source).read_all().to_pandas()
+            else:
+                with open(path + '.pickle', 'rb') as fo:
+                    value = pickle.load(fo)
+        except FileNotFoundError:
+            #Invalidated in the meantime
+            return _MISSING
+        with self._lock:
+            self._loaded[path] = (signature, value)
+        return value
+
+    def _write(self, path, value, generation):
+        if pa is not None and isinstance(value, pd.DataFrame):
+            target = path + '.arrow'
+            table = pa.Table.from_pandas(value, preserve_index=False)
+            tmp = '{}.{}.tmp'.format(target, os.getpid())
+            with pa.OSFile(tmp, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            target = path + '.pickle'
+            tmp = '{}.{}.tmp'.format(target, os.getpid())
+            with open(tmp, 'wb') as fo:
+                pickle.dump(value, fo, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self._generation_path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            if self._generation() == generation:
+                os.replace(tmp, target)
+            else:
+                #Invalidated while loading, the value may predate the change
+                os.remove(tmp)
+
+
+_MISSING = object()
+
+
+class _Stat:
+    def __init__(self, stat, kind):
+        self.st_mtime = stat.st_mtime
+        self.st_mtime_ns = stat.st_mtime_ns
+        self.st_size = stat.st_size
+        self.kind = kind
+
+
+def _stat(path):
+    for kind in ('arrow', 'pickle'):
+        try:
+            return _Stat(os.stat('{}.{}'.format(path, kind)), kind)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _private_directory(directory):
+    #Create the directory for this user only, or make sure an existing one
+    #(e.g. under the world-writable /dev/shm) is this user's and private
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    stat = os.lstat(directory)
+    if not S_ISDIR(stat.st_mode):
+        raise PermissionError("{} is not a directory".format(directory))
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise PermissionError("{} must belong to uid {} with mode 0700 (it has uid {}, mode {:o})".format(
+            directory, os.getuid(), stat.st_uid, stat.st_mode & 0o777))
+
+
+def _safe_name(name):
+    return ''.join(c if c.isalnum() or c == '_' else '_' for c in str(name))
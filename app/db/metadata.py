@@ -0,0 +1,72 @@
+import ast
+import json
+import threading
+import pandas as pd
+
+
+def parse_metadata(raw):
+    '''
+    Parse a metadata value into a dict. New rows store json, legacy rows a
+    python dict literal. Returns None if the value can't be parsed.
+    '''
+    if isinstance(raw, dict):
+        return raw
+    if raw is None or (isinstance(raw, float) and pd.isnull(raw)):
+        return {}
+    try:
+        value = json.loads(raw)
+    except (TypeError, ValueError):
+        try:
+            value = ast.literal_eval(raw)
+        except (SyntaxError, ValueError, TypeError, MemoryError, RecursionError):
+            return None
+    return value if isinstance(value, dict) else None
+
+
+def dump_metadata(metadata):
+    '''
+    Serialize metadata for the metadata column (json, so postgres can cast it to jsonb).
+    '''
+    return None if metadata is None else json.dumps(metadata, default=str)
+
+
+class MetadataParser:
+    """
+    Extracts keys from the metadata column, parsing each row only once.
+
+    Parsed values are cached by row identity together with the raw string,
+    so a refresh only parses rows that are new or whose metadata changed.
+    Malformed metadata gives missing values for that row instead of failing.
+    """
+
+    def __init__(self):
+        self._parsed = {}
+        self._lock = threading.Lock()
+
+    def extract(self, frame, keys, column='metadata', identity_columns=('date_inlet', 'model_name')):
+        '''
+        Return a frame with one column per key, aligned with frame. Values
+        are made numeric where every present value is a number.
+        '''
+        identity_columns = [c for c in identity_columns if c in frame.columns]
+        identities = zip(*[frame[c] for c in identity_columns]) if identity_columns else iter(frame.index)
+        with self._lock:
+            parsed = [self._parse(identity, raw) for identity, raw in zip(identities, frame[column])]
+
+        values = pd.DataFrame.from_records(parsed, columns=list(keys), index=frame.index)
+        for key in keys:
+            numeric = pd.to_numeric(values[key], errors='coerce')
+            if numeric.notnull().sum() == values[key].notnull().sum():
+                values[key] = numeric
+        return values
+
+    def _parse(self, identity, raw):
+        cached = self._parsed.get(identity)
+        if cached is not None and cached[0] == raw:
+            return cached[1]
+        value = parse_metadata(raw)
+        if value is None:
+            print("Skipping malformed metadata for row", identity)
+            value = {}
+        self._parsed[identity] = (raw, value)
+        return value
@@ -0,0 +1,120 @@
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+#Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+
+@contextmanager
+def _null_timer():
+    yield
+
+
+class MetricsRegistry:
+    """
+    Latency histograms rendered in the Prometheus text format.
+
+    When disabled, `timer` returns a no-op context manager, `timed` returns
+    the function unchanged and `instrument_engine` attaches nothing, so the
+    instrumented code paths cost next to nothing.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def timer(self, name, **labels):
+        '''
+        Context manager recording the time spent in its block.
+        '''
+        if not self.enabled:
+            return _null_timer()
+        return self._timer(name, labels)
+
+    @contextmanager
+    def _timer(self, name, labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        '''
+        Decorator recording the duration of every call of the function.
+        '''
+        def decorator(fn):
+            if not self.enabled:
+                return fn
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self._timer(name, labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def instrument_engine(self, engine):
+        '''
+        Record the latency of every statement run on engine, by statement type.
+        '''
+        if not self.enabled:
+            return
+        from sqlalchemy import event
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            context._mlops_query_start = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - context._mlops_query_start
+            words = statement.split(None, 1)
+            self.observe('mlops_db_query_seconds', elapsed,
+                         statement=words[0].upper() if words else '')
+
+    def render(self):
+        '''
+        All histograms in the Prometheus text exposition format (0.0.4).
+        '''
+        with self._lock:
+            items = sorted((key, dict(h, buckets=list(h['buckets']))) for key, h in self._histograms.items())
+        lines = []
+        previous_name = None
+        for (name, labels), histogram in items:
+            if name != previous_name:
+                lines.append('# TYPE {} histogram'.format(name))
+                previous_name = name
+            for bound, count in zip(BUCKETS, histogram['buckets']):
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', le),)), count))
+            lines.append('{}_sum{} {}'.format(name, _labels(labels), histogram['sum']))
+            lines.append('{}_count{} {}'.format(name, _labels(labels), histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+#Shared by the database layer and the dashboard, switched on with MLOPS_METRICS=1
+REGISTRY = MetricsRegistry(enabled=os.environ.get('MLOPS_METRICS', '0').lower() not in ('0', 'false', ''))
@@ -0,0 +1,104 @@
+import select
+import threading
+from sqlalchemy import text
+
+CHANNEL = 'mlops_data_changed'
+NOTIFY = text('select pg_notify(:channel, :table_name)')
+
+
+def notify_change(conn, table_name):
+    '''
+    Announce a change to table_name on the CHANNEL of a postgres database.
+    Called inside the writing transaction, so listeners hear it on commit.
+    '''
+    if conn.dialect.name == 'postgresql':
+        conn.execute(NOTIFY, {'channel': CHANNEL, 'table_name': table_name})
+
+
+class ChangeListener:
+    """
+    Background thread that LISTENs on CHANNEL and counts the notifications.
+
+    `version` goes up by one per change. Waiters block in `wait` until it
+    moves past the version they have seen, and callbacks registered with
+    `subscribe` get the changed table name. The connection is re-opened
+    after errors, counting a reconnect as a change since notifications
+    may have been missed meanwhile.
+    """
+
+    def __init__(self, engine, channel=CHANNEL, reconnect_delay=5):
+        self.engine = engine
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.version = 0
+        self._subscribers = []
+        self._changed = threading.Condition()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='mlops-change-listener', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def wait(self, seen_version, timeout=None):
+        '''
+        Block until the version differs from seen_version or timeout passes,
+        and return the current version.
+        '''
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != seen_version, timeout=timeout)
+            return self.version
+
+    def _publish(self, table_name):
+        for callback in self._subscribers:
+            try:
+                callback(table_name)
+            except Exception as exc:
+                print("Change listener callback failed:", exc)
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def _run(self):
+        first = True
+        while not self._stopped.is_set():
+            try:
+                conn = self.engine.raw_connection()
+                try:
+                    dbapi_conn = conn.dbapi_connection
+                    dbapi_conn.autocommit = True
+                    with dbapi_conn.cursor() as cur:
+                        cur.execute('LISTEN "{}"'.format(self.channel))
+                    if not first:
+                        self._publish(None)
+                    first = False
+                    self._listen(dbapi_conn)
+                finally:
+                    conn.invalidate()
+            except Exception as exc:
+                print("Change listener lost its connection:", exc)
+            self._stopped.wait(self.reconnect_delay)
+
+    def _listen(self, dbapi_conn):
+        while not self._stopped.is_set():
+            if hasattr(dbapi_conn, 'poll'):
+                #psycopg2
+                if select.select([dbapi_conn], [], [], 5) == ([], [], []):
+                    continue
+                dbapi_conn.poll()
+                payloads = []
+                while dbapi_conn.notifies:
+                    payloads.append(dbapi_conn.notifies.pop(0).payload)
+            else:
+                #psycopg 3
+                payloads = [n.payload for n in dbapi_conn.notifies(timeout=5)]
+            for payload in payloads:
+                self._publish(payload)
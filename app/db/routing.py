@@ -0,0 +1,160 @@
+import itertools
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+#mlopsDB_config.yaml pool keys -> create_engine arguments
+POOL_OPTIONS = {
+    'size': 'pool_size',
+    'max_overflow': 'max_overflow',
+    'timeout': 'pool_timeout',
+    'pre_ping': 'pool_pre_ping',
+    'recycle': 'pool_recycle',
+}
+#Seconds of WAL replay a postgres standby is behind, 0 when it replayed all it received
+LAG_QUERY = text('''
+    select case when pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() then 0
+                else coalesce(extract(epoch from now() - pg_last_xact_replay_timestamp()), 0)
+           end''')
+
+
+def engine_options(pool=None):
+    '''
+    create_engine keyword arguments for the pool settings of the config
+    ({size, max_overflow, timeout, pre_ping, recycle}).
+    '''
+    options = {}
+    for key, value in (pool or {}).items():
+        if key not in POOL_OPTIONS:
+            raise ValueError("Unknown pool setting: {}".format(key))
+        options[POOL_OPTIONS[key]] = value
+    return options
+
+
+def replica_url(replica, primary):
+    '''
+    Database url of a replica given as a url, or as a dict with an
+    engine_url or the settings (hostname, port, username, password,
+    database) that differ from the primary's.
+    '''
+    if isinstance(replica, str):
+        return replica
+    if replica.get('engine_url'):
+        return replica['engine_url']
+    settings = dict(primary, **replica)
+    return 'postgresql://{username}:{password}@{hostname}:{port}/{database}'.format(**settings)
+
+
+class ReplicaRouter:
+    """
+    Picks the engine of a read-only replica for each read, round-robin.
+
+    Every replica is checked at most every check_interval seconds, when it
+    is next picked: it is skipped while it can't be reached or, on postgres,
+    while its replay lag is above max_lag seconds. When no replica is
+    usable reads go to the primary (the fallback engine).
+
+    Replicas are named 'replica0', 'replica1', ... in the order of urls, and
+    the primary 'primary', so reads that must see the same data (a data
+    version and the queries it triggers) can be pinned to one of them.
+    """
+
+    def __init__(self, urls, fallback, max_lag=30, check_interval=10, engine_kwargs=None,
+                 on_engine=None, connect_timeout=5):
+        self.urls = list(urls)
+        self.fallback = fallback
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.engine_kwargs = dict(engine_kwargs or {})
+        #Called with every new replica engine, e.g. to instrument it
+        self.on_engine = on_engine
+        #So a replica that is down fails the health check quickly
+        self.connect_timeout = connect_timeout
+        self._engines = {}
+        #url -> (checked at, usable, lag or error)
+        self._status = {}
+        self._order = itertools.cycle(range(len(self.urls)))
+        self._lock = threading.Lock()
+
+    def engine(self):
+        '''
+        Engine of the next usable replica, or the fallback engine.
+        '''
+        return self.pick()[1]
+
+    def pick(self, prefer=None):
+        '''
+        (name, engine) of replica prefer if it is usable, else of the next
+        usable replica, else of the primary.
+        '''
+        url = self._url(prefer)
+        if url is not None and self._usable(url):
+            return prefer, self._engine(url)
+        for _ in range(len(self.urls)):
+            with self._lock:
+                i = next(self._order)
+            if self._usable(self.urls[i]):
+                return 'replica{}'.format(i), self._engine(self.urls[i])
+        return 'primary', self.fallback()
+
+    def pinned(self, name):
+        '''
+        (name, engine) of replica name if it is usable, else of the primary,
+        which is never behind it.
+        '''
+        url = self._url(name)
+        if url is not None and self._usable(url):
+            return name, self._engine(url)
+        return 'primary', self.fallback()
+
+    def status(self):
+        '''
+        {replica: (checked at, usable, lag in seconds or the error)} with
+        the passwords hidden.
+        '''
+        return {make_url(url).render_as_string(hide_password=True): status
+                for url, status in self._status.items()}
+
+    def dispose(self, close=True):
+        with self._lock:
+            engines, self._engines = self._engines, {}
+            self._status = {}
+        for engine in engines.values():
+            engine.dispose(close=close)
+
+    def _url(self, name):
+        if not name or not name.startswith('replica') or not name[len('replica'):].isdigit():
+            return None
+        i = int(name[len('replica'):])
+        return self.urls[i] if i < len(self.urls) else None
+
+    def _engine(self, url):
+        with self._lock:
+            if url not in self._engines:
+                kwargs = dict(self.engine_kwargs)
+                if make_url(url).get_backend_name() == 'postgresql':
+                    kwargs.setdefault('connect_args', {'connect_timeout': self.connect_timeout})
+                engine = create_engine(url, **kwargs)
+                if self.on_engine is not None:
+                    self.on_engine(engine)
+                self._engines[url] = engine
+            return self._engines[url]
+
+    def _usable(self, url):
+        status = self._status.get(url)
+        if status is not None and time.monotonic() - status[0] < self.check_interval:
+            return status[1]
+        try:
+            with self._engine(url).connect() as conn:
+                lag = conn.execute(LAG_QUERY if conn.dialect.name == 'postgresql' else text('select 0')).scalar()
+            lag = float(lag or 0)
+            usable = lag <= self.max_lag
+            if not usable:
+                print("Replica {} is {:.0f}s behind, reading from the primary".format(
+                    make_url(url).render_as_string(hide_password=True), lag))
+            self._status[url] = (time.monotonic(), usable, lag)
+        except Exception as exc:
+            print("Replica {} is unavailable: {}".format(make_url(url).render_as_string(hide_password=True), exc))
+            self._status[url] = (time.monotonic(), False, str(exc))
+        return self._status[url][1]
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class S3PrefixCounter:
+    """
+    Counts the objects under an S3 prefix by listing its folders (camera,
+    hour, ... levels) in parallel.
+
+    Every folder level down to max_depth is listed with the '/' delimiter,
+    which returns the keys directly in it and its sub-folders, and the
+    folders below max_depth are listed as a whole. Each of these listings
+    is a shard, and a manifest keeps the count, the last key and a digest
+    of the ETags of every shard.
+
+    S3 lists keys in lexicographic order and a recount can only skip what
+    it listed before when no new key sorts before the shard's last key.
+    That only holds when frames are written with increasing names (e.g.
+    timestamps) into their folder, which sorted_keys declares: recounts
+    then list only the keys after the last one of each leaf folder (a
+    level without sub-folders). Levels with sub-folders and folders below
+    max_depth mix keys of several folders and are always listed in full,
+    as is everything without sorted_keys. Objects deleted or rewritten
+    under an already listed key are only seen with refresh=True.
+    Manifests are kept in memory and, when manifest_dir is set, persisted
+    there as json so they survive restarts.
+    """
+
+    def __init__(self, bucket, max_workers=16, manifest_dir=None, max_depth=4, sorted_keys=False):
+        self.bucket = bucket
+        self.client = bucket.meta.client
+        self.max_workers = max_workers
+        self.manifest_dir = manifest_dir
+        #How many folder levels are listed with the delimiter
+        self.max_depth = max_depth
+        #Whether new keys of a folder always sort after its existing ones
+        self.sorted_keys = sorted_keys
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def count(self, prefix, manifest_name=None, refresh=False):
+        '''
+        Number of objects whose key starts with prefix.
+        manifest_name (e.g. the date) enables incremental recounts.
+        '''
+        manifest = {} if refresh or manifest_name is None else self.load_manifest(manifest_name)
+        previous = manifest.get('shards', {})
+
+        shard_states = {}
+        level = [prefix]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for _ in range(self.max_depth):
+                if not level:
+                    break
+                listed = list(pool.map(lambda p: self._count_level(p, previous.get(p + '|direct')), level))
+                shard_states.update((p + '|direct', state) for p, state in zip(level, listed))
+                level = [folder for state in listed for folder in state['folders']]
+            #Deeper folders as a whole, their keys are never assumed sorted
+            listed = list(pool.map(self._count_folder, level))
+            shard_states.update(zip(level, listed))
+
+        states = list(shard_states.values())
+        manifest = {
+            'prefix': prefix,
+            'count': sum(state['count'] for state in states),
+            'last_key': max([state['last_key'] for state in states if state['last_key']], default=None),
+            'etag_digest': _digest(sorted(state['etag_digest'] for state in states)),
+            'updated': datetime.now().isoformat(),
+            'shards': shard_states,
+        }
+        if manifest_name is not None:
+            self.save_manifest(manifest_name, manifest)
+        return manifest['count']
+
+    def count_by_date(self, prefix, start_date, end_date, progress=print, progress_every=100):
+        '''
+        Count the objects of every date folder under prefix ("<prefix>/YYYY-MM-DD...")
+        from start_date to end_date inclusive, in a single listing pass that
+        starts at start_date and stops after end_date.
+        Returns {'YYYY-MM-DD': count}; progress is called every progress_every pages.
+        '''
+        base = os.path.join(prefix, '')
+        start_date, end_date = str(start_date), str(end_date)
+        counts = Counter()
+        listed = 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=self.bucket.name, Prefix=base, StartAfter=base + start_date)
+        for page_no, page in enumerate(pages, 1):
+            contents = page.get('Contents', [])
+            listed += len(contents)
+            past_end = False
+            for obj in contents:
+                date = obj['Key'][len(base):len(base) + 10]
+                if date > end_date:
+                    past_end = True
+                    break
+                if _DATE.match(date) and date >= start_date:
+                    counts[date] += 1
+            if past_end:
+                break
+            if progress is not None and page_no % progress_every == 0:
+                progress("Listed {} keys, up to {}".format(listed, contents[-1]['Key'] if contents else base))
+        if progress is not None:
+            progress("Listed {} keys, {} dates with frames".format(listed, len(counts)))
+        return dict(counts)
+
+    def load_manifest(self, name):
+        with self._lock:
+            if name in self._manifests:
+                return self._manifests[name]
+        if self.manifest_dir is None:
+            return {}
+        path = self._manifest_path(name)
+        if not os.path.isfile(path):
+            return {}
+        with open(path, 'r') as fo:
+            manifest = json.load(fo)
+        with self._lock:
+            self._manifests[name] = manifest
+        return manifest
+
+    def save_manifest(self, name, manifest):
+        with self._lock:
+            self._manifests[name] = manifest
+        if self.manifest_dir is None:
+            return
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        path = self._manifest_path(name)
+        with open(path + '.tmp', 'w') as fo:
+            json.dump(manifest, fo)
+        os.replace(path + '.tmp', path)
+
+    def _manifest_path(self, name):
+        return os.path.join(self.manifest_dir, '{}.json'.format(str(name).replace('/', '_')))
+
+    def _count_level(self, prefix, state):
+        '''
+        Count the keys directly under prefix (listed with the delimiter) and
+        return them with its sub-folders. A leaf folder with sorted_keys is
+        only listed after the last key counted before.
+        '''
+        incremental = (self.sorted_keys and state is not None and state.get('last_key')
+                       and not state.get('folders'))
+        if not incremental:
+            state = None
+        return self._list(prefix, state, delimiter='/')
+
+    def _count_folder(self, prefix):
+        return self._list(prefix, None)
+
+    def _list(self, prefix, state, delimiter=None):
+        state = state or {'count': 0, 'last_key': None, 'etag_digest': ''}
+        count = state['count']
+        last_key = state['last_key']
+        etags = []
+        folders = []
+
+        kwargs = {'Bucket': self.bucket.name, 'Prefix': prefix}
+        if delimiter:
+            kwargs['Delimiter'] = delimiter
+        if last_key:
+            kwargs['StartAfter'] = last_key
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**kwargs):
+            contents = page.get('Contents', [])
+            count += len(contents)
+            etags.extend(obj.get('ETag', '') for obj in contents)
+            folders.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+            if contents:
+                last_key = max(last_key or '', contents[-1]['Key'])
+        #Chain the new ETags onto the previous digest so it summarises the whole shard
+        etag_digest = _digest([state['etag_digest']] + etags) if etags else state['etag_digest']
+        return {'count': count, 'last_key': last_key, 'etag_digest': etag_digest, 'folders': folders}
+
+
+_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def _digest(values):
+    return hashlib.md5(''.join(values).encode()).hexdigest()
@@ -0,0 +1,129 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from .schema import MLOpsSchema
+
+
+def pending_query(newest_first=False, after=False):
+    '''
+    Pending dates in date order, up to :size of them, past :after if after.
+    Each date once, however many pipelines it has pending rows of.
+    '''
+    order, compare = ('desc', '<') if newest_first else ('asc', '>')
+    condition = 'and date_inlet {} :after'.format(compare) if after else ''
+    return text('select distinct date_inlet from data_table where predictions_done = false {} '
+                'order by date_inlet {} limit :size'.format(condition, order))
+
+
+def claim_query(newest_first=False, skip_locked=False):
+    '''
+    Claim of up to :k pending dates without a live claim (claimed before
+    :expired) for :worker at :now, returning the claimed dates, once per
+    claimed row. Every date is picked (and locked) through one row, its
+    pending row of the lowest model_name, as postgres can't lock the rows
+    of a select distinct. The outer conditions skip the rows another
+    worker claimed meanwhile.
+    '''
+    pending = '''{0}.predictions_done = false
+                  and ({0}.claimed_at is null or {0}.claimed_at < :expired)'''
+    return text('''
+        update data_table set claimed_at = :now, claimed_by = :worker
+        where {pending_row}
+          and date_inlet in (
+            select candidate.date_inlet from data_table as candidate
+            where {pending_candidate}
+              and not exists (
+                select 1 from data_table as other
+                where other.date_inlet = candidate.date_inlet
+                  and {pending_other}
+                  and coalesce(other.model_name, '') < coalesce(candidate.model_name, '')
+              )
+            order by candidate.date_inlet {order}
+            limit :k
+            {lock}
+        )
+        returning date_inlet'''.format(pending_row=pending.format('data_table'),
+                                       pending_candidate=pending.format('candidate'),
+                                       pending_other=pending.format('other'),
+                                       order='desc' if newest_first else 'asc',
+                                       lock='for update skip locked' if skip_locked else ''))
+
+
+def default_worker():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class PendingDateScheduler:
+    """
+    Hands out the dates of data_table that still need inference
+    (predictions_done = false) straight from an index, without reading
+    the table.
+
+    `claim` marks dates as taken with a lease so that several inference
+    workers can drain the backlog in parallel. On postgres the candidate
+    rows are locked with FOR UPDATE SKIP LOCKED, so concurrent claims never
+    return the same date. A claim whose worker died is handed out again
+    once its lease has expired.
+    """
+
+    def __init__(self, engine, lease=timedelta(hours=12), schema=None):
+        self.engine = engine
+        self.lease = lease
+        self.schema = schema or MLOpsSchema(engine)
+
+    def check_schema(self):
+        '''
+        Make sure data_table has the claim columns (see MLOpsSchema.check).
+        '''
+        self.schema.check()
+
+    def next_pending(self, newest_first=False):
+        '''
+        The oldest (or newest) pending date, or None if there is none.
+        '''
+        for date in self.pending_dates(limit=1, newest_first=newest_first):
+            return date
+        return None
+
+    def pending_dates(self, limit=None, newest_first=False, batch_size=500):
+        '''
+        Generator over the pending dates in date order, read from the index
+        in batches of batch_size.
+        '''
+        self.check_schema()
+        after = None
+        returned = 0
+        while limit is None or returned < limit:
+            size = batch_size if limit is None else min(batch_size, limit - returned)
+            query = pending_query(newest_first, after=after is not None)
+            with self.engine.connect() as conn:
+                dates = [row[0] for row in conn.execute(query, {'after': after, 'size': size})]
+            for date in dates:
+                yield str(date)
+            returned += len(dates)
+            if len(dates) < size:
+                return
+            after = dates[-1]
+
+    def claim(self, k=1, newest_first=False, worker=None):
+        '''
+        Atomically claim up to k pending dates that nobody holds a live
+        claim on, and return them as 'YYYY-MM-DD' strings.
+        '''
+        self.check_schema()
+        worker = worker or default_worker()
+        now = datetime.now()
+        query = claim_query(newest_first, skip_locked=self.engine.dialect.name == 'postgresql')
+        with self.engine.begin() as conn:
+            rows = conn.execute(query, {'now': now, 'worker': worker,
+                                        'expired': now - self.lease, 'k': k}).fetchall()
+        return sorted({str(row[0]) for row in rows}, reverse=newest_first)
+
+    def release(self, date):
+        '''
+        Give a claimed date back, e.g. when its inference failed.
+        '''
+        with self.engine.begin() as conn:
+            conn.execute(text('update data_table set claimed_at = null, claimed_by = null '
+                              'where date_inlet = :date'), {'date': date})
@@ -0,0 +1,326 @@
+import threading
+from datetime import date as _date, datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+#Column types of the MLOps tables, in creation order. Tables written by
+#pandas to_sql before had whatever types it inferred, ensure() converts them
+DATA_TABLE_COLUMNS = [
+    ('date_inlet', 'date not null'),
+    ('predictions_done', 'boolean not null default false'),
+    ('no_of_frames', 'bigint'),
+    ('datetime_inference_start', 'timestamp'),
+    ('datetime_inference_end', 'timestamp'),
+    ('model_name', "text not null default ''"),
+    ('model_version', 'text'),
+    ('weights_path', 'text'),
+    ('labelstudio_projectid', 'bigint'),
+    ('no_of_samples', 'bigint'),
+    ('metadata', 'text'),
+    ('updated_at', 'timestamp'),
+    ('claimed_at', 'timestamp'),
+    ('claimed_by', 'text'),
+]
+#The columns upload_predictions adds to the inference csv, the csv columns
+#themselves are added on the first upload (ensure_columns)
+PREDICTIONS_TABLE_COLUMNS = [
+    ('image_name', 'text'),
+    ('bbox_confidence', 'double precision'),
+    ('class_score', 'double precision'),
+    ('date_inlet', 'date not null'),
+    ('date_inference', 'date'),
+]
+PREDICTION_COUNTS_COLUMNS = [
+    ('date_inlet', 'date not null'),
+    ('model_name', 'text not null'),
+    ('class_name', 'text not null'),
+    ('detections', 'bigint not null'),
+    ('updated_at', 'timestamp'),
+]
+#One row per day and pipeline, the target of the update_daily_count upsert
+DATA_TABLE_KEY = ('data_table_date_model_key', 'data_table', ('date_inlet', 'model_name'))
+#(name, table, columns, where). Lookups by date_inlet use the unique key,
+#the version queries read max() of the timestamp columns from their index
+INDEXES = [
+    ('data_table_pending_idx', 'data_table', ('date_inlet',), 'predictions_done = false'),
+    ('data_table_predictions_done_idx', 'data_table', ('predictions_done', 'date_inlet'), None),
+    ('data_table_model_date_idx', 'data_table', ('model_name', 'date_inlet'), None),
+    ('data_table_updated_at_idx', 'data_table', ('updated_at',), None),
+    ('data_table_inference_start_idx', 'data_table', ('datetime_inference_start',), None),
+    ('data_table_inference_end_idx', 'data_table', ('datetime_inference_end',), None),
+    ('predictions_table_date_inlet_idx', 'predictions_table', ('date_inlet',), None),
+    ('prediction_counts_model_date_idx', 'prediction_counts', ('model_name', 'date_inlet'), None),
+    ('prediction_counts_updated_at_idx', 'prediction_counts', ('updated_at',), None),
+]
+#Tables ensure() creates and check() looks for
+TABLES = [
+    ('data_table', DATA_TABLE_COLUMNS),
+    ('predictions_table', PREDICTIONS_TABLE_COLUMNS),
+    ('prediction_counts', PREDICTION_COUNTS_COLUMNS),
+]
+#Types as information_schema reports them on postgres
+_PG_TYPES = {
+    'date': 'date',
+    'boolean': 'boolean',
+    'bigint': 'bigint',
+    'timestamp': 'timestamp without time zone',
+    'text': 'text',
+    'double precision': 'double precision',
+}
+
+
+class MLOpsSchema:
+    """
+    Creates data_table, predictions_table and prediction_counts with
+    explicit column types, the unique (date_inlet, model_name) key and the
+    indexes every dashboard and scheduler lookup relies on, and brings
+    tables created by pandas to_sql up to date in place: missing columns
+    are added and, on postgres, columns are converted to their type.
+
+    On postgres predictions_table is partitioned by month of date_inlet.
+    An existing unpartitioned table is renamed to predictions_table_legacy
+    and attached as the default partition, so no row is copied. New months
+    get their own partition (`ensure_partition`) unless the default
+    partition already holds rows of that month.
+
+    The migration (`ensure`) rewrites tables and builds indexes, so it is a
+    deploy step (`python -m db.schema`, the Procfile release command) and
+    never runs from the read or write methods: those only `check` that the
+    tables are there, which a read-only database role can do.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        #False when duplicate rows kept the unique key from being created
+        self.has_unique_key = False
+        self._checked = False
+        self._partitions = set()
+        self._columns = {}
+        self._lock = threading.RLock()
+
+    @property
+    def partitioned(self):
+        return self.engine.dialect.name == 'postgresql'
+
+    def check(self):
+        '''
+        Make sure, without changing anything, that the tables exist with
+        all their columns, once per process, and find out whether the
+        unique key is there. Raises RuntimeError when the database has not
+        been migrated.
+        '''
+        with self._lock:
+            if self._checked:
+                return
+            inspector = inspect(self.engine)
+            missing = []
+            for table_name, columns in TABLES:
+                if not inspector.has_table(table_name):
+                    missing.append(table_name)
+                    continue
+                existing = {c['name'] for c in inspector.get_columns(table_name)}
+                missing += ['{}.{}'.format(table_name, c) for c, _ in columns if c not in existing]
+            if missing:
+                raise RuntimeError("The MLOps tables are missing or out of date ({}), create or migrate them "
+                                   "with `python -m db.schema mlopsDB_config.yaml`".format(', '.join(missing)))
+            self.has_unique_key = any(index['name'] == DATA_TABLE_KEY[0]
+                                      for index in inspector.get_indexes(DATA_TABLE_KEY[1]))
+            self._checked = True
+
+    def ensure(self):
+        '''
+        Create or migrate the tables. Run on deploy, see the class docstring.
+        '''
+        with self._lock:
+            self._ensure_table('data_table', DATA_TABLE_COLUMNS)
+            self._ensure_table('predictions_table', PREDICTIONS_TABLE_COLUMNS)
+            self._ensure_table('prediction_counts', PREDICTION_COUNTS_COLUMNS,
+                               primary_key=('date_inlet', 'model_name', 'class_name'))
+            if self.partitioned:
+                self._partition_predictions()
+            self.has_unique_key = self._create_index(*DATA_TABLE_KEY, unique=True)
+            for name, table, columns, where in INDEXES:
+                self._create_index(name, table, columns, where=where)
+            self._checked = True
+
+    def ensure_columns(self, table_name, frame, conn=None):
+        '''
+        Add the columns of frame that table_name does not have yet (e.g.
+        the fields of an inference csv), typed after the frame dtypes. Pass
+        the connection of an open transaction that writes to the table.
+        '''
+        self.check()
+        if table_name not in self._columns:
+            self._columns[table_name] = {c['name'] for c in inspect(conn or self.engine).get_columns(table_name)}
+        existing = self._columns[table_name]
+        for column, dtype in frame.dtypes.items():
+            if column in existing:
+                continue
+            if dtype.kind in 'iu':
+                sql_type = 'bigint'
+            elif dtype.kind == 'f':
+                sql_type = 'double precision'
+            elif dtype.kind == 'b':
+                sql_type = 'boolean'
+            elif dtype.kind == 'M':
+                sql_type = 'timestamp'
+            else:
+                sql_type = 'text'
+            statement = text('alter table "{}" add column "{}" {}'.format(table_name, column, sql_type))
+            if conn is None:
+                with self.engine.begin() as conn_:
+                    conn_.execute(statement)
+            else:
+                conn.execute(statement)
+            existing.add(column)
+
+    def ensure_partition(self, date):
+        '''
+        Create the predictions_table partition of the month of date, if
+        the table is partitioned and the default partition has no rows of
+        that month (postgres can't split them out of it).
+        '''
+        if not self.partitioned:
+            return
+        self.check()
+        if isinstance(date, str):
+            date = datetime.strptime(date[:10], '%Y-%m-%d').date()
+        start = _date(date.year, date.month, 1)
+        if start in self._partitions:
+            return
+        end = _date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        name = 'predictions_table_p{:%Y_%m}'.format(start)
+        with self._lock, self.engine.begin() as conn:
+            default = self._default_partition(conn)
+            if not self._has_table(conn, name):
+                in_default = default is not None and conn.execute(text(
+                    'select 1 from "{}" where date_inlet >= :start and date_inlet < :end limit 1'.format(default)),
+                    {'start': start, 'end': end}).first()
+                if in_default:
+                    self._partitions.add(start)
+                    return
+                conn.execute(text("create table {} partition of predictions_table "
+                                  "for values from ('{}') to ('{}')".format(name, start, end)))
+            self._partitions.add(start)
+
+    def _ensure_table(self, table_name, columns, primary_key=None):
+        definitions = ['"{}" {}'.format(column, sql_type) for column, sql_type in columns]
+        if primary_key:
+            definitions.append('primary key ({})'.format(', '.join(primary_key)))
+        inspector = inspect(self.engine)
+        if not inspector.has_table(table_name):
+            partition = ''
+            if table_name == 'predictions_table' and self.partitioned:
+                partition = ' partition by range (date_inlet)'
+            with self.engine.begin() as conn:
+                conn.execute(text('create table if not exists "{}" ({}){}'.format(
+                    table_name, ', '.join(definitions), partition)))
+                if partition:
+                    conn.execute(text('create table if not exists predictions_table_default '
+                                      'partition of predictions_table default'))
+            return
+        existing = {c['name'] for c in inspector.get_columns(table_name)}
+        for column, sql_type in columns:
+            if column not in existing:
+                #not null can't be added to existing rows without a default
+                sql_type = sql_type.replace(' not null', '') if 'default' not in sql_type else sql_type
+                with self.engine.begin() as conn:
+                    conn.execute(text('alter table "{}" add column "{}" {}'.format(table_name, column, sql_type)))
+        if self.engine.dialect.name == 'postgresql':
+            self._convert_types(table_name, columns)
+
+    def _convert_types(self, table_name, columns):
+        with self.engine.connect() as conn:
+            current = dict(conn.execute(text('select column_name, data_type from information_schema.columns '
+                                             'where table_name = :table'), {'table': table_name}).fetchall())
+        for column, sql_type in columns:
+            base = sql_type.split(' not null')[0].split(' default')[0]
+            if current.get(column) in (None, _PG_TYPES[base]):
+                continue
+            #Booleans written as 0/1 or 'True'/'False' go through text
+            using = '"{0}"::text::{1}'.format(column, base)
+            if base == 'bigint' and current[column] in ('double precision', 'real', 'numeric'):
+                using = 'round("{}")::bigint'.format(column)
+            print("Converting {}.{} from {} to {}".format(table_name, column, current[column], base))
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(text('alter table "{}" alter column "{}" type {} using {}'.format(
+                        table_name, column, base, using)))
+            except DBAPIError as exc:
+                print("Could not convert {}.{}, kept as {}: {}".format(
+                    table_name, column, current[column], exc.orig))
+
+    def _partition_predictions(self):
+        with self.engine.begin() as conn:
+            kind = conn.execute(text("select relkind from pg_class where relname = 'predictions_table' "
+                                     "and relnamespace = current_schema()::regnamespace")).scalar()
+            if kind != 'r':
+                #Already partitioned ('p')
+                return
+            print("Partitioning predictions_table by date_inlet, the current rows become "
+                  "the default partition predictions_table_legacy")
+            conn.execute(text('alter table predictions_table rename to predictions_table_legacy'))
+            conn.execute(text('create table predictions_table (like predictions_table_legacy including defaults) '
+                              'partition by range (date_inlet)'))
+            conn.execute(text('alter table predictions_table attach partition predictions_table_legacy default'))
+
+    def _default_partition(self, conn):
+        return conn.execute(text('''
+            select c.relname from pg_inherits i
+            join pg_class c on c.oid = i.inhrelid
+            join pg_class p on p.oid = i.inhparent
+            where p.relname = 'predictions_table' and pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+            ''')).scalar()
+
+    def _has_table(self, conn, name):
+        return conn.execute(text('select to_regclass(:name)'), {'name': name}).scalar() is not None
+
+    def _create_index(self, name, table_name, columns, where=None, unique=False):
+        #On postgres the index is built concurrently, without blocking the
+        #writes to the table, which can't run inside a transaction. Postgres
+        #can't do that on a partitioned table, predictions_table's index is
+        #built on its partitions with a plain create
+        concurrently = self.engine.dialect.name == 'postgresql' and not (
+            table_name == 'predictions_table' and self.partitioned)
+        statement = 'create {}index {}if not exists {} on "{}" ({})'.format(
+            'unique ' if unique else '', 'concurrently ' if concurrently else '', name, table_name,
+            ', '.join(columns))
+        if where:
+            statement += ' where ' + where
+        try:
+            with self.engine.connect() as conn:
+                if concurrently:
+                    conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                    self._drop_invalid_index(conn, name)
+                conn.execute(text(statement))
+                conn.commit()
+        except DBAPIError as exc:
+            if not unique:
+                raise
+            print("{} has duplicate ({}) rows, {} was not created: {}".format(
+                table_name, ', '.join(columns), name, exc.orig))
+            if concurrently:
+                with self.engine.connect() as conn:
+                    self._drop_invalid_index(conn.execution_options(isolation_level='AUTOCOMMIT'), name)
+            return False
+        return True
+
+    def _drop_invalid_index(self, conn, name):
+        #A failed or interrupted concurrent build leaves an invalid index
+        #behind, which `if not exists` would take for the real one
+        valid = conn.execute(text('select i.indisvalid from pg_index i join pg_class c on c.oid = i.indexrelid '
+                                  'where c.relname = :name'), {'name': name}).scalar()
+        if valid is False:
+            conn.execute(text('drop index concurrently if exists {}'.format(name)))
+
+
+if __name__ == '__main__':
+    #Create or migrate the tables of the dashboard database in place:
+    #    python -m db.schema [mlopsDB_config.yaml]
+    import sys
+    from .api_db import MLOPs_DB_Connect
+    from .utils import read_yaml_file
+
+    db = MLOPs_DB_Connect(**read_yaml_file(sys.argv[1] if len(sys.argv) > 1 else 'mlopsDB_config.yaml'))
+    db.schema.ensure()
+    print("MLOps tables are up to date.")
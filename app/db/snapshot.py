@@ -0,0 +1,93 @@
+from datetime import date
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+#Columns of data_table that hold booleans (sqlite returns them as 0/1)
+BOOL_COLUMNS = ['predictions_done']
+PANDAS_MAJOR = int(pd.__version__.split('.')[0])
+#Resolution pd.to_datetime gives parsed text
+DATETIME_DTYPE = 'datetime64[us]' if PANDAS_MAJOR >= 3 else 'datetime64[ns]'
+
+
+def compact_frame(frame, datetime_columns=(), bool_columns=(), max_category_ratio=0.5):
+    '''
+    Return frame with compact, typed columns: dates and datetimes (python
+    objects or strings) as datetime64, bool_columns as bools (nullable
+    'boolean' if they have nulls) and string columns with at most
+    max_category_ratio distinct values per row as categoricals.
+
+    Columns that already have such a dtype are left as they are.
+    '''
+    columns = {}
+    for column in frame.columns:
+        values = frame[column]
+        if not _is_text(values.dtype):
+            if column in bool_columns and values.dtype != bool and str(values.dtype) != 'boolean':
+                columns[column] = values.astype(bool)
+            continue
+        first = _first_value(values)
+        if column in datetime_columns or isinstance(first, date):
+            columns[column] = to_datetime(values)
+        elif column in bool_columns:
+            columns[column] = values.astype('boolean') if values.isnull().any() else values.astype(bool)
+        elif isinstance(first, str):
+            categorical = to_category(values, max_category_ratio)
+            if categorical is not None:
+                columns[column] = categorical
+    if columns:
+        frame = frame.assign(**columns)
+    return frame
+
+
+def to_datetime(values):
+    '''
+    values (dates and datetimes as text or python objects) as datetime64,
+    unparseable ones as NaT. Text is parsed by Arrow when it is installed.
+    '''
+    if pa is not None:
+        try:
+            array = pa.array(values)
+            if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+                parsed = pc.cast(array, pa.timestamp('us')).to_numpy(zero_copy_only=False)
+                return pd.Series(parsed.astype(DATETIME_DTYPE), index=values.index, name=values.name)
+        except pa.ArrowException:
+            pass
+    #ISO8601 spares the per-value format inference
+    return pd.to_datetime(values, errors='coerce', format='ISO8601')
+
+
+def to_category(values, max_ratio):
+    '''
+    Text values as a categorical with sorted categories, or None if they
+    have more than max_ratio distinct values per row.
+    '''
+    #One pass over the values, nunique and astype('category') both hash them
+    codes, categories = pd.factorize(values, sort=True)
+    if len(categories) > max_ratio * len(values):
+        return None
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=values.index, name=values.name)
+
+
+def _is_text(dtype):
+    #python objects, or pandas' own string dtypes (the default for text in pandas 3)
+    return dtype == object or (pd.api.types.is_string_dtype(dtype) and
+                               not isinstance(dtype, pd.CategoricalDtype))
+
+
+def _first_value(values):
+    if len(values) and not pd.isna(values.iat[0]):
+        return values.iat[0]
+    index = values.first_valid_index()
+    return None if index is None else values[index]
+
+
+def frame_memory(frame):
+    '''
+    Bytes held by frame, including the python objects of object columns.
+    '''
+    return int(frame.memory_usage(index=True, deep=True).sum())
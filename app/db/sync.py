@@ -0,0 +1,164 @@
+import threading
+import pandas as pd
+from sqlalchemy import text
+from .snapshot import PANDAS_MAJOR, to_datetime
+
+
+class IncrementalTableSync:
+    """
+    In-memory copy of a table kept in step with the database by fetching
+    only the rows past the last-seen watermark and merging them in.
+
+    Rows are matched on key_columns, one row per day and pipeline. When the
+    table has version_column (stamped with the database clock by every
+    MLOPs_DB_Connect write) it is the watermark, otherwise the fallback
+    timestamp columns are used, which catch new days and inference runs but
+    not edits such as annotation ids.
+
+    A row is stamped when its transaction runs, not when it commits, so the
+    delta re-reads the last lookback seconds before the watermark to catch
+    transactions that committed after a newer one. Every full_refresh_every
+    refreshes the whole table is read again, which also drops deleted rows
+    and anything a longer transaction slipped past the lookback.
+
+    transform, if given, is applied to every full read (e.g.
+    snapshot.compact_frame). A delta is cast to the dtypes of the frame it
+    is merged into instead, so a refresh only converts the rows it fetched.
+    """
+
+    def __init__(self, table_name, key_columns=('date_inlet', 'model_name'), version_column='updated_at',
+                 fallback_columns=('date_inlet', 'datetime_inference_start', 'datetime_inference_end'),
+                 full_refresh_every=60, lookback=300, transform=None):
+        self.table_name = table_name
+        self.key_columns = list(key_columns)
+        self.version_column = version_column
+        self.fallback_columns = list(fallback_columns)
+        #Rows deleted in the database are only dropped by a full refresh
+        self.full_refresh_every = full_refresh_every
+        #Seconds re-read before the version watermark
+        self.lookback = lookback
+        self.transform = transform
+        self.frame = None
+        self.watermarks = {}
+        self._refreshes = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.frame = None
+            self.watermarks = {}
+
+    def refresh(self, engine):
+        '''
+        Bring the in-memory frame up to date and return it.
+        '''
+        with self._lock:
+            self._refreshes += 1
+            if self.frame is None or (self.full_refresh_every and
+                                      self._refreshes % self.full_refresh_every == 0):
+                self.frame = self._apply(pd.read_sql_query('select * from "{}"'.format(self.table_name), con=engine))
+            else:
+                delta = self._fetch_delta(engine)
+                if len(delta):
+                    self.frame = self._merge(self.frame, delta)
+            self.watermarks = self._watermarks(self.frame)
+            return self.frame
+
+    def _apply(self, frame):
+        return frame if self.transform is None else self.transform(frame)
+
+    def _watermarks(self, frame):
+        watermarks = self._max_values(frame, [self.version_column])
+        if not watermarks:
+            #No row has been stamped with a version yet
+            watermarks = self._max_values(frame, self.fallback_columns)
+        return watermarks
+
+    def _max_values(self, frame, columns):
+        watermarks = {}
+        for column in [c for c in columns if c in frame.columns]:
+            values = frame[column].dropna()
+            if not len(values):
+                continue
+            value = values.max()
+            if isinstance(value, pd.Timestamp):
+                value = value.to_pydatetime()
+            watermarks[column] = value
+        return watermarks
+
+    def _fetch_delta(self, engine):
+        if not self.watermarks:
+            return pd.read_sql_query('select * from "{}"'.format(self.table_name), con=engine)
+        #>= rather than > so rows committed with the same timestamp as the
+        #watermark are not missed, they are simply merged again
+        conditions = ['"{0}" >= :wm_{0}'.format(column) for column in self.watermarks]
+        query = 'select * from "{}" where {}'.format(self.table_name, ' or '.join(conditions))
+        params = {'wm_' + column: value for column, value in self.watermarks.items()}
+        if self.lookback and self.version_column in self.watermarks:
+            params['wm_' + self.version_column] = _shift(self.watermarks[self.version_column], self.lookback)
+        return pd.read_sql_query(text(query), con=engine, params=params)
+
+    def _merge(self, frame, delta):
+        frame, delta = _align_dtypes(frame, delta)
+        #Only the rows sharing the delta's first key column values can be
+        #replaced, the full keys are compared on those
+        first = self.key_columns[0]
+        replaced = frame[first].isin(delta[first]).to_numpy(copy=True)
+        delta_keys = set(self._keys(delta))
+        replaced[replaced] = [key in delta_keys for key in self._keys(frame[replaced])]
+        merged = _concat(frame[~replaced], delta)
+        return merged.sort_values(by=self.key_columns).reset_index(drop=True)
+
+    def _keys(self, frame):
+        #Rows without a model name (written before there were pipelines) match each other
+        columns = ([('' if pd.isna(value) else value) for value in frame[column].tolist()]
+                   for column in self.key_columns)
+        return list(zip(*columns))
+
+
+def _shift(watermark, seconds):
+    #sqlite hands timestamps back as text, compared as text in the query
+    shifted = pd.Timestamp(watermark) - pd.Timedelta(seconds=seconds)
+    if isinstance(watermark, str):
+        return shifted.strftime('%Y-%m-%d %H:%M:%S.%f')
+    return shifted.to_pydatetime()
+
+
+def _concat(frame, delta):
+    if PANDAS_MAJOR < 3 and frame.columns.equals(delta.columns):
+        #pandas 2 checks all-null object columns (such as those compact_frame
+        #leaves) value by value when concatenating frames, but not series
+        return pd.DataFrame({column: pd.concat([frame[column], delta[column]], ignore_index=True)
+                             for column in frame.columns})
+    return pd.concat([frame, delta], ignore_index=True, sort=False)
+
+
+def _align_dtypes(frame, delta):
+    #Cast the delta to the dtypes of the frame (e.g. compact_frame's) and give
+    #categorical columns of both frames the same categories, so concat keeps
+    #them instead of falling back to objects
+    frame_columns, delta_columns = {}, {}
+    frame_dtypes, delta_dtypes = frame.dtypes, delta.dtypes
+    for column in frame.columns.intersection(delta.columns):
+        dtype = frame_dtypes[column]
+        if dtype == delta_dtypes[column]:
+            continue
+        if pd.api.types.is_datetime64_dtype(dtype):
+            delta_columns[column] = to_datetime(delta[column]).astype(dtype)
+        elif dtype == bool or str(dtype) == 'boolean':
+            if dtype == bool and delta[column].isnull().any():
+                frame_columns[column] = frame[column].astype('boolean')
+                dtype = 'boolean'
+            delta_columns[column] = delta[column].astype(dtype)
+        elif isinstance(dtype, pd.CategoricalDtype):
+            values = delta[column]
+            codes = dtype.categories.get_indexer(values)
+            new = (codes < 0) & values.notna().to_numpy()
+            if new.any():
+                frame_columns[column] = frame[column].cat.add_categories(pd.unique(values[new]))
+                dtype = frame_columns[column].dtype
+                codes = dtype.categories.get_indexer(values)
+            delta_columns[column] = pd.Categorical.from_codes(codes, dtype=dtype)
+    if frame_columns:
+        frame = frame.assign(**frame_columns)
+    return frame, delta.assign(**delta_columns)
@@ -0,0 +1,124 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+
+class WriteBehindQueue:
+    """
+    Buffer of data_table row updates that are written in batches.
+
+    `put` merges the new column values into the pending update of the same
+    row, (date_inlet, model_name) with model_name None for every row of
+    the date (later values win), so a burst of status calls for one day
+    becomes a single UPDATE. Pending updates are written in one transaction
+    once max_pending rows are queued or the oldest one has waited
+    max_delay seconds, and on `flush`, `close`, leaving the `with` block or
+    interpreter exit. A batch that fails to commit is queued again under
+    any newer values.
+    """
+
+    def __init__(self, db, max_pending=100, max_delay=5.0):
+        self.db = db
+        self.max_pending = max_pending
+        self.max_delay = float(max_delay)
+        self._pending = OrderedDict()
+        self._oldest = None
+        self._changed = threading.Condition()
+        #Only one batch is written at a time, in queue order
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='mlops-write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def close(self):
+        '''
+        Stop the background writer and write what is still pending.
+        '''
+        self._stopped.set()
+        with self._changed:
+            self._changed.notify_all()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._stopped.is_set()
+
+    def __len__(self):
+        with self._changed:
+            return len(self._pending)
+
+    def put(self, row, values):
+        '''
+        Queue setting values ({column: value}) on the data_table row
+        (date_inlet, model_name).
+        '''
+        with self._changed:
+            if row in self._pending:
+                self._pending[row].update(values)
+            else:
+                self._pending[row] = dict(values)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._pending) >= self.max_pending
+            self._changed.notify_all()
+        if full:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write every pending update now, in one transaction. Returns the
+        rows (date_inlet, model_name) that are not in data_table.
+        '''
+        with self._flush_lock:
+            with self._changed:
+                batch, self._pending = self._pending, OrderedDict()
+                self._oldest = None
+            if not batch:
+                return []
+            try:
+                missing = self.db._write_batch(batch)
+            except Exception:
+                self._requeue(batch)
+                raise
+        for date, model_name in missing:
+            print("Sorry! but no db entries found for {}{}.".format(
+                date, '' if model_name is None else ' ' + model_name))
+            print("Please first create an entry for this date.")
+        return missing
+
+    def _requeue(self, batch):
+        with self._changed:
+            for row, values in self._pending.items():
+                batch.setdefault(row, {}).update(values)
+            self._pending = batch
+            self._oldest = time.monotonic()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            with self._changed:
+                if self._oldest is None:
+                    self._changed.wait()
+                    continue
+                remaining = self._oldest + self.max_delay - time.monotonic()
+                if remaining > 0:
+                    self._changed.wait(remaining)
+                    continue
+            try:
+                self.flush()
+            except Exception as exc:
+                print("Write-behind flush failed, retrying:", exc)
+                self._stopped.wait(self.max_delay)
@@ -0,0 +1,229 @@
+"""
+Figure builders for the dashboard panels.
+
+Traces and date ticks are built from whole columns with NumPy instead of
+per-row Python, and every layout starts from the same precomputed base.
+
+`figure_update` turns a rebuilt figure into a Dash `Patch` with only the
+points a client does not have yet.
+
+Series longer than a panel can show (`max_points`, about one bar per
+pixel) are reduced on the server with `minmax_indices`, keeping the lowest
+and highest day of every bucket so peaks stay visible.
+"""
+import hashlib
+import json
+
+import numpy as np
+
+try:
+    from dash import Patch
+except ImportError:  # dash < 2.9, clients always get the full figure
+    Patch = None
+
+app_color = {"graph_bg": "#082255", "graph_line": "#007ACE"}
+
+MONTH_ABBR = np.array(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+)
+
+BASE_LAYOUT = dict(
+    plot_bgcolor=app_color["graph_bg"],
+    paper_bgcolor=app_color["graph_bg"],
+    font={"color": "#fff"},
+    xaxis={"showline": True, "zeroline": False, "title": "Date"},
+    yaxis={
+        "showgrid": True,
+        "showline": True,
+        "zeroline": False,
+        "gridcolor": app_color["graph_line"],
+    },
+)
+
+
+def date_labels(dates):
+    """
+    Category labels ("2021-06-01") and tick texts ("1 Jun") for an array of dates.
+    """
+
+    # pandas is already loaded by the database layer when panels are built,
+    # importing it here keeps it out of the app's import time
+    import pandas as pd
+
+    days = np.asarray(pd.to_datetime(dates), dtype="datetime64[D]")
+    months = days.astype("datetime64[M]")
+    day_of_month = (days - months).astype(np.int64) + 1
+    month_index = months.astype(np.int64) % 12
+
+    labels = np.datetime_as_string(days, unit="D")
+    ticktext = np.char.add(
+        np.char.add(day_of_month.astype(str), " "), MONTH_ABBR[month_index]
+    )
+    return labels, ticktext
+
+
+def minmax_indices(values, max_points):
+    """
+    Sorted indices of at most max_points values: the values are split into
+    max_points // 2 buckets of consecutive points and the minimum and
+    maximum of each bucket are kept (NaNs only when a bucket has nothing else).
+    """
+
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+    n_buckets = max(max_points // 2, 1)
+    bucket = np.arange(n) * n_buckets // n
+    starts = np.searchsorted(bucket, np.arange(n_buckets))
+    keep = []
+    for extreme in (np.fmin, np.fmax):
+        per_bucket = extreme.reduceat(values, starts)
+        hits = np.flatnonzero(values == per_bucket[bucket])
+        if len(hits):
+            # first hit of every bucket
+            keep.append(hits[np.r_[True, np.diff(bucket[hits]) > 0]])
+        # buckets of only NaNs keep their first point
+        keep.append(starts[np.isnan(per_bucket)])
+    return np.unique(np.concatenate(keep))
+
+
+def make_layout(height, y_title, xaxis=None):
+    """ Copy of the base layout with the panel's height, y title and x axis options. """
+
+    layout = dict(BASE_LAYOUT, height=height)
+    layout["xaxis"] = dict(BASE_LAYOUT["xaxis"], **(xaxis or {}))
+    layout["yaxis"] = dict(BASE_LAYOUT["yaxis"], title=y_title)
+    return layout
+
+
+def bar_figure(dates, values, height, y_title, xaxis=None, max_points=None):
+    """
+    Bar chart of values per date with one tick per date, downsampled to
+    max_points bars if there are more.
+    """
+
+    keep = minmax_indices(values, max_points)
+    if len(keep) < len(values):
+        dates, values = np.asarray(dates)[keep], np.asarray(values)[keep]
+    labels, ticktext = date_labels(dates)
+    bar_trace = dict(
+        type="bar",
+        y=np.asarray(values),
+        line={"color": "#42C4F7"},
+        mode="lines",
+        x=labels,
+    )
+
+    layout = make_layout(height, y_title, xaxis)
+    layout["xaxis"]["tickvals"] = labels
+    layout["xaxis"]["ticktext"] = ticktext
+    return dict(data=[bar_trace], layout=layout)
+
+
+def category_figure(categories, values, height, y_title, x_title, xaxis=None):
+    """ Bar chart of values per category (class, pipeline, ...). """
+
+    bar_trace = dict(
+        type="bar",
+        y=np.asarray(values),
+        marker={"color": "#42C4F7"},
+        x=np.asarray(categories),
+    )
+    layout = make_layout(height, y_title, dict({"title": x_title}, **(xaxis or {})))
+    return dict(data=[bar_trace], layout=layout)
+
+
+def metric_figure(runs, metric, height, y_title, pipeline=None, xaxis=None, max_points=None):
+    """
+    Bar chart of one metric column of pipeline runs (as returned by
+    MLOPs_DB_Connect.get_pipeline_runs) against date_inlet.
+    """
+
+    if pipeline is not None and "model_name" in runs.columns:
+        runs = runs.loc[runs["model_name"].to_numpy() == pipeline]
+    return bar_figure(
+        runs["date_inlet"].to_numpy(), runs[metric].to_numpy(), height, y_title, xaxis,
+        max_points,
+    )
+
+
+def _point_hashes(figure):
+    """ One uint64 hash per bar of a bar_figure, over its label and value. """
+
+    import pandas as pd
+
+    trace = figure["data"][0]
+    x = pd.util.hash_array(np.asarray(trace["x"], dtype=object))
+    y = pd.util.hash_array(np.asarray(trace["y"], dtype=object))
+    return x * np.uint64(31) + y
+
+
+def _layout_key(figure):
+    """ Digest of everything in the layout except the per-bar ticks. """
+
+    layout = dict(figure["layout"])
+    layout["xaxis"] = {
+        k: v for k, v in layout["xaxis"].items() if k not in ("tickvals", "ticktext")
+    }
+    return hashlib.sha1(json.dumps(layout, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def figure_state(figure, tail=31, hashes=None):
+    """
+    What a client holds of a bar_figure: the layout digest, the number of
+    bars, a digest of all but the last `tail` bars and one hash per bar of
+    that tail. Small enough to live in a dcc.Store.
+    """
+
+    if hashes is None:
+        hashes = _point_hashes(figure)
+    head = max(len(hashes) - tail, 0)
+    return dict(
+        layout=_layout_key(figure),
+        n=len(hashes),
+        head=hashlib.sha1(hashes[:head].tobytes()).hexdigest(),
+        tail=["%016x" % h for h in hashes[head:]],
+    )
+
+
+def figure_update(figure, state, tail=31):
+    """
+    Update of a client that has the figure described by `state` to `figure`.
+
+    Returns (update, new_state). The update is None when nothing changed,
+    a Patch replacing the changed bars among the last `tail` ones and
+    appending the new ones, or the full figure when the layout changed,
+    bars were removed or changed further back, or Patch is not available.
+    """
+
+    hashes = _point_hashes(figure)
+    new_state = figure_state(figure, tail, hashes)
+    if Patch is None or not state or state.get("layout") != new_state["layout"]:
+        return figure, new_state
+
+    n = state["n"]
+    head = n - len(state["tail"])
+    if len(hashes) < n or hashlib.sha1(hashes[:head].tobytes()).hexdigest() != state["head"]:
+        return figure, new_state
+
+    old = state["tail"]
+    changed = [head + i for i, h in enumerate(old) if "%016x" % hashes[head + i] != h]
+    if not changed and len(hashes) == n:
+        return None, new_state
+
+    trace = figure["data"][0]
+    xaxis = figure["layout"]["xaxis"]
+    patch = Patch()
+    columns = (
+        (patch["data"][0]["x"], trace["x"]),
+        (patch["data"][0]["y"], trace["y"]),
+        (patch["layout"]["xaxis"]["tickvals"], xaxis["tickvals"]),
+        (patch["layout"]["xaxis"]["ticktext"], xaxis["ticktext"]),
+    )
+    for target, values in columns:
+        for i in changed:
+            target[i] = values[i].item() if hasattr(values[i], "item") else values[i]
+        if len(hashes) > n:
+            target.extend(np.asarray(values[n:]).tolist())
+    return patch, new_state
@@ -0,0 +1,63 @@
+"""
+Registry of the pipelines the dashboard plots, read from pipelines.yaml.
+
+Each pipeline lists its panels, one metric per panel: a data_table column
+or a key of the metadata column. The registry also gives the union of
+columns and metadata keys over all pipelines, so a single grouped query
+(`MLOPs_DB_Connect.get_pipeline_runs` with every model name) feeds every
+panel on a refresh.
+"""
+from db.utils import ConfigLoader
+
+PANEL_DEFAULTS = dict(source="column", height=350, wide=False, y_title="", xaxis={})
+
+
+class PipelineRegistry:
+    """ Pipelines and their panels, in the order of the config file. """
+
+    def __init__(self, config):
+        self.pipelines = []
+        self._panels = {}
+        for name, pipeline in (config.get("pipelines") or {}).items():
+            panels = []
+            for panel in pipeline.get("panels") or []:
+                panel = dict(PANEL_DEFAULTS, **panel)
+                if panel["source"] not in ("column", "metadata"):
+                    raise ValueError(
+                        "Unknown source {!r} for {} of {}".format(panel["source"], panel["metric"], name)
+                    )
+                panel["xaxis"] = dict(panel["xaxis"])
+                panels.append(panel)
+                self._panels[(name, panel["metric"])] = panel
+            self.pipelines.append(
+                dict(name=name, title=pipeline.get("title", name.upper()), panels=panels)
+            )
+
+    @classmethod
+    def load(cls, config_file):
+        return cls(ConfigLoader(config_file))
+
+    @property
+    def model_names(self):
+        return [pipeline["name"] for pipeline in self.pipelines]
+
+    @property
+    def columns(self):
+        """ data_table columns of the grouped query. """
+
+        columns = ["date_inlet", "model_name"]
+        for panel in self._panels.values():
+            if panel["source"] == "column" and panel["metric"] not in columns:
+                columns.append(panel["metric"])
+        return columns
+
+    @property
+    def metadata_keys(self):
+        keys = []
+        for panel in self._panels.values():
+            if panel["source"] == "metadata" and panel["metric"] not in keys:
+                keys.append(panel["metric"])
+        return keys
+
+    def panel(self, pipeline, metric):
+        return self._panels[(pipeline, metric)]
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from benchmarks import synthetic
+from db.async_api import AsyncMLOPs_DB_Connect
+
+#The async engine needs both, sqlalchemy[asyncio] brings greenlet
+pytest.importorskip('aiosqlite')
+pytest.importorskip('greenlet')
+
+DAY = '2000-01-02'
+
+
+@pytest.fixture
+def url(tmp_path):
+    #2000-01-01 to 2000-01-04 for two pipelines, nothing done yet
+    data_table = synthetic.make_data_table(8, pipelines=synthetic.PIPELINES[:2], start=synthetic.START_DATE,
+                                           done_ratio=0)
+    return synthetic.load_tables(synthetic.sqlite_url(str(tmp_path)), data_table)
+
+
+def run(url, operations, frames=5):
+    async def main():
+        async with AsyncMLOPs_DB_Connect(None, None, None, None, None, 'frames-bucket', 'frames',
+                                         engine_url=url, cache_ttl=0) as db:
+            async def count_frames(date, operation='update_daily_count'):
+                return frames
+            #S3 counting runs in a thread on the sync counter, see test_s3_count
+            db.count_frames = count_frames
+            return await operations(db)
+    return asyncio.run(main())
+
+
+def rows(url, columns):
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        result = conn.execute(text('select date_inlet, model_name, {} from data_table'.format(', '.join(columns))))
+        values = {(str(day)[:10], model_name): tuple(rest) for day, model_name, *rest in result}
+    engine.dispose()
+    return values
+
+
+def test_concurrent_claims_are_disjoint(url):
+    async def claim(db):
+        return await asyncio.gather(db.claim_pending_dates(2), db.claim_pending_dates(2))
+
+    claimed = run(url, claim)
+    assert sorted(claimed) == [['2000-01-01', '2000-01-02'], ['2000-01-03', '2000-01-04']]
+    #Every row of a claimed date is claimed
+    assert all(worker is not None for (worker,) in rows(url, ['claimed_by']).values())
+
+
+def test_status_updates_touch_one_pipeline(url):
+    async def update(db):
+        await asyncio.gather(db.update_inference_info(DAY, 'moments_pipeline', 'v2', 'weights/v2'),
+                             db.update_inference_end_time(DAY, model_name='moments_pipeline'),
+                             db.update_annotations_info(DAY, 7, model_name='feed_pipeline'))
+
+    run(url, update)
+    status = rows(url, ['model_version', 'predictions_done', 'labelstudio_projectid'])
+    assert status[(DAY, 'moments_pipeline')][0] == 'v2'
+    assert bool(status[(DAY, 'moments_pipeline')][1])
+    assert not bool(status[(DAY, 'feed_pipeline')][1])
+    assert str(status[(DAY, 'feed_pipeline')][2]) == '7'
+
+
+def test_daily_count_updates_existing_dates_and_upserts_new_ones(url):
+    async def count(db):
+        await asyncio.gather(db.update_daily_count(DAY), db.update_daily_count('2000-01-09'))
+
+    run(url, count, frames=12)
+    counts = rows(url, ['no_of_frames'])
+    assert counts[(DAY, 'moments_pipeline')] == (12,)
+    assert counts[(DAY, 'feed_pipeline')] == (12,)
+    assert counts[('2000-01-09', '')] == (12,)
+
+
+def test_daily_log_is_inserted_through_run_sync(url):
+    async def create(db):
+        await db.create_daily_log('2000-01-10', 3, model_name='ocr_pipeline', metadata={'feed_count': 2})
+        return await db.get_table('data_table', use_cache=False)
+
+    table = run(url, create)
+    row = rows(url, ['no_of_frames', 'metadata', 'updated_at'])[('2000-01-10', 'ocr_pipeline')]
+    assert row[:2] == (3, '{"feed_count": 2}')
+    #Stamped with the database clock like every other write
+    assert row[2] is not None
+    assert len(table) == 9
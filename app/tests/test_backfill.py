@@ -0,0 +1,82 @@
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+from sqlalchemy import create_engine, event, text
+
+from benchmarks import synthetic
+from db.api_db import MLOPs_DB_Connect
+
+BUCKET = 'frames-bucket'
+#A scratch postgres database, its data_table is replaced
+POSTGRES_URL = os.environ.get('MLOPS_TEST_POSTGRES_URL')
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    for name, value in [('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_DEFAULT_REGION', 'us-east-1')]:
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        s3 = boto3.resource('s3')
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3.Bucket(BUCKET)
+
+
+@pytest.fixture(params=['sqlite', pytest.param('postgresql', marks=pytest.mark.skipif(
+    not POSTGRES_URL, reason='MLOPS_TEST_POSTGRES_URL is not set'))])
+def url(request, tmp_path):
+    #2000-01-01 and 2000-01-02 exist, for two pipelines each
+    data_table = synthetic.make_data_table(4, pipelines=synthetic.PIPELINES[:2], start=synthetic.START_DATE)
+    if request.param == 'sqlite':
+        return synthetic.load_tables(synthetic.sqlite_url(str(tmp_path)), data_table)
+    return synthetic.load_tables(POSTGRES_URL, data_table)
+
+
+def put_frames(bucket, counts):
+    for date, count in counts.items():
+        for i in range(count):
+            bucket.put_object(Key='frames/{}/cam1/{:06d}.jpg'.format(date, i), Body=b'')
+
+
+def frame_counts(engine):
+    with engine.connect() as conn:
+        rows = conn.execute(text('select date_inlet, model_name, no_of_frames from data_table'))
+        return {(str(day)[:10], model_name): count for day, model_name, count in rows}
+
+
+def test_backfill_updates_every_pipeline_and_creates_missing_dates(bucket, url):
+    put_frames(bucket, {'2000-01-02': 3, '2000-01-03': 2})
+    db = MLOPs_DB_Connect(None, None, None, None, None, BUCKET, 'frames', engine_url=url)
+    assert db.backfill('2000-01-01', '2000-01-05', progress=None) == {'2000-01-02': 3, '2000-01-03': 2}
+
+    counts = frame_counts(db.engine)
+    assert counts[('2000-01-02', 'moments_pipeline')] == 3
+    assert counts[('2000-01-02', 'feed_pipeline')] == 3
+    assert counts[('2000-01-03', '')] == 2
+    assert len(counts) == 5
+
+
+def test_date_created_meanwhile_does_not_abort_the_backfill(bucket, url):
+    put_frames(bucket, {'2000-01-03': 2, '2000-01-04': 4})
+    db = MLOPs_DB_Connect(None, None, None, None, None, BUCKET, 'frames', engine_url=url)
+    other = create_engine(url)
+
+    #Another worker creates the row of 2000-01-03 after the backfill looked
+    #up the existing dates, right before it inserts the missing ones
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def race(conn, cursor, statement, parameters, context, executemany):
+        if 'insert into data_table' in statement.lower() and not raced:
+            raced.append(statement)
+            with other.begin() as worker:
+                worker.execute(text("insert into data_table (date_inlet, predictions_done, no_of_frames, "
+                                    "model_name, model_version, weights_path) "
+                                    "values ('2000-01-03', false, 1, '', '', '')"))
+
+    raced = []
+    db.backfill('2000-01-01', '2000-01-05', progress=None)
+    other.dispose()
+    counts = frame_counts(db.engine)
+    assert counts[('2000-01-03', '')] == 2
+    assert counts[('2000-01-04', '')] == 4
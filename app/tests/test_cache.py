@@ -0,0 +1,58 @@
+import os
+
+import pandas as pd
+import pytest
+
+from db.cache import SharedSnapshotCache
+
+
+def test_directory_is_private(tmp_path):
+    cache = SharedSnapshotCache(directory=str(tmp_path / 'cache'))
+    assert os.stat(cache.directory).st_mode & 0o777 == 0o700
+
+
+def test_shared_directory_is_refused(tmp_path):
+    directory = tmp_path / 'cache'
+    directory.mkdir()
+    directory.chmod(0o777)
+    with pytest.raises(PermissionError):
+        SharedSnapshotCache(directory=str(directory))
+
+
+def test_symlinked_directory_is_refused(tmp_path):
+    (tmp_path / 'elsewhere').mkdir(mode=0o700)
+    (tmp_path / 'cache').symlink_to(tmp_path / 'elsewhere')
+    with pytest.raises(PermissionError):
+        SharedSnapshotCache(directory=str(tmp_path / 'cache'))
+
+
+def test_workers_share_a_snapshot(tmp_path):
+    workers = [SharedSnapshotCache(ttl=60, directory=str(tmp_path)) for _ in range(2)]
+    loads = []
+
+    def load():
+        loads.append(1)
+        return pd.DataFrame({'date_inlet': ['2021-06-01'], 'no_of_frames': [3]})
+
+    first = workers[0].get(('data_table',), load)
+    second = workers[1].get(('data_table',), load)
+    assert len(loads) == 1
+    pd.testing.assert_frame_equal(first, second)
+    #The same frame is handed out again, without a copy
+    assert workers[1].get(('data_table',), load) is second
+
+
+def test_value_loaded_before_an_invalidate_is_not_stored(tmp_path):
+    writer = SharedSnapshotCache(ttl=60, directory=str(tmp_path))
+    other = SharedSnapshotCache(ttl=60, directory=str(tmp_path))
+    loads = []
+
+    def stale():
+        #Another worker commits a change and invalidates during the load
+        loads.append('stale')
+        other.invalidate('data_table')
+        return {'no_of_frames': 1}
+
+    assert writer.get(('data_table', 'x'), stale) == {'no_of_frames': 1}
+    assert other.get(('data_table', 'x'), lambda: loads.append('fresh') or {'no_of_frames': 2}) == {'no_of_frames': 2}
+    assert loads == ['stale', 'fresh']
@@ -0,0 +1,28 @@
+import numpy as np
+
+from figures import bar_figure, minmax_indices
+
+
+def test_minmax_indices_short_series_is_kept():
+    assert list(minmax_indices([3.0, 1.0, 2.0], 10)) == [0, 1, 2]
+
+
+def test_minmax_indices_keeps_extremes_of_every_bucket():
+    values = np.zeros(1000)
+    values[123], values[877] = 50.0, -50.0
+    keep = minmax_indices(values, 100)
+    assert len(keep) <= 100
+    assert 123 in keep and 877 in keep
+
+
+def test_minmax_indices_all_nan_series_longer_than_max_points():
+    #A metadata metric missing on every day of a long range
+    keep = minmax_indices(np.full(1000, np.nan), 400)
+    assert len(keep) == 200
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_bar_figure_all_nan_series():
+    dates = np.arange('2020-01-01', '2023-01-01', dtype='datetime64[D]')
+    figure = bar_figure(dates, np.full(len(dates), np.nan), 350, "", max_points=400)
+    assert len(figure["data"][0]["x"]) == 200
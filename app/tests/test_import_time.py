@@ -0,0 +1,12 @@
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_app_import_is_within_budget():
+    #The budget is the script's default (1500 ms, or IMPORT_TIME_BUDGET_MS)
+    result = subprocess.run([sys.executable, '-m', 'benchmarks.import_time', '--repeat', '3'], cwd=APP_DIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, result.stdout
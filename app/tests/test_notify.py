@@ -0,0 +1,76 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from db.notify import ChangeListener, notify_change
+
+#A scratch postgres database, e.g. postgresql://postgres@localhost:5432/postgres
+POSTGRES_URL = os.environ.get('MLOPS_TEST_POSTGRES_URL')
+pytestmark = pytest.mark.skipif(not POSTGRES_URL, reason='MLOPS_TEST_POSTGRES_URL is not set')
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(POSTGRES_URL)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def listener(engine):
+    changed = []
+    listener = ChangeListener(engine, channel='mlops_test_changes', reconnect_delay=0.1)
+    listener.subscribe(changed.append)
+    listener.changed = changed
+    listener.start()
+    #Wait for the LISTEN to be in place
+    deadline = time.time() + 10
+    with engine.connect() as conn:
+        while not conn.execute(text("select 1 from pg_stat_activity where query like 'LISTEN%'")).first():
+            assert time.time() < deadline
+            #pg_stat_activity is a snapshot for the rest of the transaction
+            conn.rollback()
+            time.sleep(0.05)
+    yield listener
+    listener.stop()
+
+
+def notify(engine, table_name, commit=True):
+    conn = engine.connect()
+    trans = conn.begin()
+    conn.execute(text('select pg_notify(:channel, :table_name)'),
+                 {'channel': 'mlops_test_changes', 'table_name': table_name})
+    trans.commit() if commit else trans.rollback()
+    conn.close()
+
+
+def test_listener_hears_committed_changes(engine, listener):
+    notify(engine, 'data_table')
+    assert listener.wait(0, timeout=10) == 1
+    assert listener.changed == ['data_table']
+
+
+def test_rolled_back_changes_are_not_heard(engine, listener):
+    notify(engine, 'data_table', commit=False)
+    assert listener.wait(0, timeout=1) == 0
+
+
+def test_notify_change_is_sent_on_the_default_channel(engine):
+    listener = ChangeListener(engine).start()
+    try:
+        time.sleep(0.5)
+        with engine.begin() as conn:
+            notify_change(conn, 'prediction_counts')
+        assert listener.wait(0, timeout=10) == 1
+    finally:
+        listener.stop()
+
+
+def test_reconnect_counts_as_a_change(engine, listener):
+    with engine.connect() as conn:
+        conn.execute(text("select pg_terminate_backend(pid) from pg_stat_activity where query like 'LISTEN%'"))
+    #Notifications may have been missed while disconnected
+    assert listener.wait(0, timeout=10) >= 1
+    assert listener.changed[0] is None
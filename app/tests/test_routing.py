@@ -0,0 +1,45 @@
+from sqlalchemy import create_engine, text
+
+from benchmarks import synthetic
+from db.api_db import MLOPs_DB_Connect
+from db.routing import ReplicaRouter
+
+
+def connect(primary, replicas):
+    return MLOPs_DB_Connect(None, None, None, None, None, None, None, engine_url=primary, cache_ttl=60,
+                            replicas=replicas)
+
+
+def test_reads_of_a_version_stay_on_its_replica(tmp_path):
+    data_table = synthetic.make_data_table(30)
+    urls = [synthetic.load_tables(synthetic.sqlite_url(str(tmp_path), name), data_table)
+            for name in ('primary.db', 'fresh.db', 'lagging.db')]
+    #The second replica hasn't replayed the newest day yet
+    with create_engine(urls[2]).begin() as conn:
+        conn.execute(text('delete from data_table where date_inlet = (select max(date_inlet) from data_table)'))
+    db = connect(urls[0], urls[1:])
+
+    for _ in range(4):
+        version = db.get_data_version()
+        runs = db.get_pipeline_runs('moments_pipeline', version=version)
+        expected = 30 if version.startswith('replica0|') else 29
+        assert len(runs) == expected
+
+
+def test_client_stays_on_its_replica(tmp_path):
+    data_table = synthetic.make_data_table(10)
+    urls = [synthetic.load_tables(synthetic.sqlite_url(str(tmp_path), name), data_table)
+            for name in ('primary.db', 'r0.db', 'r1.db')]
+    db = connect(urls[0], urls[1:])
+    version = db.get_data_version()
+    assert all(db.get_data_version(version) == version for _ in range(5))
+
+
+def test_unusable_replica_falls_back_to_the_primary(tmp_path):
+    url = synthetic.load_tables(synthetic.sqlite_url(str(tmp_path)), synthetic.make_data_table(10))
+    primary = create_engine(url)
+    router = ReplicaRouter(['sqlite:////nonexistent/folder/replica.db'], lambda: primary)
+    assert router.pick() == ('primary', primary)
+    assert router.pinned('replica0') == ('primary', primary)
+    assert router.pinned('replica7') == ('primary', primary)
+    assert router.status()['sqlite:////nonexistent/folder/replica.db'][1] is False
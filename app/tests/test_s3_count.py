@@ -0,0 +1,101 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from db.s3_count import S3PrefixCounter
+
+BUCKET = 'frames-bucket'
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    for name, value in [('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_DEFAULT_REGION', 'us-east-1')]:
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        s3 = boto3.resource('s3')
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3.Bucket(BUCKET)
+
+
+def put(bucket, keys):
+    for key in keys:
+        bucket.put_object(Key=key, Body=b'')
+
+
+def frames(camera, start, stop, date='2021-06-01'):
+    return ['frames/{}/{}/{:06d}.jpg'.format(date, camera, i) for i in range(start, stop)]
+
+
+@pytest.mark.parametrize('sorted_keys', [False, True])
+def test_recount_sees_new_keys_of_every_camera(bucket, sorted_keys):
+    #A day-level sibling key next to the date folder, two cameras in it
+    put(bucket, ['frames/2021-06-01.json'] + frames('cam1', 0, 5) + frames('cam2', 0, 5))
+    counter = S3PrefixCounter(bucket, max_workers=4, sorted_keys=sorted_keys)
+    assert counter.count('frames/2021-06-01', manifest_name='2021-06-01') == 11
+
+    #New cam1 frames sort before cam2's last key
+    put(bucket, frames('cam1', 5, 7) + frames('cam2', 5, 6))
+    assert counter.count('frames/2021-06-01', manifest_name='2021-06-01') == 14
+
+
+def test_unsorted_keys_are_counted_without_sorted_keys(bucket):
+    put(bucket, frames('cam1', 10, 20))
+    counter = S3PrefixCounter(bucket)
+    assert counter.count('frames/2021-06-01', manifest_name='2021-06-01') == 10
+    put(bucket, frames('cam1', 0, 3))
+    assert counter.count('frames/2021-06-01', manifest_name='2021-06-01') == 13
+
+
+def test_sorted_keys_recount_only_lists_new_keys(bucket, tmp_path):
+    put(bucket, frames('cam1', 0, 50) + frames('cam2', 0, 50))
+    counter = S3PrefixCounter(bucket, manifest_dir=str(tmp_path), sorted_keys=True)
+    assert counter.count('frames/2021-06-01', manifest_name='2021-06-01') == 100
+    put(bucket, frames('cam2', 50, 53))
+
+    #A new process, the manifest is read back from manifest_dir
+    counter = S3PrefixCounter(bucket, manifest_dir=str(tmp_path), sorted_keys=True)
+    listed = []
+    client = counter.client
+    original = client.get_paginator
+
+    def get_paginator(name):
+        paginator = original(name)
+        paginate = paginator.paginate
+
+        def recording(**kwargs):
+            for page in paginate(**kwargs):
+                listed.extend(obj['Key'] for obj in page.get('Contents', []))
+                yield page
+        paginator.paginate = recording
+        return paginator
+
+    client.get_paginator = get_paginator
+    assert counter.count('frames/2021-06-01', manifest_name='2021-06-01') == 103
+    assert sorted(listed) == frames('cam2', 50, 53)
+
+
+def test_new_sub_folder_of_a_leaf_is_counted(bucket):
+    put(bucket, frames('cam1', 0, 3))
+    counter = S3PrefixCounter(bucket, sorted_keys=True)
+    assert counter.count('frames/2021-06-01/cam1', manifest_name='cam1') == 3
+    put(bucket, ['frames/2021-06-01/cam1/zz/000001.jpg', 'frames/2021-06-01/cam1/zz/000002.jpg'])
+    assert counter.count('frames/2021-06-01/cam1', manifest_name='cam1') == 5
+
+
+def test_folders_below_max_depth_are_counted_in_full(bucket):
+    keys = ['frames/2021-06-01/cam{}/{:02d}/{:06d}.jpg'.format(c, h, i)
+            for c in (1, 2) for h in (0, 1) for i in range(3)]
+    put(bucket, keys)
+    counter = S3PrefixCounter(bucket, max_depth=2, sorted_keys=True)
+    assert counter.count('frames/2021-06-01', manifest_name='d') == 12
+    put(bucket, ['frames/2021-06-01/cam1/00/000100.jpg'])
+    assert counter.count('frames/2021-06-01', manifest_name='d') == 13
+
+
+def test_count_by_date(bucket):
+    put(bucket, frames('cam1', 0, 3, date='2021-05-31') + frames('cam1', 0, 4) + frames('cam2', 0, 2)
+        + frames('cam1', 0, 5, date='2021-06-02') + frames('cam1', 0, 1, date='2021-06-03'))
+    counter = S3PrefixCounter(bucket)
+    counts = counter.count_by_date('frames', '2021-06-01', '2021-06-02', progress=None)
+    assert counts == {'2021-06-01': 6, '2021-06-02': 5}
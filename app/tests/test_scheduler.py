@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from benchmarks import synthetic
+from db.scheduler import PendingDateScheduler
+
+#A scratch postgres database, its data_table is replaced
+POSTGRES_URL = os.environ.get('MLOPS_TEST_POSTGRES_URL')
+postgres_only = pytest.mark.skipif(not POSTGRES_URL, reason='MLOPS_TEST_POSTGRES_URL is not set')
+
+
+@pytest.fixture(params=['sqlite', pytest.param('postgresql', marks=postgres_only)])
+def engine(request, tmp_path):
+    #Ten days pending for three pipelines each
+    data_table = synthetic.make_data_table(30, pipelines=synthetic.PIPELINES[:3], start=synthetic.START_DATE,
+                                           done_ratio=0)
+    if request.param == 'sqlite':
+        url = synthetic.load_tables(synthetic.sqlite_url(str(tmp_path)), data_table)
+    else:
+        url = synthetic.load_tables(POSTGRES_URL, data_table)
+    engine = create_engine(url)
+    yield engine
+    engine.dispose()
+
+
+def claims(engine):
+    with engine.connect() as conn:
+        rows = conn.execute(text('select date_inlet, claimed_by from data_table where claimed_by is not null'))
+        return {(str(day)[:10], worker) for day, worker in rows}
+
+
+def test_pending_dates_are_listed_once(engine):
+    scheduler = PendingDateScheduler(engine)
+    dates = list(scheduler.pending_dates(batch_size=4))
+    assert dates == sorted(set(dates))
+    assert len(dates) == 10
+    assert list(scheduler.pending_dates(limit=3, newest_first=True)) == dates[::-1][:3]
+
+
+def test_claim_returns_k_dates_with_all_their_pipelines(engine):
+    scheduler = PendingDateScheduler(engine)
+    first = scheduler.claim(2, worker='a')
+    assert first == ['2000-01-01', '2000-01-02']
+    assert scheduler.claim(2, worker='b') == ['2000-01-03', '2000-01-04']
+    assert len(claims(engine)) == 4
+
+
+@postgres_only
+def test_concurrent_claims_are_disjoint(engine):
+    if engine.dialect.name != 'postgresql':
+        pytest.skip('sqlite serializes the claims')
+    scheduler = PendingDateScheduler(engine)
+    with ThreadPoolExecutor(4) as pool:
+        claimed = list(pool.map(lambda worker: scheduler.claim(2, worker=worker), 'abcd'))
+    dates = [day for days in claimed for day in days]
+    #Locked dates are skipped, not waited for or lost
+    assert [len(days) for days in claimed] == [2, 2, 2, 2]
+    assert len(dates) == len(set(dates))
+    #Every row of a claimed date went to one worker
+    workers = {}
+    for day, worker in claims(engine):
+        assert workers.setdefault(day, worker) == worker
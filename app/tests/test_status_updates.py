@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from benchmarks import synthetic
+from db.api_db import MLOPs_DB_Connect
+
+DAY = '2000-01-02'
+
+
+@pytest.fixture
+def db(tmp_path):
+    #One row per day for two pipelines, nothing done yet
+    data_table = synthetic.make_data_table(4, pipelines=synthetic.PIPELINES[:2], start=synthetic.START_DATE,
+                                           done_ratio=0)
+    url = synthetic.load_tables(synthetic.sqlite_url(str(tmp_path)), data_table)
+    return MLOPs_DB_Connect(None, None, None, None, None, None, None, engine_url=url, cache_ttl=0)
+
+
+def rows(db):
+    with db.engine.connect() as conn:
+        frame = pd.read_sql_query(text("select model_name, predictions_done, labelstudio_projectid "
+                                       "from data_table where date_inlet = :day"), conn, params={'day': DAY})
+    return frame.set_index('model_name')
+
+
+@pytest.mark.parametrize('write_behind', [False, True])
+def test_status_of_one_pipeline_leaves_the_others(db, write_behind):
+    if write_behind:
+        queue = db.write_behind(max_pending=100, max_delay=60)
+    db.update_inference_end_time(DAY, model_name='moments_pipeline')
+    db.update_annotations_info(DAY, 42, model_name='moments_pipeline')
+    db.update_annotations_info(DAY, 7, model_name='feed_pipeline')
+    if write_behind:
+        assert len(queue) == 2
+        queue.close()
+
+    status = rows(db)
+    assert bool(status.loc['moments_pipeline', 'predictions_done'])
+    assert not bool(status.loc['feed_pipeline', 'predictions_done'])
+    assert str(status.loc['moments_pipeline', 'labelstudio_projectid']) == '42'
+    assert str(status.loc['feed_pipeline', 'labelstudio_projectid']) == '7'
+
+
+def test_status_without_a_pipeline_sets_every_row_of_the_date(db):
+    db.update_inference_end_time(DAY)
+    assert rows(db)['predictions_done'].astype(bool).all()
+
+
+@pytest.mark.parametrize('write_behind', [False, True])
+def test_pipeline_with_a_row_leaves_the_unclaimed_row_of_the_date(db, write_behind):
+    #The date also has a row no pipeline has taken yet, e.g. from the daily count
+    with db.engine.begin() as conn:
+        conn.execute(text("insert into data_table (date_inlet, predictions_done, no_of_frames, "
+                          "model_name, model_version, weights_path) values (:day, false, 3, '', '', '')"),
+                     {'day': DAY})
+    if write_behind:
+        queue = db.write_behind(max_pending=100, max_delay=60)
+    db.update_inference_info(DAY, 'moments_pipeline', 'v2', 'weights/v2')
+    db.update_inference_info(DAY, 'ocr_pipeline', 'v1', 'weights/v1')
+    if write_behind:
+        queue.close()
+
+    with db.engine.connect() as conn:
+        versions = dict(conn.execute(text('select model_name, model_version from data_table '
+                                          'where date_inlet = :day'), {'day': DAY}).fetchall())
+    assert versions['moments_pipeline'] == 'v2'
+    #The pipeline without a row takes the unclaimed one
+    assert versions['ocr_pipeline'] == 'v1'
+    assert sorted(versions) == ['feed_pipeline', 'moments_pipeline', 'ocr_pipeline']
@@ -0,0 +1,34 @@
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from benchmarks import synthetic
+from db.api_db import BOOL_COLUMNS, DATETIME_COLUMNS
+from db.snapshot import compact_frame
+from db.sync import IncrementalTableSync
+
+
+def compact(frame):
+    return compact_frame(frame, datetime_columns=DATETIME_COLUMNS, bool_columns=BOOL_COLUMNS)
+
+
+def test_refresh_merges_the_delta_into_the_compact_frame(tmp_path):
+    data_table = synthetic.make_data_table(8, pipelines=synthetic.PIPELINES[:2], start=synthetic.START_DATE,
+                                           done_ratio=0)
+    engine = create_engine(synthetic.load_tables(synthetic.sqlite_url(str(tmp_path)), data_table))
+    sync = IncrementalTableSync('data_table', lookback=0, full_refresh_every=0, transform=compact)
+    dtypes = sync.refresh(engine).dtypes.astype(str)
+
+    with engine.begin() as conn:
+        #One row changed and one with a pipeline the frame has no category for
+        conn.execute(text("update data_table set predictions_done = true, updated_at = '2100-01-01 00:00:00' "
+                          "where date_inlet = '2000-01-02' and model_name = 'feed_pipeline'"))
+        conn.execute(text("insert into data_table (date_inlet, predictions_done, no_of_frames, no_of_samples, "
+                          "model_name, model_version, weights_path, updated_at) "
+                          "values ('2000-01-02', false, 5, 0, 'ocr_pipeline', 'v1', 'w', '2100-01-01 00:00:00')"))
+    frame = sync.refresh(engine)
+
+    pd.testing.assert_series_equal(frame.dtypes.astype(str), dtypes)
+    expected = compact(pd.read_sql_query('select * from data_table', con=engine))
+    expected = expected.sort_values(by=sync.key_columns).reset_index(drop=True)
+    pd.testing.assert_frame_equal(frame, expected, check_categorical=False)
+    assert 'ocr_pipeline' in frame['model_name'].cat.categories
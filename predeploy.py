@@ -47,7 +47,7 @@ full_app_path = os.path.join("/app", app_file_name + ".py")
 lines = []
 
 # find the line with the conditional used to run
-# the app server; anything after the `app.run_server`
+# the app server; anything after the `app.run`
 # call will not get executed because the app is running
 with open(full_app_path, "r") as f:
     lines = f.readlines()
@@ -58,7 +58,7 @@ with open(full_app_path, "r") as f:
             break
 
     # insert the index_string declaration just above
-    # the run_server conditional
+    # the app.run conditional
     lines.insert(name_main_index, app_index_string)
 
 # if something has gone wrong, don't overwrite